@@ -0,0 +1,241 @@
+"""Time fastapi_migrate commands against a synthetic project.
+
+Builds a throw-away project with ``--tables`` models and ``--revisions``
+revisions spread over ``--branches`` parallel branches (merged back into one
+head), backed by a local SQLite file, then times ``init``, ``migrate``,
+``upgrade``, ``downgrade``, ``heads``, ``history`` and ``current`` through
+``fastapi_migrate.command`` and writes the results as JSON::
+
+    python benchmarks/bench_commands.py --revisions 1500 --tables 200 \\
+        --branches 4 --output before.json
+
+    python benchmarks/bench_commands.py --revisions 1500 --tables 200 \\
+        --branches 4 --output after.json --compare before.json
+
+With ``--compare`` the run exits non-zero when a command got slower than
+``--threshold`` times its median in the earlier results.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+MODELS = '''\
+import sqlalchemy as sa
+from sqlalchemy.orm import declarative_base
+
+from fastapi_migrate import Migrate
+
+try:
+    from fastapi import FastAPI
+    app = FastAPI()
+except ImportError:
+    import types
+    app = types.SimpleNamespace()
+
+Model = declarative_base()
+{models}
+
+migrate = Migrate(app, model=Model, db_uri={db_uri!r},
+                  directory={directory!r})
+'''
+
+MODEL = '''
+class T{i}(Model):
+    __tablename__ = 't{i}'
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String(255))
+'''
+
+REVISION = '''\
+"""synthetic revision {i}
+
+Revision ID: {revision}
+Revises: {down_revision}
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = {revision!r}
+down_revision = {down_revision!r}
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+{upgrade}
+
+
+def downgrade():
+{downgrade}
+'''
+
+
+def _revision_id(i):
+    return 'b%011d' % i
+
+
+def write_revisions(versions, first, count, tables, branches):
+    """Write ``count`` revisions on top of ``first``, spread over
+    ``branches`` branches that a final revision merges back together."""
+    branch_heads = [first] * branches
+    for i in range(count):
+        branch = i % branches
+        table = 't%d' % (i % tables)
+        column = 'c%d' % i
+        revision = _revision_id(i)
+        with open(os.path.join(versions, '%s_.py' % revision), 'w') as f:
+            f.write(REVISION.format(
+                i=i,
+                revision=revision,
+                down_revision=branch_heads[branch],
+                upgrade='    op.add_column(%r, sa.Column(%r, sa.Integer()))'
+                        % (table, column),
+                downgrade='    op.drop_column(%r, %r)' % (table, column),
+            ))
+        branch_heads[branch] = revision
+
+    heads = tuple(sorted(set(branch_heads)))
+    if len(heads) > 1:
+        revision = _revision_id(count)
+        with open(os.path.join(versions, '%s_.py' % revision), 'w') as f:
+            f.write(REVISION.format(
+                i=count, revision=revision, down_revision=heads,
+                upgrade='    pass', downgrade='    pass'))
+
+
+def timed(results, name, repeat, f, *args, **kwargs):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args, **kwargs)
+        runs.append(time.perf_counter() - start)
+    results[name] = {
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+    }
+    print('%-10s median %8.3fs  min %8.3fs' % (
+        name, results[name]['median'], results[name]['min']))
+
+
+def run(args, root):
+    directory = os.path.join(root, 'migrations')
+    db_path = os.path.join(root, 'bench.db')
+    with open(os.path.join(root, 'bench_models.py'), 'w') as f:
+        f.write(MODELS.format(
+            models=''.join(MODEL.format(i=i) for i in range(args.tables)),
+            db_uri='sqlite:///%s' % db_path,
+            directory=directory,
+        ))
+    sys.path.insert(0, root)
+    models = importlib.import_module('bench_models')
+
+    devnull = open(os.devnull, 'w')
+
+    @models.migrate.configure
+    def quiet(config):
+        # alembic prints to the stdout captured when the Config is built
+        config.stdout = devnull
+        return config
+
+    from fastapi_migrate import command
+
+    results = {}
+    timed(results, 'init', 1, command.init)
+    timed(results, 'migrate', 1, command.migrate, message='initial',
+          rev_id='a00000000000')
+    write_revisions(os.path.join(directory, 'versions'), 'a00000000000',
+                    args.revisions, args.tables, args.branches)
+
+    timed(results, 'upgrade', 1, command.upgrade)
+    timed(results, 'heads', args.repeat, command.heads)
+    timed(results, 'history', args.repeat, command.history)
+    timed(results, 'current', args.repeat, command.current)
+    timed(results, 'downgrade', 1, command.downgrade, _revision='base')
+    devnull.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else 0
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-10s %8.3fs -> %8.3fs  x%.2f%s' % (
+            name, before['median'], result['median'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--revisions', type=int, default=200)
+    parser.add_argument('--tables', type=int, default=50)
+    parser.add_argument('--branches', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of each read-only command')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='earlier JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the generated project')
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix='fastapi_migrate_bench_')
+    try:
+        results = run(args, root)
+    finally:
+        if args.keep:
+            print('project kept in %s' % root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    import alembic
+    import sqlalchemy
+
+    import fastapi_migrate
+    report = {
+        'parameters': {
+            'revisions': args.revisions,
+            'tables': args.tables,
+            'branches': args.branches,
+            'repeat': args.repeat,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'alembic': alembic.__version__,
+            'sqlalchemy': sqlalchemy.__version__,
+            'fastapi_migrate': getattr(fastapi_migrate, '__version__', None),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
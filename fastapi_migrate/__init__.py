@@ -1,29 +1,77 @@
-import argparse
 import os
 
-from sqlalchemy.ext.declarative import declarative_base
-from fastapi_migrate.command import Config
+from fastapi_migrate.apps import DEFAULT_NAME
+from fastapi_migrate.apps import get_app  # noqa: F401
+from fastapi_migrate.apps import register
+from fastapi_migrate.apps import use_app  # noqa: F401
+from fastapi_migrate.internal import exclude_tables
+from fastapi_migrate.internal import internal_tables
 
+# alembic and sqlalchemy are imported on first use, not at import time: web
+# workers import Migrate but never run a migration.
+
+# the last application initialised, see fastapi_migrate.apps for the others
 current_app = None
 
 
+def __getattr__(name):
+    # formerly imported here eagerly, still importable from this package
+    if name == 'declarative_base':
+        from sqlalchemy.ext.declarative import declarative_base
+        return declarative_base
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
 class Migrate:
-    def __init__(self, app=None, model=None, directory: str = 'migrations', db_uri: str = None, **kwargs):
+    def __init__(self, app=None, model=None, directory: str = 'migrations', db_uri: str = None,
+                 max_workers: int = None, async_: bool = False, revision_index: bool = True,
+                 reflect_models_only: bool = False, reflection_cache: bool = False,
+                 profile=None, engine=None, online_ddl: bool = False,
+                 batch_coalesce: str = None, sqlite_pragmas: dict = None,
+                 metadata_snapshot: bool = False, run_history=False, name: str = None,
+                 lock_timeout: float = None, statement_timeout: float = None,
+                 lock_retries: int = 3, lock_retry_delay: float = 1.0, **kwargs):
         self.configure_callbacks = []
+        self.tenant_callback = None
         self.model = model
         self.directory = directory
+        self.max_workers = max_workers
+        self.async_ = async_
+        self.revision_index = revision_index
+        self.reflect_models_only = reflect_models_only
+        self.reflection_cache = reflection_cache
+        self.profile = profile
+        self.engine = engine
+        self.online_ddl = online_ddl
+        self.batch_coalesce = batch_coalesce
+        self.sqlite_pragmas = sqlite_pragmas
+        self.metadata_snapshot = metadata_snapshot
+        self.run_history = run_history
+        self.name = name or DEFAULT_NAME
+        self.lock_timeout = lock_timeout
+        self.statement_timeout = statement_timeout
+        self.lock_retries = lock_retries
+        self.lock_retry_delay = lock_retry_delay
         self.alembic_ctx_kwargs = kwargs
+        self._migrate_config = None
+        self._engine = None
+        self._revision_graph = None
         if app is not None and model is not None and db_uri is not None:
             self.init_app(app, model, directory, db_uri)
 
-    def init_app(self, app, model=None, directory: str = None, db_uri: str = None, **kwargs):
+    def init_app(self, app, model=None, directory: str = None, db_uri: str = None,
+                 name: str = None, **kwargs):
         self.model = model or self.model
         self.directory = directory or self.directory
+        self.name = name or self.name
         sqlalchemy_binds = self.alembic_ctx_kwargs.pop("SQLALCHEMY_BINDS", None) or kwargs.pop("SQLALCHEMY_BINDS", {})
         self.alembic_ctx_kwargs.update(kwargs)
         if not hasattr(app, 'extra'):
             app.extra = {}
         app.extra['migrate'] = _MigrateConfig(self, self.model, db_uri, sqlalchemy_binds, **self.alembic_ctx_kwargs)
+        self._migrate_config = app.extra['migrate']
+        self._engine = None
+        register(self.name, app)
         global current_app
         current_app = app
 
@@ -31,16 +79,75 @@ class Migrate:
         self.configure_callbacks.append(f)
         return f
 
+    def tenants(self, f):
+        """Register the callback returning the tenants upgraded by
+        ``db upgrade --tenants``, see ``fastapi_migrate.tenants``."""
+        self.tenant_callback = f
+        return f
+
     def call_configure_callbacks(self, config):
         for f in self.configure_callbacks:
             config = f(config)
         return config
 
-    def get_config(self, directory=None, x_arg=None, opts=None):
+    def status(self, bind=None):
+        """Return the ``MigrationStatus`` (current, heads, pending) of the
+        database, without printing anything.
+
+        The revision scripts are read on the first call, and again once a
+        revision file is added, removed or changed, such as by ``db
+        migrate`` in a ``db serve`` daemon.  The database costs one query,
+        over ``bind`` (an ``Engine`` or ``Connection``), the ``engine``
+        given to ``Migrate``, or else a pooled engine kept by this object.
+        Async applications can pass their own connection with
+        ``await connection.run_sync(migrate.status)``.
+        """
+        from fastapi_migrate.status import RevisionGraph
+        from fastapi_migrate.status import current_revisions
+
+        if self._revision_graph is None or \
+                not self._revision_graph.is_current():
+            self._revision_graph = RevisionGraph.load(self)
+        current = current_revisions(bind or self.get_bind(),
+                                    self._migrate_config.configure_args)
+        return self._revision_graph.status(current)
+
+    def get_bind(self):
+        """Return the ``engine`` given for the primary database, or else a
+        pooled engine for ``db_uri`` kept by this object."""
+        from fastapi_migrate.status import create_engine
+
+        bind = self.engine
+        if isinstance(bind, dict):
+            bind = bind.get('')
+        if bind is None:
+            if self._engine is None:
+                self._engine = create_engine(self._migrate_config)
+            bind = self._engine
+        return bind
+
+    def pending_revisions(self, bind=None):
+        """Return the revisions ``upgrade`` would run, oldest first."""
+        return self.status(bind).pending
+
+    def is_up_to_date(self, bind=None):
+        """Return whether the database is exactly at the script heads."""
+        status = self.status(bind)
+        return set(status.current) == set(status.heads)
+
+    def get_config(self, directory=None, x_arg=None, opts=None, connection=None):
+        import argparse
+
+        from fastapi_migrate.command import Config
+
         if directory is None:
             directory = self.directory
         config = Config(os.path.join(directory, 'alembic.ini'))
         config.set_main_option('script_location', directory)
+        config.revision_index = self.revision_index
+        if connection is not None:
+            # picked up by env.py instead of a new engine
+            config.attributes['connection'] = connection
         if config.cmd_opts is None:
             config.cmd_opts = argparse.Namespace()
         for opt in opts or []:
@@ -65,7 +172,40 @@ class _MigrateConfig(object):
         self.db_uri = db_uri
         self.sqlalchemy_binds = sqlalchemy_binds
         self.directory = migrate.directory
+        self.max_workers = migrate.max_workers
+        self.async_ = migrate.async_
+        self.engine = migrate.engine
         self.configure_args = kwargs
+        if migrate.reflect_models_only or migrate.reflection_cache:
+            from fastapi_migrate.reflection import ReflectionCache
+            from fastapi_migrate.reflection import include_model_names
+        if migrate.reflect_models_only:
+            self.configure_args['include_name'] = include_model_names(
+                model.metadata, kwargs.get('include_name'))
+            self.configure_args.setdefault('include_schemas', True)
+        # hidden from autogenerate like the version table
+        self.configure_args['include_name'] = exclude_tables(
+            internal_tables(migrate), self.configure_args.get('include_name'))
+        if migrate.online_ddl:
+            # see fastapi_migrate.online
+            self.configure_args['online_ddl'] = True
+        if migrate.reflection_cache:
+            self.configure_args['reflection_cache'] = ReflectionCache(
+                self.directory, models_only=migrate.reflect_models_only)
+        # see fastapi_migrate.batch
+        self.configure_args.setdefault('render_as_batch', 'auto')
+        if migrate.batch_coalesce:
+            self.configure_args['batch_coalesce'] = migrate.batch_coalesce
+        if migrate.sqlite_pragmas:
+            self.configure_args['sqlite_pragmas'] = dict(migrate.sqlite_pragmas)
+        if migrate.lock_timeout is not None or migrate.statement_timeout is not None:
+            # see fastapi_migrate.timeouts
+            self.configure_args['lock_timeout'] = migrate.lock_timeout
+            self.configure_args['statement_timeout'] = migrate.statement_timeout
+            self.configure_args['lock_retries'] = migrate.lock_retries
+            self.configure_args['lock_retry_delay'] = migrate.lock_retry_delay
+            # a revision waiting to be retried holds no locks of the previous ones
+            self.configure_args.setdefault('transaction_per_migration', True)
 
     @property
     def metadata(self):
@@ -0,0 +1,43 @@
+import asyncio
+import functools
+import threading
+
+
+def run_async(coro):
+    """Run ``coro`` to completion from synchronous code such as ``env.py``.
+
+    When the calling thread already runs an event loop (a command invoked
+    directly from an ``async def``), the coroutine gets its own loop on a
+    helper thread, because a loop cannot be re-entered.  That still blocks
+    the caller; use :func:`run_in_executor` to keep the loop responsive.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as exc:
+            result['error'] = exc
+
+    thread = threading.Thread(target=target, name='fastapi-migrate')
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+
+async def run_in_executor(f, *args, **kwargs):
+    """Run a ``fastapi_migrate.command`` function without blocking the loop.
+
+    e.g. in the app lifespan::
+
+        await run_in_executor(command.upgrade)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(f, *args, **kwargs))
@@ -0,0 +1,349 @@
+"""Lock and rewrite impact of pending migrations.
+
+``analyze`` renders the pending revisions as offline (``--sql``) SQL, one
+revision at a time, and classifies every statement with the rules of the
+target dialect: the lock it takes, what that lock blocks, and whether it
+only touches the catalog, scans the table or rewrites it.  Row counts read
+from the live database can be added to weigh the findings.
+"""
+import io
+import re
+from collections import namedtuple
+
+import sqlalchemy as sa
+from alembic.runtime.environment import EnvironmentContext
+
+
+Finding = namedtuple('Finding', [
+    'revision', 'engine_name', 'table', 'operation', 'lock', 'blocks',
+    'cost', 'severity', 'rows', 'note', 'statement',
+])
+
+SEVERITIES = ('high', 'medium', 'low')
+
+# findings on tables with fewer rows than this are not reported as high
+SMALL_TABLE_ROWS = 10000
+
+_IDENTIFIER = r'(?:"[^"]+"|`[^`]+`|\[[^\]]+\]|[\w$]+)'
+_TABLE = r'(?P<table>%s(?:\.%s)?)' % (_IDENTIFIER, _IDENTIFIER)
+
+
+def _rule(pattern, operation, lock, blocks, cost, note=None, severity=None):
+    pattern = pattern.replace('TABLE_NAME', _TABLE)
+    return (re.compile(pattern, re.IGNORECASE), operation, lock, blocks,
+            cost, note, severity)
+
+
+_ALTER = r'^ALTER TABLE (?:ONLY )?(?:IF EXISTS )?TABLE_NAME '
+_DML = [
+    _rule(r'^UPDATE TABLE_NAME', 'update', 'ROW EXCLUSIVE', 'none', 'scan',
+          'rows stay locked until the migration commits, see op.backfill'),
+    _rule(r'^DELETE FROM TABLE_NAME', 'delete', 'ROW EXCLUSIVE', 'none',
+          'scan',
+          'rows stay locked until the migration commits, see op.backfill'),
+    _rule(r'^INSERT INTO TABLE_NAME', 'insert', 'ROW EXCLUSIVE', 'none',
+          'scan'),
+]
+
+RULES = {
+    'postgresql': [
+        _rule(r'^CREATE (?:UNIQUE )?INDEX CONCURRENTLY .*? ON (?:ONLY )?'
+              r'TABLE_NAME', 'create index concurrently',
+              'SHARE UPDATE EXCLUSIVE', 'none', 'scan'),
+        _rule(r'^CREATE (?:UNIQUE )?INDEX .*? ON (?:ONLY )?TABLE_NAME',
+              'create index', 'SHARE', 'writes', 'scan',
+              'build it with postgresql_concurrently=True in an '
+              'autocommit_block()'),
+        _rule(r'^DROP INDEX CONCURRENTLY', 'drop index concurrently',
+              'SHARE UPDATE EXCLUSIVE', 'none', 'catalog'),
+        _rule(r'^DROP INDEX', 'drop index', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'catalog'),
+        _rule(r'^CREATE TABLE TABLE_NAME', 'create table', None, 'none',
+              'catalog'),
+        _rule(r'^DROP TABLE TABLE_NAME', 'drop table', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'catalog'),
+        _rule(r'^TRUNCATE (?:TABLE )?TABLE_NAME', 'truncate',
+              'ACCESS EXCLUSIVE', 'reads and writes', 'catalog'),
+        _rule(_ALTER + r'ADD COLUMN .*\bDEFAULT\b.*\b(?:random|'
+              r'gen_random_uuid|uuid_generate_v\d|clock_timestamp|nextval)'
+              r'\s*\(', 'add column with volatile default', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'rewrite'),
+        _rule(_ALTER + r'ADD COLUMN \S+ (?:SMALL|BIG)?SERIAL\b',
+              'add serial column', 'ACCESS EXCLUSIVE', 'reads and writes',
+              'rewrite'),
+        _rule(_ALTER + r'ADD COLUMN (?!.*\bDEFAULT\b).*\bNOT NULL\b',
+              'add NOT NULL column without default', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'catalog',
+              'fails when the table has rows, add a server_default',
+              'high'),
+        _rule(_ALTER + r'ADD COLUMN', 'add column', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'catalog'),
+        _rule(_ALTER + r'ALTER (?:COLUMN )?\S+ (?:SET DATA )?TYPE\b',
+              'change column type', 'ACCESS EXCLUSIVE', 'reads and writes',
+              'rewrite',
+              'most type changes rewrite the table and rebuild its indexes'),
+        _rule(_ALTER + r'ALTER (?:COLUMN )?\S+ SET NOT NULL',
+              'set NOT NULL', 'ACCESS EXCLUSIVE', 'reads and writes', 'scan',
+              'validate a CHECK (column IS NOT NULL) NOT VALID constraint '
+              'first'),
+        _rule(_ALTER + r'ALTER (?:COLUMN )?', 'alter column',
+              'ACCESS EXCLUSIVE', 'reads and writes', 'catalog'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?FOREIGN KEY.*\bNOT VALID',
+              'add foreign key NOT VALID', 'SHARE ROW EXCLUSIVE', 'writes',
+              'catalog'),
+        _rule(_ALTER + r'ADD .*\bNOT VALID', 'add constraint NOT VALID',
+              'ACCESS EXCLUSIVE', 'reads and writes', 'catalog'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?FOREIGN KEY',
+              'add foreign key', 'SHARE ROW EXCLUSIVE', 'writes', 'scan',
+              'add it NOT VALID and VALIDATE CONSTRAINT separately'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?CHECK', 'add check',
+              'ACCESS EXCLUSIVE', 'reads and writes', 'scan',
+              'add it NOT VALID and VALIDATE CONSTRAINT separately'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?(?:UNIQUE|PRIMARY KEY) '
+              r'USING INDEX', 'add constraint using index', 'ACCESS EXCLUSIVE',
+              'reads and writes', 'catalog'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?(?:UNIQUE|PRIMARY KEY)',
+              'add unique constraint', 'ACCESS EXCLUSIVE', 'reads and writes',
+              'scan',
+              'create the unique index CONCURRENTLY, then add the '
+              'constraint USING INDEX'),
+        _rule(_ALTER + r'VALIDATE CONSTRAINT', 'validate constraint',
+              'SHARE UPDATE EXCLUSIVE', 'none', 'scan'),
+        _rule(_ALTER, 'alter table', 'ACCESS EXCLUSIVE', 'reads and writes',
+              'catalog'),
+    ] + _DML,
+    'mysql': [
+        _rule(r'^CREATE TABLE TABLE_NAME', 'create table', None, 'none',
+              'catalog'),
+        _rule(r'^DROP TABLE TABLE_NAME', 'drop table', 'metadata lock',
+              'reads and writes', 'catalog'),
+        _rule(r'^CREATE (?:FULLTEXT|SPATIAL) INDEX .*? ON TABLE_NAME',
+              'create fulltext index', 'INPLACE, LOCK=SHARED', 'writes',
+              'scan'),
+        _rule(r'^CREATE (?:UNIQUE )?INDEX .*? ON TABLE_NAME', 'create index',
+              'INPLACE, LOCK=NONE', 'none', 'scan'),
+        _rule(r'^DROP INDEX \S+ ON TABLE_NAME', 'drop index',
+              'INPLACE, LOCK=NONE', 'none', 'catalog'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?FOREIGN KEY',
+              'add foreign key', 'COPY, LOCK=SHARED', 'writes', 'rewrite',
+              'only INPLACE with foreign_key_checks=0'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?PRIMARY KEY',
+              'add primary key', 'INPLACE, LOCK=NONE', 'none', 'rewrite'),
+        _rule(_ALTER + r'ADD (?:CONSTRAINT \S+ )?(?:UNIQUE|INDEX|KEY)',
+              'add index', 'INPLACE, LOCK=NONE', 'none', 'scan'),
+        _rule(_ALTER + r'ADD COLUMN ', 'add column', 'INSTANT', 'none',
+              'catalog', 'rebuilds the table (INPLACE) before MySQL 8.0'),
+        _rule(_ALTER + r'(?:MODIFY|CHANGE) ', 'change column',
+              'COPY, LOCK=SHARED', 'writes', 'rewrite',
+              'type changes copy the table'),
+        _rule(_ALTER + r'DROP COLUMN ', 'drop column', 'INPLACE, LOCK=NONE',
+              'none', 'rewrite'),
+        _rule(_ALTER, 'alter table', 'INPLACE, LOCK=NONE', 'none',
+              'catalog'),
+    ] + _DML,
+    'sqlite': [
+        # batch mode ("move and copy") rebuilds through a temporary table
+        _rule(r'^CREATE TABLE _alembic_tmp_TABLE_NAME', 'rebuild table',
+              'database write lock', 'writes', 'rewrite'),
+        _rule(r'^INSERT INTO _alembic_tmp_TABLE_NAME', 'copy rows',
+              'database write lock', 'writes', 'rewrite'),
+        _rule(r'^CREATE TABLE TABLE_NAME', 'create table',
+              'database write lock', 'writes', 'catalog'),
+        _rule(r'^CREATE (?:UNIQUE )?INDEX .*? ON TABLE_NAME', 'create index',
+              'database write lock', 'writes', 'scan'),
+        _rule(r'^(?:UPDATE|DELETE FROM|INSERT INTO) TABLE_NAME',
+              'data change', 'database write lock', 'writes', 'scan'),
+        _rule(r'^(?:ALTER|DROP) TABLE TABLE_NAME', 'alter table',
+              'database write lock', 'writes', 'catalog'),
+    ],
+}
+RULES['mariadb'] = RULES['mysql']
+
+_BLOCKING = {'reads and writes': 0, 'writes': 1, 'none': 2}
+
+
+def _strip_quotes(name):
+    return '.'.join(part.strip('"`[]') for part in
+                    re.findall(_IDENTIFIER, name))
+
+
+def _severity(blocks, cost):
+    if blocks != 'none' and cost in ('scan', 'rewrite'):
+        return 'high'
+    if blocks == 'reads and writes' or cost in ('scan', 'rewrite'):
+        return 'medium'
+    return 'low'
+
+
+def classify(dialect_name, statement):
+    """Return ``(table, operation, lock, blocks, cost, note, severity)``
+    for one SQL statement."""
+    for pattern, operation, lock, blocks, cost, note, severity in \
+            RULES.get(dialect_name, ()):
+        m = pattern.search(statement)
+        if m is None:
+            continue
+        table = m.groupdict().get('table')
+        if table is not None:
+            table = _strip_quotes(table)
+        return (table, operation, lock, blocks, cost, note,
+                severity or _severity(blocks, cost))
+    return (None, 'unknown', None, 'unknown', 'unknown',
+            'no rule for this statement on %s' % dialect_name, 'medium')
+
+
+def _normalize(text):
+    statement = ' '.join(text.split()).rstrip(';').strip()
+    if not statement or statement.startswith('--') or \
+            statement.upper() in ('BEGIN', 'COMMIT'):
+        return None
+    return statement
+
+
+def capture(config, script, starting_rev, destination_rev='heads'):
+    """Render the revisions after ``starting_rev`` offline and return
+    ``(dialect_name, revision, engine_name, statement)`` tuples."""
+    captured = []
+
+    def capture_step(step, context):
+        migration_fn = step.migration_fn
+        impl = context.impl
+
+        def run(**kw):
+            statements = []
+            static_output = impl.static_output
+            impl.static_output = statements.append
+            error = None
+            try:
+                migration_fn(**kw)
+            except Exception as exc:
+                # report it and carry on with the next revision
+                error = exc
+            finally:
+                impl.static_output = static_output
+            revision = step.revision.revision
+            engine_name = kw.get('engine_name', '')
+            for text in statements:
+                statement = _normalize(text)
+                if statement is not None:
+                    captured.append((context.dialect.name, revision,
+                                     engine_name, statement))
+            if error is not None:
+                captured.append((context.dialect.name, revision, engine_name,
+                                 error))
+        run.__name__ = migration_fn.__name__
+        return run
+
+    def fn(rev, context):
+        for step in script._upgrade_revs(destination_rev, rev):
+            step.migration_fn = capture_step(step, context)
+            yield step
+
+    # the version table statements are rendered too, swallow them
+    config.output_buffer = io.StringIO()
+    with EnvironmentContext(
+        config,
+        script,
+        fn=fn,
+        as_sql=True,
+        starting_rev=starting_rev or 'base',
+        destination_rev=destination_rev,
+    ):
+        script.run_env()
+    return captured
+
+
+def row_count(connection, table):
+    """Return an estimate of the rows in ``table``, or ``None``."""
+    schema, _, name = table.rpartition('.')
+    dialect_name = connection.dialect.name
+    try:
+        if dialect_name == 'postgresql':
+            rows = connection.execute(
+                sa.text('SELECT reltuples FROM pg_class '
+                        'WHERE oid = to_regclass(:name)'),
+                {'name': table}).scalar()
+            # -1 (or 0 on old servers) until the table was analyzed
+            return int(rows) if rows is not None and rows >= 0 else None
+        if dialect_name in ('mysql', 'mariadb'):
+            return connection.execute(
+                sa.text('SELECT table_rows FROM information_schema.tables '
+                        'WHERE table_schema = COALESCE(:schema, DATABASE()) '
+                        'AND table_name = :name'),
+                {'schema': schema or None, 'name': name}).scalar()
+        return connection.execute(sa.select(sa.func.count()).select_from(
+            sa.table(name, schema=schema or None))).scalar()
+    except sa.exc.DBAPIError:
+        if connection.in_transaction():
+            connection.rollback()
+        return None
+
+
+def analyze(config, script, starting_rev, destination_rev='heads',
+            connection=None, small_table_rows=SMALL_TABLE_ROWS):
+    """Return the ``Finding`` of every statement the pending revisions run,
+    most severe first.
+
+    With a ``connection``, findings carry the row count of their table, and
+    scans and rewrites of tables under ``small_table_rows`` rows are not
+    reported as high.
+    """
+    findings = []
+    rows = {}
+    for dialect_name, revision, engine_name, statement in capture(
+            config, script, starting_rev, destination_rev):
+        if isinstance(statement, Exception):
+            findings.append(Finding(
+                revision, engine_name, None, 'not rendered', None, 'unknown',
+                'unknown', 'medium', None,
+                'could not render offline: %s' % statement, None))
+            continue
+        table, operation, lock, blocks, cost, note, severity = \
+            classify(dialect_name, statement)
+        table_rows = None
+        if connection is not None and table is not None and \
+                operation not in ('create table', 'rebuild table'):
+            if table not in rows:
+                rows[table] = row_count(connection, table)
+            table_rows = rows[table]
+        if severity == 'high' and table_rows is not None and \
+                table_rows < small_table_rows and cost != 'catalog':
+            severity = 'medium'
+        findings.append(Finding(
+            revision, engine_name, table, operation, lock, blocks, cost,
+            severity, table_rows, note, statement))
+
+    # stable, so revisions keep their upgrade order within a severity
+    findings.sort(key=lambda finding: (
+        SEVERITIES.index(finding.severity),
+        _BLOCKING.get(finding.blocks, 0),
+        -(finding.rows or 0),
+    ))
+    return findings
+
+
+def format_finding(finding):
+    lines = ['%-6s %s%s %s%s%s' % (
+        finding.severity.upper(),
+        finding.revision,
+        ' [%s]' % finding.engine_name if finding.engine_name else '',
+        finding.operation,
+        ' on %s' % finding.table if finding.table else '',
+        ' (%s rows)' % finding.rows if finding.rows is not None else '',
+    )]
+    details = []
+    if finding.lock:
+        details.append('lock: %s' % finding.lock)
+    details.append('blocks %s' % finding.blocks)
+    details.append({'catalog': 'catalog only', 'scan': 'scans the table',
+                    'rewrite': 'rewrites the table'}.get(finding.cost,
+                                                         'cost unknown'))
+    lines.append('       ' + ', '.join(details))
+    if finding.note:
+        lines.append('       ' + finding.note)
+    if finding.statement:
+        statement = finding.statement
+        if len(statement) > 120:
+            statement = statement[:117] + '...'
+        lines.append('       ' + statement)
+    return '\n'.join(lines)
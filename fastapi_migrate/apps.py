@@ -0,0 +1,167 @@
+"""Several applications migrated from one process.
+
+Every ``Migrate`` registers its application under a name, ``'default'``
+unless given::
+
+    Migrate(billing_app, BillingModel, db_uri=..., name='billing')
+    Migrate(users_app, UsersModel, db_uri=..., name='users')
+
+The commands, and env.py through ``current_app()``, work on the
+application of the current context: the one passed as the ``app`` argument
+of a command (an application or its name), else the one made current with
+``use_app()``, else the last one initialised.  The current application is
+kept in a ``contextvars.ContextVar``, so threads and asyncio tasks each
+have their own.
+
+``run_each()`` runs a command for several applications, one after the
+other or on forked worker processes: alembic's ``context`` and ``op``
+proxies are module globals, so two migrations cannot run on threads of the
+same process.
+"""
+import contextvars
+import os
+import time
+
+
+DEFAULT_NAME = 'default'
+
+_apps = {}
+_current = contextvars.ContextVar('fastapi_migrate_app', default=None)
+
+
+def register(name, app):
+    """Register ``app`` under ``name``, replacing any application of that
+    name."""
+    _apps[name] = app
+
+
+def registered():
+    """Return the names of the registered applications."""
+    return list(_apps)
+
+
+def _resolve(app):
+    if isinstance(app, str):
+        try:
+            return _apps[app]
+        except KeyError:
+            raise RuntimeError('No application registered as %r, known: %s'
+                               % (app, ', '.join(sorted(_apps)) or 'none'))
+    return app
+
+
+def get_app(app=None):
+    """Return ``app``, an application or the name of a registered one, or
+    else the current application."""
+    if app is not None:
+        return _resolve(app)
+    app = _current.get()
+    if app is not None:
+        return app
+    import fastapi_migrate
+    return fastapi_migrate.current_app
+
+
+class use_app(object):
+    """Make ``app``, an application or its name, current for the block;
+    ``None`` leaves the current application as it is."""
+
+    # a class rather than contextlib.contextmanager, which is slow to
+    # import on startup
+    def __init__(self, app):
+        self.app = app
+        self.token = None
+
+    def __enter__(self):
+        if self.app is None:
+            return get_app()
+        app = _resolve(self.app)
+        self.token = _current.set(app)
+        return app
+
+    def __exit__(self, *exc_info):
+        if self.token is not None:
+            _current.reset(self.token)
+            self.token = None
+
+
+def set_app(app):
+    """Make ``app`` current for the rest of the context and return the
+    token that restores the previous one with ``reset_app``."""
+    return _current.set(_resolve(app))
+
+
+def reset_app(token):
+    _current.reset(token)
+
+
+def __getattr__(name):
+    # built on first use, collections is not imported on startup
+    if name == 'AppResult':
+        from collections import namedtuple
+
+        global AppResult
+        AppResult = namedtuple('AppResult', ['name', 'elapsed', 'error'])
+        return AppResult
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def _run(name, command_name, kwargs):
+    from fastapi_migrate import command
+    from fastapi_migrate.apps import AppResult
+
+    start = time.perf_counter()
+    try:
+        getattr(command, command_name)(app=name, **kwargs)
+    except SystemExit as exc:
+        if exc.code:
+            # the error is logged by the command
+            return AppResult(name, time.perf_counter() - start,
+                             'exit status %s' % exc.code)
+    except Exception as exc:
+        return AppResult(name, time.perf_counter() - start,
+                         '%s: %s' % (type(exc).__name__, exc))
+    return AppResult(name, time.perf_counter() - start, None)
+
+
+def run_each(command_name, names=None, concurrency=1, **kwargs):
+    """Run the ``fastapi_migrate.command`` function ``command_name``, such as
+    ``'upgrade'`` or ``'check'``, for every application in ``names`` (all the
+    registered ones by default) and return an ``AppResult`` per
+    application.
+
+    A failed application does not stop the others.  With ``concurrency``
+    above 1 the applications run on that many forked processes, in the
+    order they finish.
+    """
+    # imported here, fastapi_migrate imports this module on startup
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures import as_completed
+
+    from fastapi_migrate.apps import AppResult
+
+    names = registered() if names is None else list(names)
+    for name in names:
+        _resolve(name)
+    if concurrency <= 1 or len(names) <= 1:
+        return [_run(name, command_name, kwargs) for name in names]
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise RuntimeError('Running applications concurrently needs the '
+                           'fork start method')
+    results = []
+    executor = ProcessPoolExecutor(
+        max_workers=min(concurrency or os.cpu_count() or 1, len(names)),
+        mp_context=multiprocessing.get_context('fork'))
+    with executor:
+        futures = dict((executor.submit(_run, name, command_name, kwargs),
+                        name) for name in names)
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                # the worker process died
+                results.append(AppResult(futures[future], None,
+                                         '%s: %s' % (type(exc).__name__,
+                                                     exc)))
+    return results
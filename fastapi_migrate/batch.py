@@ -0,0 +1,249 @@
+"""Batch mode on SQLite, with each table rebuilt at most once.
+
+SQLite can only add columns with ``ALTER TABLE``; anything else goes
+through alembic's batch mode, which copies the table.  Unless
+``render_as_batch`` is given to ``Migrate``, autogenerate renders batch
+operations for SQLite databases and plain ones for the others.
+
+With ``batch_coalesce='revision'``, when a revision, or the whole upgrade
+with ``'run'``, alters the same table in several batches, the batches are
+held back and applied together, so that the table is copied once.  Held
+back batches are applied before any other statement runs on the
+connection, so operations and data migrations in between see the schema
+they expect.  With ``'run'`` the pending revisions run in a single
+transaction.  Batches are applied as they come by default.
+
+``sqlite_pragmas``, such as ``{'journal_mode': 'MEMORY', 'synchronous':
+'OFF'}``, are set for the length of the upgrade and then restored.
+"""
+import logging
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import wraps
+
+from sqlalchemy import event
+from alembic.operations.batch import BatchOperationsImpl
+from alembic.runtime.migration import MigrationContext
+
+
+log = logging.getLogger(__name__)
+
+
+class Coalescer(object):
+    """Holds back the batches of a migration context, one per table."""
+
+    def __init__(self, context, run=False):
+        self.context = context
+        self.run = run
+        # with run, stamping a revision does not apply the held back
+        # batches: the whole run is one transaction
+        self.bookkeeping = set([context._version]) if run else set()
+        self.pending = OrderedDict()
+        self.flushing = False
+        self.rebuilds = 0
+
+    def defer(self, batch):
+        """Hold ``batch`` back; return ``False`` when it has to be
+        applied now."""
+        if self.flushing:
+            return False
+        if batch.copy_from is not None or batch.partial_reordering:
+            self.flush()
+            return False
+        key = (batch.schema, batch.table_name)
+        pending = self.pending.get(key)
+        if pending is None:
+            self.pending[key] = batch
+        elif _compatible(pending, batch):
+            pending.batch.extend(batch.batch)
+        else:
+            self.flush()
+            self.pending[key] = batch
+        return True
+
+    def flush(self):
+        if self.flushing:
+            return
+        self.flushing = True
+        try:
+            while self.pending:
+                _, batch = self.pending.popitem(last=False)
+                if batch._should_recreate():
+                    self.rebuilds += 1
+                _flush(batch)
+        finally:
+            self.flushing = False
+
+    def end_step(self):
+        """Apply the batches of a revision that just ran, unless they are
+        held back for the whole run."""
+        if not self.run:
+            self.flush()
+
+    def discard(self):
+        self.pending.clear()
+
+    def before_execute(self, conn, clauseelement, multiparams, params,
+                       execution_options):
+        if not self.pending or self.flushing:
+            return
+        if getattr(clauseelement, 'table', None) in self.bookkeeping:
+            return
+        self.flush()
+
+
+def _added_columns(batch):
+    return set(arg[1].name for opname, arg, kw in batch.batch
+               if opname == 'add_column')
+
+
+def _compatible(batch, other):
+    """Whether the operations of ``other`` can be applied by ``batch``."""
+    if any(opname == 'rename_table' for opname, arg, kw in batch.batch):
+        return False
+    # the copy of the table cannot drop a column it adds
+    added = _added_columns(batch)
+    if any(opname == 'drop_column' and arg[1].name in added
+           for opname, arg, kw in other.batch):
+        return False
+    return (batch.recreate == other.recreate and
+            batch.table_args == other.table_args and
+            batch.table_kwargs == other.table_kwargs and
+            batch.reflect_args == other.reflect_args and
+            batch.naming_convention == other.naming_convention)
+
+
+def _dbapi_connection(connection):
+    fairy = connection.connection
+    # SQLAlchemy 1.4 names it connection
+    return getattr(fairy, 'dbapi_connection', None) or fairy.connection
+
+
+def set_pragmas(connection, pragmas):
+    """Set the SQLite ``pragmas`` and return their previous values."""
+    if getattr(_dbapi_connection(connection), 'in_transaction', False):
+        # journal_mode and synchronous cannot change in a transaction
+        log.warning('Not setting SQLite pragmas inside a transaction')
+        return {}
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = connection.exec_driver_sql(
+            'PRAGMA %s' % name).scalar()
+        connection.exec_driver_sql('PRAGMA %s = %s' % (name, value))
+    return previous
+
+
+class CoalescedSteps(object):
+    """Wraps an ``EnvironmentContext`` ``fn`` so that the steps it returns
+    hold back their batches."""
+
+    def __init__(self, fn, opts):
+        self.fn = fn
+        self.coalesce = opts.get('batch_coalesce')
+        self.pragmas = opts.get('sqlite_pragmas')
+        self.generators = []
+
+    def __call__(self, rev, context):
+        generator = self.steps(rev, context)
+        self.generators.append(generator)
+        return generator
+
+    def close(self):
+        # a failed step leaves its generator suspended, clean up while the
+        # connection is still open
+        for generator in self.generators:
+            generator.close()
+
+    def steps(self, rev, context):
+        steps = iter(self.fn(rev, context))
+        step = next(steps, None)
+        if step is None:
+            # nothing to run, e.g. autogenerate
+            return
+        run = self.coalesce == 'run'
+        connection = context.connection
+        coalescer = None
+        if self.coalesce:
+            coalescer = Coalescer(context, run=run)
+            context.impl.batch_coalescer = coalescer
+            event.listen(connection, 'before_execute',
+                         coalescer.before_execute)
+        previous = set_pragmas(connection, self.pragmas) if self.pragmas \
+            else {}
+        transaction = context.begin_transaction(_per_migration=True) if run \
+            else nullcontext()
+        try:
+            with transaction:
+                while step is not None:
+                    if coalescer is not None:
+                        step.migration_fn = _flushed(step.migration_fn,
+                                                     coalescer)
+                    yield step
+                    step = next(steps, None)
+                if coalescer is not None:
+                    coalescer.flush()
+        except BaseException:
+            if coalescer is not None:
+                coalescer.discard()
+            raise
+        finally:
+            if coalescer is not None:
+                event.remove(connection, 'before_execute',
+                             coalescer.before_execute)
+                del context.impl.batch_coalescer
+                if coalescer.rebuilds:
+                    log.info('Rebuilt %d tables', coalescer.rebuilds)
+            if previous:
+                set_pragmas(connection, previous)
+
+
+def _flushed(migration_fn, coalescer):
+    # alembic logs steps by the name of their function
+    @wraps(migration_fn)
+    def step(**kw):
+        try:
+            migration_fn(**kw)
+        except BaseException:
+            coalescer.discard()
+            raise
+        coalescer.end_step()
+    return step
+
+
+def _run_migrations(run_migrations):
+    def wrapped(self, **kw):
+        if self.opts.get('render_as_batch') == 'auto':
+            # opts is shared by the contexts of every database
+            self.opts = dict(self.opts,
+                             render_as_batch=self.dialect.name == 'sqlite')
+        fn = self._migrations_fn
+        if self.as_sql or self.dialect.name != 'sqlite' or not (
+                self.opts.get('batch_coalesce') or
+                self.opts.get('sqlite_pragmas')):
+            return run_migrations(self, **kw)
+        steps = CoalescedSteps(fn, self.opts)
+        self._migrations_fn = steps
+        try:
+            return run_migrations(self, **kw)
+        finally:
+            self._migrations_fn = fn
+            steps.close()
+    wrapped._coalesce_batches = True
+    return wrapped
+
+
+_flush = BatchOperationsImpl.flush
+
+
+def _deferred_flush(self):
+    coalescer = getattr(self.impl, 'batch_coalescer', None)
+    if coalescer is None or not coalescer.defer(self):
+        _flush(self)
+
+
+def install():
+    if not getattr(MigrationContext.run_migrations, '_coalesce_batches',
+                   False):
+        MigrationContext.run_migrations = _run_migrations(
+            MigrationContext.run_migrations)
+        BatchOperationsImpl.flush = _deferred_flush
@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import MetaData
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+BindResult = namedtuple('BindResult', ['name', 'elapsed', 'error'])
+
+
+def bind_names(migrate_config):
+    """Return the primary database ('') followed by every configured bind."""
+    return [''] + list(migrate_config.sqlalchemy_binds or {})
+
+
+def bind_uri(migrate_config, name):
+    if not name:
+        return migrate_config.db_uri
+    return migrate_config.sqlalchemy_binds[name]
+
+
+def bind_connectable(config, migrate_config, name):
+    """Return the Engine or Connection given for database ``name``, if any.
+
+    It comes from the ``connection`` attribute of the alembic config, else
+    from ``Migrate(engine=...)``; either is a single Engine or Connection
+    for the primary database, or a dict of them keyed by bind name.
+    """
+    connectable = config.attributes.get('connection', migrate_config.engine)
+    if isinstance(connectable, dict):
+        return connectable.get(name)
+    if name:
+        return None
+    return connectable
+
+
+def bind_metadata(metadata, name):
+    """Return a MetaData holding only the tables that target ``name``.
+
+    Tables choose their database through ``info['bind_key']``, e.g.
+    ``__table_args__ = {'info': {'bind_key': 'users'}}``; tables without a
+    bind key belong to the primary database.
+    """
+    if metadata is None:
+        return None
+    subset = MetaData()
+    for table in metadata.tables.values():
+        if (table.info.get('bind_key') or '') != name:
+            continue
+        if hasattr(table, 'to_metadata'):
+            table.to_metadata(subset)
+        else:
+            table.tometadata(subset)
+    return subset
+
+
+class _ThreadLocalOperations(object):
+    """Stand-in for the ``alembic.op`` proxy that dispatches per thread.
+
+    Alembic installs the object behind ``alembic.op`` as a module global, so
+    two revisions running at once on different threads would otherwise send
+    their operations to whichever migration context was installed last.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        operations = getattr(self._local, 'operations', None)
+        if operations is None:
+            raise NameError(
+                "No migration context is active for this thread")
+        return getattr(operations, name)
+
+
+_thread_local_operations = _ThreadLocalOperations()
+_install_lock = threading.Lock()
+_install_count = 0
+_saved_proxies = []
+
+
+def _install_thread_local_operations():
+    from alembic.operations import Operations
+
+    global _install_count
+    with _install_lock:
+        if _install_count == 0:
+            _attr_names, modules = Operations._setups[Operations]
+            for globals_, _locals in modules:
+                _saved_proxies.append((globals_, globals_.get('_proxy')))
+                globals_['_proxy'] = _thread_local_operations
+        _install_count += 1
+
+
+def _remove_thread_local_operations():
+    global _install_count
+    with _install_lock:
+        _install_count -= 1
+        if _install_count == 0:
+            while _saved_proxies:
+                globals_, proxy = _saved_proxies.pop()
+                globals_['_proxy'] = proxy
+
+
+@contextmanager
+def operations(migration_context):
+    """Bind ``alembic.op`` to ``migration_context`` for the current thread."""
+    from alembic.operations import Operations
+
+    _install_thread_local_operations()
+    _thread_local_operations._local.operations = Operations(migration_context)
+    try:
+        yield
+    finally:
+        _thread_local_operations._local.operations = None
+        _remove_thread_local_operations()
+
+
+_current_bind = threading.local()
+_print_lock = threading.Lock()
+
+
+def label_output(config):
+    """Make ``config.print_stdout`` thread safe and prefix it with the bind.
+
+    Commands such as ``current`` print from inside the migration context, so
+    without this the output of concurrently running binds interleaves.
+    """
+    print_stdout = config.print_stdout
+
+    def labelled_print_stdout(text, *arg):
+        name = getattr(_current_bind, 'name', None)
+        if name is not None:
+            text = '%s: %s' % (name or '<primary>', text)
+        with _print_lock:
+            print_stdout(text, *arg)
+    config.print_stdout = labelled_print_stdout
+
+
+def run_binds(fn, names, max_workers=None, logger=None):
+    """Call ``fn(name)`` for every bind on a bounded thread pool.
+
+    Every bind is attempted even when another one fails; the status of each
+    bind is logged on its own and a ``RuntimeError`` naming the failed binds
+    is raised once all of them have finished.
+    """
+    logger = logger or log
+
+    def run(name):
+        label = name or '<primary>'
+        logger.info('Migrating database %s', label)
+        start = time.perf_counter()
+        _current_bind.name = name
+        try:
+            fn(name)
+        except Exception as exc:
+            elapsed = time.perf_counter() - start
+            logger.error('Database %s failed after %.2fs: %s', label, elapsed, exc)
+            return BindResult(name, elapsed, exc)
+        finally:
+            _current_bind.name = None
+        elapsed = time.perf_counter() - start
+        logger.info('Database %s done in %.2fs', label, elapsed)
+        return BindResult(name, elapsed, None)
+
+    names = list(names)
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    max_workers = max(1, min(max_workers, len(names) or 1))
+    if max_workers == 1:
+        results = [run(name) for name in names]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run, names))
+
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        raise RuntimeError('Migration failed for database(s): ' + ', '.join(
+            '%s (%s)' % (result.name or '<primary>', result.error)
+            for result in failed))
+    return results
@@ -0,0 +1,190 @@
+"""Squashed baselines and fast bootstrap of empty databases.
+
+``squash`` appends a ``create_schema()`` rendered from the model metadata to
+a new head revision and marks it ``baseline = True``.  An empty database
+upgraded with ``fast_bootstrap=True`` then runs that single function, plus
+the baseline's ``bootstrap_data()``, instead of replaying every revision up
+to the baseline; revisions added after the baseline still run normally.
+"""
+import sqlalchemy as sa
+from alembic import util
+from alembic.autogenerate import compare_metadata
+from alembic.autogenerate import render_python_code
+from alembic.operations import ops
+from alembic.runtime.environment import EnvironmentContext
+from alembic.runtime.migration import RevisionStep
+
+from fastapi_migrate.binds import bind_metadata
+from fastapi_migrate.binds import bind_names
+
+
+class BootstrapStep(RevisionStep):
+    """Upgrade step to a baseline that builds the schema in one go."""
+
+    def __init__(self, revision_map, revision):
+        super(BootstrapStep, self).__init__(revision_map, revision, True)
+        module = revision.module
+
+        def bootstrap(**kw):
+            module.create_schema(**kw)
+            module.bootstrap_data(**kw)
+        self.migration_fn = bootstrap
+
+
+def _script_directory(config):
+    # go through alembic.command so the revision index is honoured
+    from alembic import command
+
+    return command.ScriptDirectory.from_config(config)
+
+
+def _render_schema(metadata):
+    tables = metadata.sorted_tables
+    upgrade_ops = ops.UpgradeOps(ops=[
+        ops.CreateTableOp.from_table(table) for table in tables
+    ] + [
+        ops.CreateIndexOp.from_index(index)
+        for table in tables
+        for index in sorted(table.indexes, key=lambda index: index.name or '')
+    ])
+    if upgrade_ops.is_empty():
+        return 'pass'
+    return render_python_code(upgrade_ops)
+
+
+def _render_baseline(migrate_config):
+    names = bind_names(migrate_config)
+    lines = [
+        '',
+        '',
+        '# squashed baseline, see `db squash` and `db upgrade --fast-bootstrap`',
+        'baseline = True',
+    ]
+    if len(names) == 1:
+        lines += [
+            '',
+            '',
+            "def create_schema(engine_name=''):",
+            '    ' + _render_schema(migrate_config.metadata),
+        ]
+    else:
+        lines += [
+            '',
+            '',
+            "def create_schema(engine_name=''):",
+            '    globals()["create_schema_%s" % engine_name]()',
+        ]
+        for name in names:
+            lines += [
+                '',
+                '',
+                'def create_schema_%s():' % name,
+                '    ' + _render_schema(
+                    bind_metadata(migrate_config.metadata, name)),
+            ]
+    lines += [
+        '',
+        '',
+        "def bootstrap_data(engine_name=''):",
+        '    """Data steps run by --fast-bootstrap after create_schema().',
+        '',
+        '    Add anything a fresh database needs that the squashed revisions',
+        '    used to insert, such as lookup rows.',
+        '    """',
+        '    pass',
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def squash(config, migrate_config, message=None, head='head', rev_id=None):
+    """Write a baseline revision on top of ``head`` from the model metadata.
+
+    The models must match ``head``: run it when ``migrate`` reports no
+    changes.
+    """
+    script = _script_directory(config)
+    script_ = script.generate_revision(
+        rev_id or util.rev_id(), message or 'squashed baseline', head=head)
+    with open(script_.path, 'a', encoding=script.output_encoding) as f:
+        f.write(_render_baseline(migrate_config))
+    return script_
+
+
+def _find_baseline(script, destination):
+    for revision in script.iterate_revisions(destination, 'base'):
+        if getattr(revision.module, 'baseline', False):
+            return revision
+    return None
+
+
+def _is_empty(context, ignored=()):
+    """Whether the database has no tables but the version table and
+    ``ignored``."""
+    if context.as_sql:
+        return True
+    table_names = sa.inspect(context.connection).get_table_names()
+    return not [name for name in table_names
+                if name != context.version_table and name not in ignored]
+
+
+def upgrade(config, revision='head', sql=False, tag=None, verify=True,
+            profiler=None, expand_only=False, ignored_tables=()):
+    """Like ``alembic.command.upgrade``, but bootstraps empty databases
+    from the newest baseline below ``revision``.
+
+    Databases that were bootstrapped are then compared with the model
+    metadata, the same comparison autogenerate makes after a full replay,
+    and a ``CommandError`` lists any difference.  ``profiler`` is an
+    optional ``fastapi_migrate.profiling.Profiler``; ``expand_only`` stops
+    before the first contract revision, see ``fastapi_migrate.phases``.
+    ``ignored_tables`` do not count against an empty database, such as the
+    run history table the profiler creates first.
+    """
+    script = _script_directory(config)
+    bootstrapped = set()
+
+    def bootstrap_upgrade(rev, context):
+        if rev or not _is_empty(context, ignored_tables):
+            return script._upgrade_revs(revision, rev)
+        baseline = _find_baseline(script, revision)
+        if baseline is None:
+            return script._upgrade_revs(revision, rev)
+        bootstrapped.add(context.opts.get('upgrade_token'))
+        return [BootstrapStep(script.revision_map, baseline)] + \
+            script._upgrade_revs(revision, baseline.revision)
+
+    if expand_only:
+        from fastapi_migrate.phases import expand_only as _expand_only
+        bootstrap_upgrade = _expand_only(bootstrap_upgrade)
+    if profiler is not None:
+        bootstrap_upgrade = profiler.wrap(bootstrap_upgrade)
+
+    with EnvironmentContext(
+        config,
+        script,
+        fn=bootstrap_upgrade,
+        as_sql=sql,
+        starting_rev=None,
+        destination_rev=revision,
+        tag=tag,
+    ):
+        script.run_env()
+
+    if not verify or sql or not bootstrapped:
+        return
+
+    differences = []
+
+    def compare(rev, context):
+        if context.opts.get('upgrade_token') in bootstrapped:
+            differences.extend(compare_metadata(
+                context, context.opts['target_metadata']))
+        return []
+
+    with EnvironmentContext(config, script, fn=compare, dont_mutate=True):
+        script.run_env()
+    if differences:
+        raise util.CommandError(
+            'Bootstrapped schema does not match the models: %s'
+            % differences)
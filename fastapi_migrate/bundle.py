@@ -0,0 +1,158 @@
+"""Precompiled revision bundle for deployments.
+
+``db bundle`` writes ``<directory>/revisions.bundle``, a zip archive with a
+``manifest.json`` holding the revision identifiers, docstring and content
+hash of every file in ``versions/``, and the compiled bytecode of each one.
+When the bundle is present the revision graph is built from the manifest,
+and a revision module is created from its bytecode, without compiling or
+going through the import system, only when one of its functions has to run.
+
+A file whose content no longer matches its hash, or that is not in the
+bundle, is read from ``versions/`` as usual; a bundle built by another
+Python version is ignored.
+"""
+import hashlib
+import importlib.util
+import json
+import logging
+import marshal
+import os
+import re
+import sys
+import types
+import zipfile
+
+from alembic import util
+
+from fastapi_migrate.index import _LazyModule
+from fastapi_migrate.index import _list_scripts
+from fastapi_migrate.index import _parse
+from fastapi_migrate.index import kept_module
+
+
+log = logging.getLogger(__name__)
+
+BUNDLE_FILENAME = 'revisions.bundle'
+BUNDLE_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def bundle_path(script):
+    return os.path.join(str(script.dir), BUNDLE_FILENAME)
+
+
+def _magic():
+    return importlib.util.MAGIC_NUMBER.hex()
+
+
+class _BundledModule(_LazyModule):
+    """Stand-in for a revision module that runs its bundled bytecode on
+    first real use."""
+
+    def __init__(self, path, entry, bundle):
+        super(_BundledModule, self).__init__(path, entry)
+        self._bundle = bundle
+        self._member = entry['member']
+
+    def _load(self):
+        filename = os.path.basename(self.__file__)
+        # the module name alembic.util.load_python_file would use
+        module = types.ModuleType(re.sub(r'\W', '_', filename),
+                                  self.__doc__)
+        module.__file__ = self.__file__
+        exec(self._bundle.code(self._member), module.__dict__)
+        return module
+
+
+class Bundle(object):
+    def __init__(self, path, archive, manifest):
+        self.path = path
+        self.archive = archive
+        self.files = manifest['files']
+
+    @classmethod
+    def open(cls, script):
+        """Return the bundle of ``script``, or ``None`` when there is no
+        usable one."""
+        path = bundle_path(script)
+        if not os.path.exists(path):
+            return None
+        try:
+            archive = zipfile.ZipFile(path)
+            manifest = json.loads(archive.read(MANIFEST).decode('utf-8'))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as exc:
+            log.warning('Ignoring revision bundle %s: %s', path, exc)
+            return None
+        if manifest.get('version') != BUNDLE_VERSION or \
+                manifest.get('magic') != _magic():
+            log.warning('Ignoring revision bundle %s, built for another '
+                        'Python version', path)
+            archive.close()
+            return None
+        return cls(path, archive, manifest)
+
+    def code(self, member):
+        return marshal.loads(self.archive.read(member))
+
+    def load_revisions(self, script, fallback):
+        """Yield the ``Script`` of every revision file, from the bundle when
+        its content is unchanged, else from ``fallback``, a
+        ``RevisionIndex``."""
+        from alembic.script import Script
+
+        stale = 0
+        for path, key in _list_scripts(script):
+            entry = self.files.get(key)
+            if entry is not None:
+                with open(path, 'rb') as f:
+                    if hashlib.sha1(f.read()).hexdigest() != entry['sha1']:
+                        entry = None
+            if entry is None:
+                stale += 1
+                entry = fallback.entry(path, key)
+                module = kept_module(path, entry,
+                                     lambda: _LazyModule(path, entry))
+            else:
+                module = kept_module(path, entry,
+                                     lambda: _BundledModule(path, entry,
+                                                            self))
+            yield Script(module, entry['revision'], path)
+        if stale:
+            log.warning('%d revision files changed since "db bundle", '
+                        'run it again', stale)
+        fallback.write()
+
+
+def build(script):
+    """Compile every revision file of ``script`` into its bundle and return
+    the number of revisions bundled."""
+    script_dir = str(script.dir)
+    files = {}
+    path = bundle_path(script)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as archive:
+        for number, (file_path, key) in enumerate(_list_scripts(script)):
+            with open(file_path, 'rb') as f:
+                source = f.read()
+            # before _parse, which imports files it cannot parse
+            try:
+                code = compile(source, file_path, 'exec', dont_inherit=True)
+            except SyntaxError as exc:
+                archive.close()
+                os.remove(tmp_path)
+                raise util.CommandError('Cannot compile %s: %s'
+                                        % (os.path.relpath(file_path,
+                                                           script_dir), exc))
+            entry = _parse(file_path, source)
+            entry['sha1'] = hashlib.sha1(source).hexdigest()
+            entry['member'] = 'code/%d' % number
+            archive.writestr(entry['member'], marshal.dumps(code))
+            files[key] = entry
+        archive.writestr(MANIFEST, json.dumps({
+            'version': BUNDLE_VERSION,
+            'magic': _magic(),
+            'python': sys.version.split()[0],
+            'files': files,
+        }, indent=0, sort_keys=True))
+    os.replace(tmp_path, path)
+    return len(files)
@@ -0,0 +1,204 @@
+"""Schema drift between the models and the database, for CI.
+
+``db check`` runs the autogenerate comparison of ``db migrate`` without
+writing a revision file.  It prints the differences as JSON::
+
+    {"drift": true,
+     "databases": {"": [{"kind": "add_column", "schema": null,
+                         "table": "user", "column": "email",
+                         "type": "String(length=120)", "nullable": true}]}}
+
+and exits with status 1 when there are any.  The comparison goes through
+env.py like ``db migrate``, so ``reflect_models_only``, ``include_name``
+and the ``reflection_cache`` of ``Migrate`` apply; ``tables`` restricts it
+further to the named tables.
+"""
+from alembic.autogenerate import RevisionContext
+from alembic.runtime.environment import EnvironmentContext
+
+from fastapi_migrate.bootstrap import _script_directory
+from fastapi_migrate.reflection import _table_key
+
+
+def _type(type_):
+    return None if type_ is None else repr(type_)
+
+
+def _default(default):
+    if default is None or default is False:
+        return None
+    arg = getattr(default, 'arg', default)
+    return str(getattr(arg, 'text', arg))
+
+
+def _columns(columns):
+    return [column.name for column in columns]
+
+
+def _table(table):
+    return {'schema': table.schema, 'table': table.name}
+
+
+def _column(schema, table, column):
+    return {'schema': schema, 'table': table, 'column': column.name,
+            'type': _type(column.type), 'nullable': column.nullable}
+
+
+def _index(index):
+    return dict(_table(index.table), name=index.name, unique=index.unique,
+                columns=[getattr(expr, 'name', str(expr))
+                         for expr in index.expressions])
+
+
+def _constraint(constraint):
+    diff = dict(_table(constraint.table), name=constraint.name,
+                type=type(constraint).__name__)
+    if hasattr(constraint, 'columns'):
+        diff['columns'] = _columns(constraint.columns)
+    return diff
+
+
+def _foreign_key(constraint):
+    diff = _constraint(constraint)
+    diff['referred_table'] = constraint.referred_table.name
+    diff['referred_columns'] = [element.column.name
+                                for element in constraint.elements]
+    return diff
+
+
+def _modify(schema, table, column, existing, old, new, convert=None):
+    convert = convert or (lambda value: value)
+    return {'schema': schema, 'table': table, 'column': column,
+            'from': convert(old), 'to': convert(new)}
+
+
+_MODIFY = {
+    'modify_type': _type,
+    'modify_nullable': None,
+    'modify_default': _default,
+    'modify_comment': None,
+}
+
+
+def _diff(diff):
+    """Return the autogenerate ``diff`` tuple as a JSON friendly dict."""
+    kind = diff[0]
+    if kind in ('add_table', 'remove_table'):
+        fields = _table(diff[1])
+    elif kind in ('add_column', 'remove_column'):
+        fields = _column(*diff[1:4])
+    elif kind in ('add_index', 'remove_index'):
+        fields = _index(diff[1])
+    elif kind in ('add_fk', 'remove_fk'):
+        fields = _foreign_key(diff[1])
+    elif kind in ('add_constraint', 'remove_constraint'):
+        fields = _constraint(diff[1])
+    elif kind in ('add_table_comment', 'remove_table_comment'):
+        fields = dict(_table(diff[1]), comment=diff[1].comment)
+    elif kind in _MODIFY:
+        fields = _modify(*diff[1:7], convert=_MODIFY[kind])
+    else:
+        fields = {'args': [str(arg) for arg in diff[1:]]}
+    return dict(fields, kind=kind)
+
+
+# added by online_ddl to the constraints it reports already
+_REWRITTEN = ('validate_constraint',)
+
+
+def _as_diffs(upgrade_ops):
+    diffs = []
+    for diff in upgrade_ops.as_diffs():
+        # the changes of a single column come as a list
+        if isinstance(diff, list):
+            diffs.extend(_diff(d) for d in diff)
+        elif diff[0] not in _REWRITTEN:
+            diffs.append(_diff(diff))
+    return diffs
+
+
+def _database(upgrade_token):
+    if upgrade_token == 'upgrades':
+        return ''
+    return upgrade_token[:-len('_upgrades')]
+
+
+def diffs(migration_scripts):
+    """Return the differences found by autogenerate, a list of dicts per
+    database name, ``''`` for the primary one."""
+    databases = {}
+    for migration_script in migration_scripts:
+        for upgrade_ops in migration_script.upgrade_ops_list:
+            databases.setdefault(_database(upgrade_ops.upgrade_token),
+                                 []).extend(_as_diffs(upgrade_ops))
+    return databases
+
+
+def only(databases, tables):
+    """Return the differences of ``databases`` that concern ``tables``."""
+    tables = set(tables)
+    return dict(
+        (name, [diff for diff in diffs
+                if diff.get('table') in tables or
+                _table_key(diff.get('schema'), diff.get('table')) in tables])
+        for name, diffs in databases.items())
+
+
+def restrict(configure_args, tables):
+    """Return ``configure_args`` with autogenerate limited to ``tables``,
+    names with an optional ``schema.`` prefix."""
+    tables = set(tables)
+    include_name = configure_args.get('include_name')
+    include_object = configure_args.get('include_object')
+
+    def included(name, schema):
+        return name in tables or _table_key(schema, name) in tables
+
+    def restricted_name(name, type_, parent_names):
+        # tables outside the set are not even reflected
+        if type_ == 'table' and \
+                not included(name, parent_names.get('schema_name')):
+            return False
+        if include_name is not None:
+            return include_name(name, type_, parent_names)
+        return True
+
+    def restricted_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and not included(name, object.schema):
+            return False
+        if include_object is not None:
+            return include_object(object, name, type_, reflected, compare_to)
+        return True
+
+    return dict(configure_args, include_name=restricted_name,
+                include_object=restricted_object)
+
+
+def check(config):
+    """Compare the database with the models through env.py, like
+    ``alembic.command.check``, and return the differences by database."""
+    script_directory = _script_directory(config)
+    revision_context = RevisionContext(
+        config,
+        script_directory,
+        dict(message=None, autogenerate=True, sql=False, head='head',
+             splice=False, branch_label=None, version_path=None,
+             rev_id=None, depends_on=None),
+    )
+
+    def retrieve_migrations(rev, context):
+        revision_context.run_autogenerate(rev, context)
+        return []
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=retrieve_migrations,
+        as_sql=False,
+        template_args=revision_context.template_args,
+        revision_context=revision_context,
+    ):
+        script_directory.run_env()
+
+    # env.py's hook drops a revision without changes
+    return diffs(revision_context.generated_revisions)
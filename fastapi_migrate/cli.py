@@ -1,30 +1,61 @@
 import click
 
-from .command import init as _init
-from .command import revision as _revision
-from .command import migrate as _migrate
-from .command import edit as _edit
-from .command import merge as _merge
-from .command import upgrade as _upgrade
-from .command import downgrade as _downgrade
-from .command import show as _show
-from .command import history as _history
-from .command import heads as _heads
-from .command import branches as _branches
-from .command import current as _current
-from .command import stamp as _stamp
+
+def _command(name):
+    # fastapi_migrate.command pulls in alembic, only import it once a
+    # command actually runs so that --help stays fast
+    def run(*args, **kwargs):
+        from fastapi_migrate import command
+        return getattr(command, name)(*args, **kwargs)
+    run.__name__ = name
+    return run
+
+
+_init = _command('init')
+_revision = _command('revision')
+_migrate = _command('migrate')
+_edit = _command('edit')
+_merge = _command('merge')
+_upgrade = _command('upgrade')
+_downgrade = _command('downgrade')
+_show = _command('show')
+_history = _command('history')
+_heads = _command('heads')
+_branches = _command('branches')
+_current = _command('current')
+_stamp = _command('stamp')
+_squash = _command('squash')
+_analyze = _command('analyze')
+_check = _command('check')
+_bundle = _command('bundle')
+_serve = _command('serve')
 
 
 @click.group()
-def db():
-    pass
+@click.option('--app', 'app_name', default=None, metavar='NAME',
+              help='Name of the application to migrate, as given to '
+              'Migrate(name=...) (default is the last one initialised)')
+@click.pass_context
+def db(ctx, app_name):
+    if app_name is None:
+        return
+    from fastapi_migrate.apps import reset_app
+    from fastapi_migrate.apps import set_app
+
+    try:
+        token = set_app(app_name)
+    except RuntimeError as exc:
+        raise click.BadParameter(str(exc), param_hint='--app')
+    ctx.call_on_close(lambda: reset_app(token))
 
 
 @db.command()
 @click.option("-d", "--direct", default=None,
               help='migration script directory (default is "migrations")')
-def init(direct):
-    _init(direct)
+@click.option('--multidb', is_flag=True,
+              help='Support multiple databases (SQLALCHEMY_BINDS)')
+def init(direct, multidb):
+    _init(direct, multidb)
 
 
 @db.command()
@@ -77,11 +108,87 @@ def revision(directory, message, autogenerate, sql, head, splice, branch_label,
               'one')
 @click.option('-x', '--x-arg', multiple=True,
               help='Additional arguments consumed by custom env.py scripts')
+@click.option('--split', is_flag=True,
+              help='Write an expand revision with the additions and a '
+              'contract revision with the drops, renames and NOT NULL '
+              'changes')
+@click.option('--offline', is_flag=True,
+              help='Compare the models with the metadata snapshot of the '
+              'head revision instead of with the database')
 def migrate(directory, message, sql, head, splice, branch_label, version_path,
-            rev_id, x_arg):
+            rev_id, x_arg, split, offline):
     """Autogenerate a new revision file (Alias for 'revision --autogenerate')"""
     _migrate(directory, message, sql, head, splice, branch_label, version_path,
-             rev_id, x_arg)
+             rev_id, x_arg, split=split, offline=offline)
+
+
+@db.command()
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+@click.option('-x', '--x-arg', multiple=True,
+              help='Additional arguments consumed by custom env.py scripts')
+@click.option('-t', '--table', 'tables', multiple=True,
+              help='Only compare this table, "schema.table" for another '
+              'schema (can be given several times)')
+@click.option('--offline', is_flag=True,
+              help='Compare the models with the metadata snapshot of the '
+              'head revision instead of with the database')
+def check(directory, x_arg, tables, offline):
+    """Print the differences between the models and the database as JSON,
+    exit with status 1 when there are any"""
+    _check(directory, x_arg, tables, offline)
+
+
+@db.command()
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+@click.option('-m', '--message', default=None, help='Revision message')
+@click.option('--head', default='head',
+              help='Specify head revision or <branchname>@head to base new '
+              'revision on')
+@click.option('--rev-id', default=None,
+              help='Specify a hardcoded revision id instead of generating '
+              'one')
+def squash(directory, message, head, rev_id):
+    """Write a baseline revision from the current models, used by
+    'upgrade --fast-bootstrap'"""
+    _squash(directory, message, head, rev_id)
+
+
+@db.command()
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+def bundle(directory):
+    """Compile the revision scripts into one bundle, loaded by the other
+    commands while the scripts are unchanged"""
+    _bundle(directory)
+
+
+@db.command()
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+@click.option('--socket', 'path', default=None, metavar='PATH',
+              help='Unix socket to listen on (default is '
+              '"<directory>/.serve.sock")')
+def serve(directory, path):
+    """Keep the application loaded and run the db commands forwarded by
+    fastapi_migrate.serve.forward()"""
+    _serve(directory, path)
+
+
+@db.command()
+@click.option('-d', '--directory', default=None,
+              help='migration script directory (default is "migrations")')
+@click.option('--from', 'from_revision', default=None,
+              help='Analyze the revisions after this one instead of after '
+              'the current revision of the database')
+@click.option('--rows', is_flag=True,
+              help='Weigh the findings by the row counts of the live '
+              'database')
+@click.argument('revision', default='heads')
+def analyze(directory, from_revision, rows, revision):
+    """Show the locks and table rewrites of the pending revisions"""
+    _analyze(directory, revision, from_revision, rows)
 
 
 @db.command()
@@ -119,10 +226,41 @@ def merge(directory, message, branch_label, rev_id, revisions):
               'scripts')
 @click.option('-x', '--x-arg', multiple=True,
               help='Additional arguments consumed by custom env.py scripts')
+@click.option('--fast-bootstrap', is_flag=True,
+              help='Build an empty database from the newest squashed '
+              'baseline instead of replaying every revision')
+@click.option('--profile', default=None, metavar='FILE',
+              help='Append per-revision and per-statement timings to FILE '
+              'as JSON lines ("-" for standard output)')
+@click.option('--expand-only', is_flag=True,
+              help='Stop before the first contract revision written by '
+              '"migrate --split"')
+@click.option('--tenants', is_flag=True,
+              help='Upgrade every tenant returned by the @migrate.tenants '
+              'callback')
+@click.option('--concurrency', default=None, type=int,
+              help='Number of tenants upgraded at a time (default is the '
+              'number of CPUs)')
+@click.option('--failures', default=None, metavar='FILE',
+              help='Write the failed tenants to FILE as JSON lines')
+@click.option('--plan', is_flag=True,
+              help='Estimate how long the pending revisions will take from '
+              'the run history, without upgrading')
+@click.option('--plan-from', default=None, metavar='URL_OR_FILE',
+              help='Database URL, or --profile file, with the run history '
+              'used by --plan (default is the database itself)')
+@click.option('--output-dir', default=None, metavar='DIR',
+              help='With --sql, write the SQL of each revision and database '
+              'to its own file in DIR, with a manifest')
 @click.argument('revision', default='head')
-def upgrade(directory, sql, tag, x_arg, revision):
+def upgrade(directory, sql, tag, x_arg, fast_bootstrap, profile, expand_only,
+            tenants, concurrency, failures, plan, plan_from, output_dir,
+            revision):
     """Upgrade to a later version"""
-    _upgrade(directory, revision, sql, tag, x_arg)
+    _upgrade(directory, revision, sql, tag, x_arg, fast_bootstrap, profile,
+             expand_only=expand_only, tenants=tenants,
+             concurrency=concurrency, failures=failures, plan=plan,
+             plan_from=plan_from, output_dir=output_dir)
 
 
 @db.command()
@@ -136,10 +274,17 @@ def upgrade(directory, sql, tag, x_arg, revision):
                     'scripts'))
 @click.option('-x', '--x-arg', multiple=True,
               help='Additional arguments consumed by custom env.py scripts')
+@click.option('--profile', default=None, metavar='FILE',
+              help='Append per-revision and per-statement timings to FILE '
+              'as JSON lines ("-" for standard output)')
+@click.option('--output-dir', default=None, metavar='DIR',
+              help='With --sql, write the SQL of each revision and database '
+              'to its own file in DIR, with a manifest')
 @click.argument('revision', default='-1')
-def downgrade(directory, sql, tag, x_arg, revision):
+def downgrade(directory, sql, tag, x_arg, profile, output_dir, revision):
     """Revert to a previous version"""
-    _downgrade(directory, revision, sql, tag, x_arg)
+    _downgrade(directory, revision, sql, tag, x_arg, profile,
+               output_dir=output_dir)
 
 
 @db.command()
@@ -1,38 +1,103 @@
 import sys
 import os
+import json
 import logging
 from pathlib import Path
 from functools import wraps
 
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import ArgumentError
+from sqlalchemy.exc import DBAPIError
 from alembic import command
 from alembic.config import Config as AlembicConfig
 from alembic.util import CommandError
 from alembic import __version__ as __alembic_version__
 
+from fastapi_migrate import analyze as _analyze
+from fastapi_migrate import batch
+from fastapi_migrate import bootstrap
+from fastapi_migrate import bundle as _bundle
+from fastapi_migrate import check as _check
+from fastapi_migrate import history as _history
+from fastapi_migrate import index
+from fastapi_migrate import online
+from fastapi_migrate import operations  # noqa: F401, registers op.backfill
+from fastapi_migrate import phases
+from fastapi_migrate import profiling
+from fastapi_migrate import reflection
+from fastapi_migrate import serve as _serve
+from fastapi_migrate import snapshot
+from fastapi_migrate import sqlscripts
+from fastapi_migrate import tenants as _tenants
+from fastapi_migrate import timeouts
+from fastapi_migrate.apps import get_app
+from fastapi_migrate.apps import use_app
+from fastapi_migrate.internal import internal_tables
+
 
 log = logging.getLogger()
 alembic_version = tuple([int(v) for v in __alembic_version__.split('.')[0:3]])
 
 
+index.install()
+online.install()
+batch.install()
+reflection.install()
+timeouts.install()
+
+
 class Config(AlembicConfig):
+    # build the revision graph from the on-disk index, see fastapi_migrate.index
+    revision_index = False
+
+    def __init__(self, *args, **kwargs):
+        # alembic's default is sys.stdout as it was on import, db serve
+        # replaces it
+        kwargs.setdefault('stdout', sys.stdout)
+        super(Config, self).__init__(*args, **kwargs)
+
     def get_template_directory(self):
         package_dir = Path(__file__).parent
         return str((package_dir / "templates").absolute())
 
 
 def catch_errors(f):
+    # the commands also take the application, or its registered name, to
+    # work on, see fastapi_migrate.apps
     @wraps(f)
     def wrapped(*args, **kwargs):
+        app = kwargs.pop('app', None)
         try:
-            f(*args, **kwargs)
+            with use_app(app):
+                f(*args, **kwargs)
         except (CommandError, RuntimeError) as exc:
             log.error('Error: ' + str(exc))
             sys.exit(1)
     return wrapped
 
 
+def store_snapshot(app, scripts):
+    """Store the model metadata in the revisions written from it, by
+    autogenerate or ``squash``; both revisions of ``--split`` get it."""
+    migrate_config = app.extra['migrate']
+    if not isinstance(scripts, (list, tuple)):
+        scripts = [scripts]
+    scripts = [script for script in scripts if script is not None]
+    if not migrate_config.migrate.metadata_snapshot or not scripts or \
+            migrate_config.model is None:
+        return
+    for script in scripts:
+        snapshot.append(script, migrate_config.metadata)
+
+
+def save_reflection_cache(app):
+    cache = app.extra['migrate'].configure_args.get('reflection_cache')
+    if cache is not None:
+        cache.save()
+
+
 def current_app():
-    from fastapi_migrate import current_app
+    current_app = get_app()
     if not current_app:
         log.error(
             "No fastapi application running, Check if Migate(app) has been executed")
@@ -40,7 +105,7 @@ def current_app():
 
 
 @catch_errors
-def init(directory=None):
+def init(directory=None, multidb=False):
     """Creates a new migration repository"""
     app = current_app()
     if directory is None:
@@ -49,37 +114,173 @@ def init(directory=None):
     config.set_main_option('script_location', directory)
     config.config_file_name = os.path.join(directory, 'alembic.ini')
     config = app.extra['migrate'].migrate.call_configure_callbacks(config)
-    command.init(config, directory, 'fastapi')
+    template_name = 'fastapi'
+    if multidb:
+        template_name = 'fastapi-multidb'
+    command.init(config, directory, template_name)
 
 
 @catch_errors
 def revision(directory=None, message=None, autogenerate=False, sql=False,
              head='head', splice=False, branch_label=None, version_path=None,
-             rev_id=None):
+             rev_id=None, connection=None):
     """Create a new revision file."""
     app = current_app()
-    config = app.extra['migrate'].migrate.get_config(directory)
+    opts = ['autogenerate'] if autogenerate else None
+    config = app.extra['migrate'].migrate.get_config(directory, opts=opts,
+                                                     connection=connection)
     if alembic_version >= (0, 7, 0):
-        command.revision(config, message, autogenerate=autogenerate, sql=sql,
-                         head=head, splice=splice, branch_label=branch_label,
-                         version_path=version_path, rev_id=rev_id)
+        scripts = command.revision(
+            config, message, autogenerate=autogenerate, sql=sql, head=head,
+            splice=splice, branch_label=branch_label,
+            version_path=version_path, rev_id=rev_id)
     else:
-        command.revision(config, message, autogenerate=autogenerate, sql=sql)
+        scripts = command.revision(config, message,
+                                   autogenerate=autogenerate, sql=sql)
+    if autogenerate:
+        # an empty revision does not hold the changes of the models
+        if not sql:
+            store_snapshot(app, scripts)
+        save_reflection_cache(app)
 
 
 @catch_errors
 def migrate(directory=None, message=None, sql=False, head='head', splice=False,
-            branch_label=None, version_path=None, rev_id=None, x_arg=None):
+            branch_label=None, version_path=None, rev_id=None, x_arg=None,
+            connection=None, split=False, offline=False):
     """Alias for 'revision --autogenerate'"""
     app = current_app()
     config = app.extra['migrate'].migrate.get_config(
+        directory, opts=['autogenerate'], x_arg=x_arg, connection=connection)
+    if split and sql:
+        raise CommandError('--split writes revision files, it cannot be '
+                           'used with --sql')
+    if offline:
+        scripts = snapshot.revision(
+            bootstrap._script_directory(config), app.extra['migrate'],
+            message, head=head, splice=splice, branch_label=branch_label,
+            version_path=version_path, rev_id=rev_id, split=split)
+        store_snapshot(app, scripts)
+        return
+    if split:
+        scripts = phases.revision(
+            config, message, head=head, splice=splice,
+            branch_label=branch_label, version_path=version_path,
+            rev_id=rev_id)
+    elif alembic_version >= (0, 7, 0):
+        scripts = command.revision(
+            config, message, autogenerate=True, sql=sql, head=head,
+            splice=splice, branch_label=branch_label,
+            version_path=version_path, rev_id=rev_id)
+    else:
+        scripts = command.revision(config, message, autogenerate=True,
+                                   sql=sql)
+    if not sql:
+        store_snapshot(app, scripts)
+    save_reflection_cache(app)
+
+
+@catch_errors
+def check(directory=None, x_arg=None, tables=None, offline=False):
+    """Compare the models with the database and exit with an error when
+    they differ"""
+    app = current_app()
+    migrate_config = app.extra['migrate']
+    config = migrate_config.migrate.get_config(
         directory, opts=['autogenerate'], x_arg=x_arg)
-    if alembic_version >= (0, 7, 0):
-        command.revision(config, message, autogenerate=True, sql=sql,
-                         head=head, splice=splice, branch_label=branch_label,
-                         version_path=version_path, rev_id=rev_id)
+    if offline:
+        migration_script, _ = snapshot.autogenerate(
+            migrate_config, snapshot.head_snapshot(
+                bootstrap._script_directory(config)))
+        databases = _check.diffs([migration_script])
+        if tables:
+            databases = _check.only(databases, tables)
     else:
-        command.revision(config, message, autogenerate=True, sql=sql)
+        configure_args = migrate_config.configure_args
+        if tables:
+            migrate_config.configure_args = _check.restrict(configure_args,
+                                                            tables)
+        try:
+            databases = _check.check(config)
+        finally:
+            migrate_config.configure_args = configure_args
+        save_reflection_cache(app)
+    databases = dict((name, diffs) for name, diffs in databases.items()
+                     if diffs)
+    drift = bool(databases)
+    config.print_stdout(json.dumps({'drift': drift, 'databases': databases},
+                                   indent=2, sort_keys=True))
+    if drift:
+        raise CommandError('The models and the database differ')
+
+
+@catch_errors
+def squash(directory=None, message=None, head='head', rev_id=None):
+    """Write a baseline revision from the current model metadata"""
+    app = current_app()
+    config = app.extra['migrate'].migrate.get_config(directory)
+    script = bootstrap.squash(config, app.extra['migrate'], message,
+                              head=head, rev_id=rev_id)
+    store_snapshot(app, script)
+
+
+@catch_errors
+def bundle(directory=None):
+    """Compile the revision scripts into a bundle loaded by the other
+    commands"""
+    app = current_app()
+    config = app.extra['migrate'].migrate.get_config(directory)
+    script = bootstrap._script_directory(config)
+    count = _bundle.build(script)
+    config.print_stdout('Bundled %d revisions into %s'
+                        % (count, _bundle.bundle_path(script)))
+
+
+@catch_errors
+def serve(directory=None, path=None):
+    """Run the db commands sent over a Unix socket in this process"""
+    from fastapi_migrate.cli import db
+
+    app = current_app()
+    migrate = app.extra['migrate'].migrate
+    config = migrate.get_config(directory)
+    path = path or _serve.socket_path(directory or migrate.directory)
+    config.print_stdout('Serving db commands on %s, press Ctrl+C to stop',
+                        path)
+    _serve.serve(db, path)
+
+
+@catch_errors
+def analyze(directory=None, _revision='heads', from_revision=None,
+            rows=False):
+    """Show the locks and table rewrites of the pending revisions"""
+    app = current_app()
+    migrate = app.extra['migrate'].migrate
+    config = migrate.get_config(directory)
+    script = bootstrap._script_directory(config)
+    if from_revision is None:
+        try:
+            from_revision = migrate.status().current or 'base'
+        except DBAPIError as exc:
+            raise CommandError('Cannot read the current revision, give it '
+                               'with --from: %s' % exc.orig)
+    if not rows:
+        findings = _analyze.analyze(config, script, from_revision, _revision)
+    elif hasattr(migrate.get_bind(), 'sync_engine'):
+        raise RuntimeError('--rows needs a synchronous engine')
+    else:
+        bind = migrate.get_bind()
+        if isinstance(bind, Connection):
+            findings = _analyze.analyze(config, script, from_revision,
+                                        _revision, connection=bind)
+        else:
+            with bind.connect() as connection:
+                findings = _analyze.analyze(config, script, from_revision,
+                                            _revision, connection=connection)
+    if not findings:
+        config.print_stdout('No pending operations.')
+    for finding in findings:
+        config.print_stdout(_analyze.format_finding(finding))
 
 
 @catch_errors
@@ -108,24 +309,157 @@ def merge(directory=None, revisions='', message=None, branch_label=None,
         raise RuntimeError('Alembic 0.7.0 or greater is required')
 
 
+def write_sql(app, config, output_dir, _revision, direction, sql=False,
+              tag=None, expand_only=False):
+    """Write the SQL of ``upgrade --sql`` or ``downgrade --sql`` to one file
+    per revision and per database, see ``fastapi_migrate.sqlscripts``."""
+    if not sql:
+        raise CommandError('--output-dir writes the SQL of --sql')
+    manifest = sqlscripts.render(config, app.extra['migrate'], output_dir,
+                                 _revision, direction, tag=tag,
+                                 expand_only=expand_only)
+    count = sum(len(files) for files in manifest['databases'].values())
+    config.print_stdout('Wrote %d SQL files and %s to %s', count,
+                        sqlscripts.MANIFEST_FILENAME, output_dir)
+
+
+def make_profiler(app, profile=None):
+    """Return the ``Profiler`` for the ``profile`` of ``Migrate`` and of the
+    command, and for its run history."""
+    migrate_config = app.extra['migrate']
+    migrate = migrate_config.migrate
+    history = None
+    if migrate.run_history:
+        history = _history.RunHistory(
+            _history.table_name(migrate.run_history),
+            migrate_config.configure_args.get('version_table_schema'))
+    return profiling.make_profiler(migrate.profile, profile, history=history)
+
+
+def upgrade_plan(app, directory=None, _revision='heads', plan_from=None):
+    """Return the lines estimating how long upgrading to ``_revision`` will
+    take, from the run history in ``plan_from`` or in the database."""
+    migrate_config = app.extra['migrate']
+    migrate = migrate_config.migrate
+    script = bootstrap._script_directory(migrate.get_config(directory))
+    pending = migrate.status().pending
+    if _revision not in ('head', 'heads'):
+        revision_map = script.revision_map
+        target = set(revision.revision for revision in
+                     revision_map._get_ancestor_nodes(
+                         revision_map.get_revisions(_revision)))
+        pending = [revision for revision in pending if revision in target]
+    bind = migrate.get_bind()
+    if plan_from is None and hasattr(bind, 'sync_engine'):
+        raise RuntimeError('--plan needs a synchronous engine, or the '
+                           'history given with --plan-from')
+    try:
+        records = _history.read(
+            plan_from, bind, _history.table_name(migrate.run_history),
+            migrate_config.configure_args.get('version_table_schema'))
+    except ArgumentError:
+        raise CommandError('--plan-from %s is neither a file nor a database '
+                           'URL' % plan_from)
+    except DBAPIError as exc:
+        raise CommandError('Cannot read the run history: %s' % exc.orig)
+    return _history.format_plan(_history.estimate(
+        records, [script.get_revision(revision) for revision in pending]))
+
+
+def run_upgrade(app, directory=None, _revision='head', sql=False, tag=None,
+                x_arg=None, fast_bootstrap=False, profile=None,
+                connection=None, expand_only=False, output_dir=None):
+    """``upgrade`` without the error handling of the command line."""
+    config = app.extra['migrate'].migrate.get_config(directory,
+                                                     x_arg=x_arg,
+                                                     connection=connection)
+    if output_dir is not None:
+        write_sql(app, config, output_dir, _revision, 'upgrade', sql=sql,
+                  tag=tag, expand_only=expand_only)
+        return
+    profiler = make_profiler(app, profile)
+    try:
+        if fast_bootstrap:
+            bootstrap.upgrade(config, _revision, sql=sql, tag=tag,
+                              profiler=profiler, expand_only=expand_only,
+                              ignored_tables=internal_tables(
+                                  app.extra['migrate'].migrate))
+        elif profiler is not None or expand_only:
+            profiling.upgrade(config, _revision, sql=sql, tag=tag,
+                              profiler=profiler, expand_only=expand_only)
+        else:
+            command.upgrade(config, _revision, sql=sql, tag=tag)
+    finally:
+        if profiler is not None:
+            profiler.close()
+
+
 @catch_errors
-def upgrade(directory=None, _revision='head', sql=False, tag=None, x_arg=None):
+def upgrade(directory=None, _revision='head', sql=False, tag=None, x_arg=None,
+            fast_bootstrap=False, profile=None, connection=None,
+            expand_only=False, tenants=False, concurrency=None,
+            failures=None, plan=False, plan_from=None, output_dir=None):
     """Upgrade to a later version"""
     app = current_app()
-    config = app.extra['migrate'].migrate.get_config(directory,
-                                                     x_arg=x_arg)
-    command.upgrade(config, _revision, sql=sql, tag=tag)
+    if plan:
+        config = app.extra['migrate'].migrate.get_config(directory)
+        for line in upgrade_plan(app, directory, _revision, plan_from):
+            config.print_stdout(line)
+        return
+    if not tenants:
+        run_upgrade(app, directory, _revision, sql=sql, tag=tag, x_arg=x_arg,
+                    fast_bootstrap=fast_bootstrap, profile=profile,
+                    connection=connection, expand_only=expand_only,
+                    output_dir=output_dir)
+        return
+    migrate = app.extra['migrate'].migrate
+    if migrate.tenant_callback is None:
+        raise CommandError('No tenants, register a callback with '
+                           '@migrate.tenants')
+    if sql or connection is not None:
+        raise CommandError('--tenants connects to every tenant, it cannot '
+                           'be used with --sql or a connection')
+    config = migrate.get_config(directory)
+    results = _tenants.upgrade(
+        migrate.tenant_callback(), concurrency=concurrency,
+        progress=config.print_stdout, app=migrate.name, directory=directory,
+        revision=_revision, tag=tag, x_arg=x_arg,
+        fast_bootstrap=fast_bootstrap, profile=profile,
+        expand_only=expand_only)
+    for line in _tenants.summary(results):
+        config.print_stdout(line)
+    if failures is not None:
+        _tenants.write_failures(failures, results)
+    failed = [result for result in results if result.error]
+    if failed:
+        raise CommandError('%d of %d tenants failed' % (len(failed),
+                                                        len(results)))
 
 
 @catch_errors
-def downgrade(directory=None, _revision='-1', sql=False, tag=None, x_arg=None):
+def downgrade(directory=None, _revision='-1', sql=False, tag=None, x_arg=None,
+              profile=None, connection=None, output_dir=None):
     """Revert to a previous version"""
     app = current_app()
     config = app.extra['migrate'].migrate.get_config(directory,
-                                                     x_arg=x_arg)
+                                                     x_arg=x_arg,
+                                                     connection=connection)
     if sql and _revision == '-1':
         _revision = 'head:-1'
-    command.downgrade(config, _revision, sql=sql, tag=tag)
+    if output_dir is not None:
+        write_sql(app, config, output_dir, _revision, 'downgrade', sql=sql,
+                  tag=tag)
+        return
+    profiler = make_profiler(app, profile)
+    try:
+        if profiler is not None:
+            profiling.downgrade(config, _revision, sql=sql, tag=tag,
+                                profiler=profiler)
+        else:
+            command.downgrade(config, _revision, sql=sql, tag=tag)
+    finally:
+        if profiler is not None:
+            profiler.close()
 
 
 @catch_errors
@@ -179,20 +513,25 @@ def branches(directory=None, verbose=False):
 
 
 @catch_errors
-def current(directory=None, verbose=False, head_only=False):
+def current(directory=None, verbose=False, head_only=False, connection=None):
     """Display the current revision for each database."""
     app = current_app()
-    config = app.extra['migrate'].migrate.get_config(directory)
+    config = app.extra['migrate'].migrate.get_config(directory,
+                                                     connection=connection)
     if alembic_version >= (0, 7, 0):
-        command.current(config, verbose=verbose, head_only=head_only)
+        # head_only is deprecated and was removed from later alembic releases
+        kwargs = {'head_only': True} if head_only else {}
+        command.current(config, verbose=verbose, **kwargs)
     else:
         command.current(config)
 
 
 @catch_errors
-def stamp(directory=None, _revision='head', sql=False, tag=None):
+def stamp(directory=None, _revision='head', sql=False, tag=None,
+          connection=None):
     """'stamp' the revision table with the given revision; don't run any
     migrations"""
     app = current_app()
-    config = app.extra['migrate'].migrate.get_config(directory)
+    config = app.extra['migrate'].migrate.get_config(directory,
+                                                     connection=connection)
     command.stamp(config, _revision, sql=sql, tag=tag)
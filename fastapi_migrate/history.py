@@ -0,0 +1,189 @@
+"""Run history of the migrations and upgrade time estimates.
+
+With ``Migrate(run_history=True)`` every revision applied by ``upgrade`` or
+``downgrade`` is recorded in a ``fastapi_migrate_history`` table, next to
+the version table and in the same transaction as the revision: when it
+started, how long it took, the statements it ran, the rows they reported
+and the host that ran it.  Autogenerate leaves the table alone, see
+``fastapi_migrate.internal``.
+
+``db upgrade --plan`` estimates how long the pending revisions will take
+from the history of a database they already ran on, such as staging, or
+from a ``--profile`` file.
+"""
+import datetime
+import json
+import os
+import socket
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+from fastapi_migrate.internal import HISTORY_TABLE
+
+
+TABLE_NAME = HISTORY_TABLE
+
+Estimate = namedtuple('Estimate', ['revision', 'doc', 'elapsed', 'runs'])
+Estimate.__doc__ = """Expected duration of a pending revision.
+
+``elapsed`` is the median duration of its past upgrades, in seconds, or
+``None`` without any; ``runs`` is the number of upgrades it is based on.
+"""
+
+
+def history_table(name=TABLE_NAME, schema=None, metadata=None):
+    return sa.Table(
+        name, metadata if metadata is not None else sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('revision', sa.String(255), nullable=False),
+        sa.Column('direction', sa.String(16), nullable=False),
+        sa.Column('engine_name', sa.String(255), nullable=False),
+        sa.Column('started', sa.DateTime, nullable=False),
+        sa.Column('elapsed', sa.Float, nullable=False),
+        sa.Column('statements', sa.Integer, nullable=False),
+        sa.Column('rows', sa.Integer, nullable=False),
+        sa.Column('host', sa.String(255), nullable=False),
+        schema=schema,
+    )
+
+
+def table_name(run_history):
+    """The table name for the ``run_history`` option of ``Migrate``."""
+    return run_history if isinstance(run_history, str) else TABLE_NAME
+
+
+class RunHistory(object):
+    """Writes the revision records of a ``Profiler`` to the history table
+    of the database they ran on."""
+
+    def __init__(self, name=TABLE_NAME, schema=None):
+        self.table = history_table(name, schema)
+        self.host = socket.gethostname()
+
+    def create(self, connection):
+        self.table.create(connection, checkfirst=True)
+
+    def insert(self, connection, record):
+        connection.execute(self.table.insert().values(
+            revision=record['revision'],
+            direction=record['direction'],
+            engine_name=record['engine_name'],
+            started=datetime.datetime.fromtimestamp(record['started']),
+            elapsed=record['elapsed'],
+            statements=record['statements'],
+            rows=record['rows'],
+            host=self.host,
+        ))
+
+
+def read_table(bind, name=TABLE_NAME, schema=None):
+    """Return the records of the history table in ``bind``, none when it
+    does not exist."""
+    if not isinstance(bind, sa.engine.Connection):
+        with bind.connect() as connection:
+            return read_table(connection, name, schema)
+    # only a missing table means no history, a wrong database is an error
+    if not sa.inspect(bind).has_table(name, schema=schema):
+        return []
+    table = history_table(name, schema)
+    rows = bind.execute(sa.select(table.c.revision, table.c.direction,
+                                  table.c.engine_name,
+                                  table.c.elapsed)).fetchall()
+    return [dict(row._mapping, ok=True) for row in rows]
+
+
+def read_profile(path):
+    """Return the revision records of a ``--profile`` file."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('type') == 'revision':
+                records.append(record)
+    return records
+
+
+def read(source, default_bind, name=TABLE_NAME, schema=None):
+    """Return the records of ``source``: a ``--profile`` file, a database
+    URL, or ``None`` for ``default_bind``."""
+    if source is None:
+        return read_table(default_bind, name, schema)
+    if os.path.exists(source):
+        return read_profile(source)
+    engine = sa.create_engine(source, poolclass=sa.pool.NullPool)
+    try:
+        return read_table(engine, name, schema)
+    finally:
+        engine.dispose()
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def estimate(records, revisions):
+    """Return an ``Estimate`` for each of ``revisions``, ``Script``
+    objects, from the upgrade ``records``.
+
+    The runs of a revision on each database are summed per engine name,
+    using the median of each."""
+    runs = {}
+    for record in records:
+        if record.get('direction') != 'upgrade' or not record.get('ok'):
+            continue
+        runs.setdefault(record['revision'], {}).setdefault(
+            record.get('engine_name') or '', []).append(record['elapsed'])
+    estimates = []
+    for revision in revisions:
+        by_engine = runs.get(revision.revision)
+        if not by_engine:
+            estimates.append(Estimate(revision.revision, revision.doc,
+                                      None, 0))
+            continue
+        estimates.append(Estimate(
+            revision.revision, revision.doc,
+            sum(_median(elapsed) for elapsed in by_engine.values()),
+            max(len(elapsed) for elapsed in by_engine.values())))
+    return estimates
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return '%.1fs' % seconds
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return '%dm%02ds' % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return '%dh%02dm%02ds' % (hours, minutes, seconds)
+
+
+def format_plan(estimates):
+    """Return the lines of ``db upgrade --plan``."""
+    if not estimates:
+        return ['No pending revisions.']
+    lines = []
+    width = max(len(estimate.revision) for estimate in estimates)
+    for estimate in estimates:
+        if estimate.elapsed is None:
+            eta = 'no history'
+        else:
+            eta = '%s (%d run%s)' % (format_duration(estimate.elapsed),
+                                     estimate.runs,
+                                     '' if estimate.runs == 1 else 's')
+        lines.append('%-*s  %-24s %s' % (width, estimate.revision, eta,
+                                          estimate.doc or ''))
+    total = sum(estimate.elapsed for estimate in estimates
+                if estimate.elapsed is not None)
+    unknown = len([estimate for estimate in estimates
+                   if estimate.elapsed is None])
+    line = 'Estimated total: %s for %d revisions' % (
+        format_duration(total), len(estimates))
+    if unknown:
+        line += ', %d without history' % unknown
+    lines.append(line)
+    return lines
@@ -0,0 +1,266 @@
+"""On-disk index of the revision graph.
+
+Alembic imports every file in ``versions/`` to learn the revision graph, even
+for commands such as ``heads`` or ``history`` that never run a migration.
+The index keeps each file's revision identifiers and docstring in
+``<directory>/.revision_index.json`` so those commands can build the graph
+without importing anything; a revision module is only imported once one of
+its other attributes, such as ``upgrade()``, is needed.  Entries are reused
+while a file's size and mtime are unchanged, or, when the mtime moved, while
+its content hash is unchanged.
+"""
+import ast
+import hashlib
+import json
+import os
+import re
+
+from alembic import util
+from alembic.script import Script
+from alembic.script import ScriptDirectory
+from alembic.script.revision import RevisionMap
+
+
+INDEX_FILENAME = '.revision_index.json'
+INDEX_VERSION = 2
+
+_rev_file = re.compile(r'(?!\.\#|__init__)(.*\.py)$')
+_legacy_rev = re.compile(r'([a-f0-9]+)\.py$')
+
+
+class _LazyModule(object):
+    """Stand-in for a revision module that imports it on first real use."""
+
+    def __init__(self, path, entry):
+        self.__file__ = path
+        self.__doc__ = entry['doc']
+        self.revision = entry['revision']
+        self.down_revision = entry['down_revision']
+        self.branch_labels = entry['branch_labels']
+        self.depends_on = entry['depends_on']
+        self.baseline = entry['baseline']
+        self._module = None
+
+    def __getattr__(self, name):
+        if name.startswith('_alembic'):
+            raise AttributeError(name)
+        if self._module is None:
+            self._module = self._load()
+        return getattr(self._module, name)
+
+    def _load(self):
+        dir_, filename = os.path.split(self.__file__)
+        return util.load_python_file(dir_, filename)
+
+
+# revision modules kept by a long running process, see fastapi_migrate.serve
+_kept_modules = None
+
+
+def keep_modules():
+    """Keep the imported revision modules from one command to the next,
+    while their files are unchanged."""
+    global _kept_modules
+    if _kept_modules is None:
+        _kept_modules = {}
+
+
+def kept_module(path, entry, factory):
+    """Return the module of revision file ``path``: the one kept for its
+    content hash, or else a new one from ``factory``."""
+    if _kept_modules is None:
+        return factory()
+    key = (path, entry['sha1'])
+    module = _kept_modules.get(key)
+    if module is None:
+        module = _kept_modules[key] = factory()
+    return module
+
+
+def _literal(tree, name):
+    for node in tree.body:
+        if not isinstance(node, (ast.Assign, ast.AnnAssign)):
+            continue
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        for target in targets:
+            if isinstance(target, ast.Name) and target.id == name:
+                value = ast.literal_eval(node.value)
+                if isinstance(value, tuple):
+                    value = list(value)
+                return value
+    return None
+
+
+def _parse(path, source):
+    """Read the revision identifiers of a script without importing it.
+
+    Scripts that compute them at import time fall back to a real import.
+    """
+    try:
+        tree = ast.parse(source, path)
+        entry = {
+            'revision': _literal(tree, 'revision'),
+            'down_revision': _literal(tree, 'down_revision'),
+            'branch_labels': _literal(tree, 'branch_labels'),
+            'depends_on': _literal(tree, 'depends_on'),
+            'baseline': _literal(tree, 'baseline'),
+            'doc': ast.get_docstring(tree, clean=False),
+        }
+    except (SyntaxError, ValueError):
+        entry = None
+    if entry is None or entry['revision'] is None:
+        dir_, filename = os.path.split(path)
+        module = util.load_python_file(dir_, filename)
+        entry = {
+            'revision': getattr(module, 'revision', None),
+            'down_revision': getattr(module, 'down_revision', None),
+            'branch_labels': getattr(module, 'branch_labels', None),
+            'depends_on': getattr(module, 'depends_on', None),
+            'baseline': getattr(module, 'baseline', None),
+            'doc': module.__doc__,
+        }
+    if entry['revision'] is None:
+        # legacy scripts only carry the revision id in their filename
+        m = _legacy_rev.match(os.path.basename(path))
+        if not m:
+            raise util.CommandError(
+                'Could not determine revision id from filename %s'
+                % os.path.basename(path))
+        entry['revision'] = m.group(1)
+    return entry
+
+
+def _list_scripts(script):
+    """Yield ``(path, key)`` for every revision file, ``key`` being the path
+    relative to the script directory."""
+    script_dir = os.path.realpath(str(script.dir))
+    recursive = getattr(script, 'recursive_version_locations', False)
+    for location in script._version_locations:
+        location = os.path.realpath(str(location))
+        if not os.path.exists(location):
+            continue
+        for root, dirs, files in os.walk(location):
+            if os.path.basename(root) == '__pycache__':
+                continue
+            prefix = os.path.relpath(root, script_dir)
+            for filename in sorted(files):
+                if _rev_file.match(filename):
+                    yield (os.path.join(root, filename),
+                           os.path.join(prefix, filename))
+            if not recursive:
+                break
+            dirs.sort()
+
+
+class RevisionIndex(object):
+    def __init__(self, script):
+        self.script = script
+        self.path = os.path.join(str(script.dir), INDEX_FILENAME)
+        self.entries = self._read()
+        self.dirty = False
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != INDEX_VERSION:
+            return {}
+        return data.get('files', {})
+
+    def write(self):
+        if not self.dirty:
+            return
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self.entries},
+                          f, indent=0, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # a read-only checkout still works, it just isn't accelerated
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.dirty = False
+
+    def entry(self, path, key):
+        stat = os.stat(path)
+        cached = self.entries.get(key)
+        if cached is not None and cached['mtime'] == stat.st_mtime_ns \
+                and cached['size'] == stat.st_size:
+            return cached
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        sha1 = hashlib.sha1(source).hexdigest()
+        if cached is not None and cached['sha1'] == sha1:
+            entry = cached
+        else:
+            entry = _parse(path, source)
+            entry['sha1'] = sha1
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.entries[key] = entry
+        self.dirty = True
+        return entry
+
+    def load_revisions(self):
+        seen = set()
+        for path, key in _list_scripts(self.script):
+            seen.add(key)
+            entry = self.entry(path, key)
+            module = kept_module(path, entry,
+                                 lambda: _LazyModule(path, entry))
+            yield Script(module, entry['revision'], path)
+        for key in set(self.entries) - seen:
+            del self.entries[key]
+            self.dirty = True
+        self.write()
+
+
+def attach(script):
+    """Make ``script`` build its revision map from the on-disk index, or
+    from the revision bundle when there is one, see
+    ``fastapi_migrate.bundle``."""
+    from fastapi_migrate.bundle import Bundle
+
+    if getattr(script, 'sourceless', False):
+        return script
+    index = RevisionIndex(script)
+    bundle = Bundle.open(script)
+    if bundle is not None:
+        script.revision_map = RevisionMap(
+            lambda: bundle.load_revisions(script, index))
+    else:
+        script.revision_map = RevisionMap(index.load_revisions)
+    return script
+
+
+class IndexedScriptDirectory(ScriptDirectory):
+    """Drop-in for ``alembic.command.ScriptDirectory``.
+
+    Only configurations that ask for it through ``config.revision_index``,
+    whose directory has a revision bundle, or that run in ``db serve``, are
+    indexed; everything else behaves exactly like alembic.
+    """
+
+    @classmethod
+    def from_config(cls, config):
+        from fastapi_migrate.bundle import bundle_path
+
+        script = ScriptDirectory.from_config(config)
+        if getattr(config, 'revision_index', False) or \
+                _kept_modules is not None or \
+                os.path.exists(bundle_path(script)):
+            attach(script)
+        return script
+
+
+def install():
+    from alembic import command
+
+    command.ScriptDirectory = IndexedScriptDirectory
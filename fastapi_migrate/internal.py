@@ -0,0 +1,33 @@
+"""Tables fastapi_migrate keeps in the application's databases.
+
+Like alembic's version table, they are not part of the models and are
+hidden from autogenerate, so ``db migrate`` never drops them and ``db
+check`` does not report them as drift.
+"""
+HISTORY_TABLE = 'fastapi_migrate_history'
+CHECKPOINT_TABLE = 'fastapi_migrate_checkpoint'
+
+
+def internal_tables(migrate):
+    """Return the names of the tables ``migrate``, a ``Migrate``, may
+    create."""
+    # op.backfill may run in any revision
+    names = set([CHECKPOINT_TABLE])
+    if migrate.run_history:
+        names.add(migrate.run_history if isinstance(migrate.run_history, str)
+                  else HISTORY_TABLE)
+    return names
+
+
+def exclude_tables(names, include_name=None):
+    """Return an ``include_name`` hook skipping the tables in ``names``,
+    then deferring to ``include_name``."""
+    names = frozenset(names)
+
+    def include(name, type_, parent_names):
+        if type_ == 'table' and name in names:
+            return False
+        if include_name is not None:
+            return include_name(name, type_, parent_names)
+        return True
+    return include
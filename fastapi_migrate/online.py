@@ -0,0 +1,107 @@
+"""Online-safe rendering of autogenerated revisions on PostgreSQL.
+
+With ``Migrate(online_ddl=True)``, ``db migrate`` rewrites the operations it
+found on existing tables before rendering them:
+
+* indexes are created and dropped with ``postgresql_concurrently=True``
+  inside ``op.get_context().autocommit_block()``;
+* foreign keys and check constraints are added with
+  ``postgresql_not_valid=True`` and validated by ``op.validate_constraint``
+  at the end of the upgrade, in an autocommit block of their own.
+
+Tables created or dropped by the same revision are left alone, including
+the indexes autogenerate lists apart from their ``create_table``.  The
+validations have nothing to undo and are left out of the downgrade.
+"""
+from alembic.autogenerate import renderers
+from alembic.autogenerate.render import _alembic_autogenerate_prefix
+from alembic.autogenerate.render import render_op
+from alembic.operations import ops
+
+from fastapi_migrate.operations import AutocommitBlockOp
+from fastapi_migrate.operations import ValidateConstraintOp
+
+
+@renderers.dispatch_for(AutocommitBlockOp)
+def _render_autocommit_block(autogen_context, op):
+    lines = []
+    for nested in op.ops:
+        for text in render_op(autogen_context, nested):
+            lines.extend('    ' + line for line in text.split('\n'))
+    if not lines:
+        return []
+    return '\n'.join(['with %sget_context().autocommit_block():'
+                      % _alembic_autogenerate_prefix(autogen_context)] + lines)
+
+
+@renderers.dispatch_for(ValidateConstraintOp)
+def _render_validate_constraint(autogen_context, op):
+    schema = ', schema=%r' % op.schema if op.schema else ''
+    return '%svalidate_constraint(%r, %r%s)' % (
+        _alembic_autogenerate_prefix(autogen_context), op.constraint_name,
+        op.table_name, schema)
+
+
+def _rewrite_table(table_ops, validations):
+    result = []
+    for op in table_ops.ops:
+        if isinstance(op, (ops.CreateIndexOp, ops.DropIndexOp)):
+            op.kw['postgresql_concurrently'] = True
+            if result and isinstance(result[-1], AutocommitBlockOp):
+                result[-1].ops.append(op)
+                continue
+            op = AutocommitBlockOp([op])
+        elif isinstance(op, ops.CreateForeignKeyOp) and op.constraint_name:
+            op.kw['postgresql_not_valid'] = True
+            validations.append(ValidateConstraintOp(
+                op.constraint_name, op.source_table,
+                schema=op.kw.get('source_schema')))
+        elif isinstance(op, ops.CreateCheckConstraintOp) and \
+                op.constraint_name:
+            op.kw['postgresql_not_valid'] = True
+            validations.append(ValidateConstraintOp(
+                op.constraint_name, op.table_name, schema=op.schema))
+        result.append(op)
+    table_ops.ops = result
+
+
+def rewrite(operations):
+    """Rewrite ``UpgradeOps`` or ``DowngradeOps`` in place."""
+    validations = []
+    # new tables are empty and dropped ones about to go
+    skipped = set((op.schema, op.table_name) for op in operations.ops
+                  if isinstance(op, (ops.CreateTableOp, ops.DropTableOp)))
+    for op in operations.ops:
+        if isinstance(op, ops.ModifyTableOps) and \
+                (op.schema, op.table_name) not in skipped:
+            _rewrite_table(op, validations)
+    if validations:
+        operations.ops.append(AutocommitBlockOp(validations))
+
+
+def _run_autogenerate(run_autogenerate):
+    def run(self, rev, migration_context):
+        run_autogenerate(self, rev, migration_context)
+        opts = migration_context.opts
+        if not opts.get('online_ddl') or opts.get('render_as_batch') or \
+                migration_context.dialect.name != 'postgresql':
+            return
+        # with several databases this runs once per database, only touch
+        # the operations of this one
+        for script in self.generated_revisions:
+            for upgrade_ops in script.upgrade_ops_list:
+                if upgrade_ops.upgrade_token == opts['upgrade_token']:
+                    rewrite(upgrade_ops)
+            for downgrade_ops in script.downgrade_ops_list:
+                if downgrade_ops.downgrade_token == opts['downgrade_token']:
+                    rewrite(downgrade_ops)
+    run._online_ddl = True
+    return run
+
+
+def install():
+    from alembic.autogenerate.api import RevisionContext
+
+    if not getattr(RevisionContext.run_autogenerate, '_online_ddl', False):
+        RevisionContext.run_autogenerate = _run_autogenerate(
+            RevisionContext.run_autogenerate)
@@ -0,0 +1,213 @@
+"""Custom operations available as ``op.<name>`` in revision scripts."""
+import hashlib
+import logging
+import time
+
+import sqlalchemy as sa
+from alembic.operations import MigrateOperation
+from alembic.operations import Operations
+from alembic.util import CommandError
+
+from fastapi_migrate.internal import CHECKPOINT_TABLE
+
+
+log = logging.getLogger(__name__)
+
+
+def _checkpoint_table(schema=None):
+    return sa.Table(
+        CHECKPOINT_TABLE, sa.MetaData(),
+        sa.Column('name', sa.String(255), primary_key=True),
+        sa.Column('position', sa.BigInteger, nullable=False),
+        schema=schema,
+    )
+
+
+@Operations.register_operation('backfill')
+class BackfillOp(MigrateOperation):
+    """Run a data migration over a table in committed, resumable chunks."""
+
+    def __init__(self, table_name, statement, key='id', start=None,
+                 stop=None, batch_size=1000, sleep=0, name=None,
+                 schema=None):
+        self.table_name = table_name
+        self.statement = statement
+        self.key = key
+        self.start = start
+        self.stop = stop
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.name = name
+        self.schema = schema
+
+    @classmethod
+    def backfill(cls, operations, table_name, statement, key='id', start=None,
+                 stop=None, batch_size=1000, sleep=0, name=None, schema=None):
+        """Run ``statement`` over ``table_name`` one key range at a time.
+
+        ``statement`` is SQL (a string or ``text()``) that restricts itself
+        with the ``:lower`` and ``:upper`` bind parameters::
+
+            op.backfill(
+                'note',
+                "UPDATE note SET num = 0 "
+                "WHERE num IS NULL AND id >= :lower AND id < :upper",
+                batch_size=10000, sleep=0.1)
+
+        The integer ``key`` column is walked from ``start`` to ``stop``
+        (inclusive, by default its current minimum and maximum) in chunks of
+        ``batch_size``.  Each chunk is committed on its own and followed by a
+        pause of ``sleep`` seconds, and the position reached is saved in the
+        ``fastapi_migrate_checkpoint`` table under ``name``, so an
+        interrupted upgrade resumes after the last committed chunk.  A chunk
+        can run twice if the process dies between the chunk and its
+        checkpoint, so the statement must be idempotent.
+
+        Entering the operation commits the migration's transaction so far.
+        In ``--sql`` mode ``start`` and ``stop`` are required and one
+        statement per chunk is rendered.
+        """
+        return operations.invoke(cls(
+            table_name, statement, key=key, start=start, stop=stop,
+            batch_size=batch_size, sleep=sleep, name=name, schema=schema))
+
+    def checkpoint_name(self):
+        if self.name:
+            return self.name
+        digest = hashlib.sha1(str(self.statement).encode('utf-8')).hexdigest()
+        return '%s.%s:%s' % (self.table_name, self.key, digest[:12])
+
+
+def _key_range(connection, operation):
+    table = sa.table(operation.table_name, sa.column(operation.key),
+                     schema=operation.schema)
+    key = table.c[operation.key]
+    start, stop = connection.execute(
+        sa.select(sa.func.min(key), sa.func.max(key))).first()
+    if operation.start is not None:
+        start = operation.start
+    if operation.stop is not None:
+        stop = operation.stop
+    return start, stop
+
+
+@Operations.implementation_for(BackfillOp)
+def backfill(operations, operation):
+    context = operations.get_context()
+    statement = operation.statement
+    if isinstance(statement, str):
+        statement = sa.text(statement)
+    batch_size = operation.batch_size
+
+    if context.as_sql:
+        if operation.start is None or operation.stop is None:
+            raise CommandError(
+                'backfill of %s needs start and stop in --sql mode'
+                % operation.table_name)
+        for lower in range(operation.start, operation.stop + 1, batch_size):
+            upper = min(lower + batch_size, operation.stop + 1)
+            operations.execute(statement.bindparams(lower=lower, upper=upper))
+        return
+
+    if context._in_connection_transaction() and context._transaction is None:
+        # autocommit_block() cannot commit a transaction it did not begin
+        raise CommandError(
+            'backfill of %s commits each chunk and needs to own the '
+            'connection, it cannot run inside a transaction begun by the '
+            'caller' % operation.table_name)
+    name = operation.checkpoint_name()
+    checkpoints = _checkpoint_table(operation.schema)
+    with context.autocommit_block():
+        connection = context.connection
+        checkpoints.create(connection, checkfirst=True)
+        start, stop = _key_range(connection, operation)
+        if start is None:
+            log.info('backfill %s: table is empty', name)
+            return
+
+        position = connection.execute(
+            sa.select(checkpoints.c.position)
+            .where(checkpoints.c.name == name)).scalar()
+        if position is None:
+            position = start
+        else:
+            log.info('backfill %s: resuming at %s', name, position)
+
+        while position <= stop:
+            upper = min(position + batch_size, stop + 1)
+            connection.execute(statement, {'lower': position, 'upper': upper})
+            updated = connection.execute(
+                checkpoints.update()
+                .where(checkpoints.c.name == name)
+                .values(position=upper))
+            if not updated.rowcount:
+                connection.execute(
+                    checkpoints.insert().values(name=name, position=upper))
+            log.debug('backfill %s: done up to %s of %s', name, upper, stop)
+            position = upper
+            if operation.sleep and position <= stop:
+                time.sleep(operation.sleep)
+
+        connection.execute(
+            checkpoints.delete().where(checkpoints.c.name == name))
+        log.info('backfill %s: finished', name)
+
+
+@Operations.register_operation('validate_constraint')
+class ValidateConstraintOp(MigrateOperation):
+    """Validate a constraint that was added ``NOT VALID``."""
+
+    def __init__(self, constraint_name, table_name, schema=None):
+        self.constraint_name = constraint_name
+        self.table_name = table_name
+        self.schema = schema
+
+    @classmethod
+    def validate_constraint(cls, operations, constraint_name, table_name,
+                            schema=None):
+        """Check the existing rows against a foreign key or check constraint
+        created with ``postgresql_not_valid=True``::
+
+            op.create_foreign_key(
+                'fk_note_user', 'note', 'user', ['user_id'], ['id'],
+                postgresql_not_valid=True)
+            with op.get_context().autocommit_block():
+                op.validate_constraint('fk_note_user', 'note')
+
+        Validation scans the table under a lock that lets reads and writes
+        through, so it belongs in its own transaction.
+        """
+        return operations.invoke(cls(constraint_name, table_name,
+                                     schema=schema))
+
+    def reverse(self):
+        # dropping the constraint undoes it, there is nothing to invalidate
+        return AutocommitBlockOp([])
+
+    def to_diff_tuple(self):
+        return ('validate_constraint', self.schema, self.table_name,
+                self.constraint_name)
+
+
+class AutocommitBlockOp(MigrateOperation):
+    """Operations rendered inside ``autocommit_block()`` by autogenerate,
+    see ``fastapi_migrate.online``; without any it renders nothing."""
+
+    def __init__(self, ops):
+        self.ops = ops
+
+    def reverse(self):
+        reversed_ops = [op.reverse() for op in reversed(self.ops)]
+        return AutocommitBlockOp([
+            op for op in reversed_ops
+            if not (isinstance(op, AutocommitBlockOp) and not op.ops)])
+
+
+@Operations.implementation_for(ValidateConstraintOp)
+def validate_constraint(operations, operation):
+    preparer = operations.get_context().impl.dialect.identifier_preparer
+    table = preparer.quote(operation.table_name)
+    if operation.schema:
+        table = '%s.%s' % (preparer.quote_schema(operation.schema), table)
+    operations.execute('ALTER TABLE %s VALIDATE CONSTRAINT %s' % (
+        table, preparer.quote(operation.constraint_name)))
@@ -0,0 +1,275 @@
+"""Expand and contract revisions for zero-downtime deploys.
+
+``db migrate --split`` sorts the operations autogenerate finds into two
+revisions.  The *expand* revision only adds: tables, columns, indexes,
+constraints.  It is safe to run while the previous release still serves
+traffic.  The *contract* revision, which depends on it, drops, renames,
+changes column types and tightens ``NOT NULL``; it runs once no old code
+is left.  A new ``NOT NULL`` column without a server default is added as
+nullable by the expand revision and made ``NOT NULL`` by the contract one.
+
+The revisions are marked with a module level ``phase = 'expand'`` or
+``phase = 'contract'``, and ``db upgrade --expand-only`` runs the pending
+revisions up to, not including, the first contract revision.
+"""
+import logging
+
+from alembic import util
+from alembic.autogenerate import RevisionContext
+from alembic.operations import ops
+from alembic.runtime.environment import EnvironmentContext
+
+from fastapi_migrate.bootstrap import _script_directory
+from fastapi_migrate.operations import AutocommitBlockOp
+from fastapi_migrate.operations import ValidateConstraintOp
+
+
+log = logging.getLogger(__name__)
+
+EXPAND = 'expand'
+CONTRACT = 'contract'
+
+# operations old code does not notice
+EXPAND_OPS = (
+    ops.CreateTableOp,
+    ops.AddColumnOp,
+    ops.CreateIndexOp,
+    ops.AddConstraintOp,
+    ops.CreateTableCommentOp,
+    ops.DropTableCommentOp,
+)
+
+
+def _copy_column(column):
+    # Column.copy() is deprecated in SQLAlchemy 1.4
+    copy = getattr(column, '_copy', None) or column.copy
+    return copy()
+
+
+def _alter_is_contract(op):
+    return (op.modify_nullable is False or op.modify_type is not None or
+            op.modify_name is not None)
+
+
+def _split_op(op):
+    """Return the (expand, contract) operations that make up ``op``."""
+    if isinstance(op, ops.ModifyTableOps):
+        expand, contract = _split_ops(op.ops)
+        return (
+            [ops.ModifyTableOps(op.table_name, expand, schema=op.schema)]
+            if expand else [],
+            [ops.ModifyTableOps(op.table_name, contract, schema=op.schema)]
+            if contract else [],
+        )
+    if isinstance(op, ops.AddColumnOp) and not op.column.nullable and \
+            op.column.server_default is None:
+        # existing rows and old code need the column to be nullable first
+        column = _copy_column(op.column)
+        column.nullable = True
+        return (
+            [ops.AddColumnOp(op.table_name, column, schema=op.schema)],
+            [ops.AlterColumnOp(op.table_name, column.name,
+                               schema=op.schema, existing_type=column.type,
+                               existing_nullable=True, modify_nullable=False)],
+        )
+    if isinstance(op, ops.AlterColumnOp):
+        if _alter_is_contract(op):
+            return [], [op]
+        return [op], []
+    if isinstance(op, EXPAND_OPS):
+        return [op], []
+    return [], [op]
+
+
+def _replace_key(op):
+    """The index or constraint ``op`` creates or drops, ``None`` for other
+    operations and unnamed constraints."""
+    if isinstance(op, (ops.CreateIndexOp, ops.DropIndexOp)):
+        name, kind = op.index_name, 'index'
+    elif isinstance(op, (ops.AddConstraintOp, ops.DropConstraintOp)):
+        name, kind = op.constraint_name, 'constraint'
+    else:
+        return None
+    if name is None:
+        return None
+    if isinstance(op, ops.CreateForeignKeyOp):
+        return kind, op.kw.get('source_schema'), op.source_table, name
+    return kind, op.schema, op.table_name, name
+
+
+def _added_keys(operations):
+    keys = set()
+    for op in operations:
+        if isinstance(op, (ops.ModifyTableOps, AutocommitBlockOp)):
+            keys.update(_added_keys(op.ops))
+        elif isinstance(op, ops.AddConstraintOp):
+            keys.add(_replace_key(op))
+    return keys
+
+
+def _dropped_keys(operations):
+    keys = set()
+    for op in operations:
+        if isinstance(op, AutocommitBlockOp):
+            keys.update(_dropped_keys(op.ops))
+        elif isinstance(op, (ops.DropIndexOp, ops.DropConstraintOp)):
+            keys.add(_replace_key(op))
+    keys.discard(None)
+    return keys
+
+
+def _split_ops(operations, contract_keys=(), dropped=None):
+    """Return the (expand, contract) operations of ``operations``;
+    ``contract_keys`` are the constraints added by the contract revision."""
+    # an index or constraint that changes is dropped and created again
+    # under the same name: the new one cannot exist next to the old one, so
+    # both go to contract
+    if dropped is None:
+        dropped = _dropped_keys(operations)
+    expand, contract = [], []
+    for op in operations:
+        if isinstance(op, (ops.CreateIndexOp, ops.AddConstraintOp)) and \
+                _replace_key(op) in dropped:
+            contract.append(op)
+            continue
+        if isinstance(op, AutocommitBlockOp):
+            # online_ddl: by the operations inside, after the constraints
+            # they validate
+            block_expand, block_contract = _split_ops(
+                op.ops, set(contract_keys) | _added_keys(contract), dropped)
+            if block_expand:
+                expand.append(AutocommitBlockOp(block_expand))
+            if block_contract:
+                contract.append(AutocommitBlockOp(block_contract))
+            continue
+        if isinstance(op, ValidateConstraintOp):
+            key = 'constraint', op.schema, op.table_name, op.constraint_name
+            (contract if key in contract_keys else expand).append(op)
+            continue
+        expand_ops, contract_ops = _split_op(op)
+        expand.extend(expand_ops)
+        contract.extend(contract_ops)
+    return expand, contract
+
+
+def _migration_script(script, rev_id, phase, parts):
+    """A copy of ``script`` with the operations in ``parts``, a list of
+    (upgrade token, downgrade token, operations) per database."""
+    new = ops.MigrationScript(
+        rev_id,
+        [ops.UpgradeOps(ops=operations, upgrade_token=upgrade_token)
+         for upgrade_token, _, operations in parts],
+        [ops.UpgradeOps(ops=operations).reverse_into(ops.DowngradeOps(
+            ops=[], downgrade_token=downgrade_token))
+         for _, downgrade_token, operations in parts],
+        message='%s (%s)' % (script.message, phase) if script.message
+        else phase,
+        imports=set(script.imports),
+        head=script.head,
+        splice=script.splice,
+        branch_label=script.branch_label,
+        version_path=script.version_path,
+        depends_on=script.depends_on,
+    )
+    new._needs_render = True
+    return new
+
+
+def split(script):
+    """Return the (phase, MigrationScript) pairs ``script`` splits into;
+    a phase without operations is left out."""
+    expand, contract = [], []
+    for upgrade_ops, downgrade_ops in zip(script.upgrade_ops_list,
+                                          script.downgrade_ops_list):
+        expand_ops, contract_ops = _split_ops(upgrade_ops.ops)
+        tokens = upgrade_ops.upgrade_token, downgrade_ops.downgrade_token
+        expand.append(tokens + (expand_ops,))
+        contract.append(tokens + (contract_ops,))
+
+    scripts = []
+    if any(operations for _, _, operations in expand):
+        scripts.append((EXPAND, _migration_script(
+            script, script.rev_id, EXPAND, expand)))
+    if any(operations for _, _, operations in contract):
+        contract_script = _migration_script(
+            script, util.rev_id() if scripts else script.rev_id, CONTRACT,
+            contract)
+        if scripts:
+            # on top of the expand revision
+            contract_script.head = scripts[0][1].rev_id
+            contract_script.splice = False
+            contract_script.branch_label = None
+            contract_script.depends_on = None
+        scripts.append((CONTRACT, contract_script))
+    return scripts
+
+
+def append_phase(script, phase, encoding='utf-8'):
+    """Mark the revision ``script`` as part of ``phase``."""
+    with open(script.path, 'a', encoding=encoding) as f:
+        f.write('\n'.join([
+            '',
+            '',
+            '# see `db migrate --split` and `db upgrade --expand-only`',
+            'phase = %r' % phase,
+            '',
+        ]))
+
+
+def revision(config, message=None, head='head', splice=False,
+             branch_label=None, version_path=None, rev_id=None):
+    """``alembic.command.revision --autogenerate``, writing an expand and a
+    contract revision.  Returns the generated scripts."""
+    script_directory = _script_directory(config)
+    revision_context = RevisionContext(
+        config,
+        script_directory,
+        dict(message=message, autogenerate=True, sql=False, head=head,
+             splice=splice, branch_label=branch_label,
+             version_path=version_path, rev_id=rev_id, depends_on=None),
+    )
+
+    def retrieve_migrations(rev, context):
+        revision_context.run_autogenerate(rev, context)
+        return []
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=retrieve_migrations,
+        as_sql=False,
+        template_args=revision_context.template_args,
+        revision_context=revision_context,
+    ):
+        script_directory.run_env()
+
+    # split once every database has been compared; env.py's hook has
+    # already dropped a revision without changes
+    phases = []
+    generated = []
+    for migration_script in revision_context.generated_revisions:
+        for phase, new in split(migration_script):
+            phases.append(phase)
+            generated.append(new)
+    revision_context.generated_revisions[:] = generated
+
+    scripts = []
+    for phase, script in zip(phases, revision_context.generate_scripts()):
+        append_phase(script, phase, script_directory.output_encoding)
+        scripts.append(script)
+    return scripts
+
+
+def expand_only(fn):
+    """Wrap an ``EnvironmentContext`` ``fn`` so that upgrades stop before
+    the first contract revision."""
+    def expand(rev, context):
+        for step in fn(rev, context):
+            revision = getattr(step, 'revision', None)
+            if step.is_upgrade and revision is not None and \
+                    getattr(revision.module, 'phase', None) == CONTRACT:
+                log.info('Stopping before contract revision %s',
+                         revision.revision)
+                return
+            yield step
+    return expand
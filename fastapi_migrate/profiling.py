@@ -0,0 +1,240 @@
+"""Per-revision and per-statement timings for ``upgrade`` and ``downgrade``.
+
+A ``Profiler`` wraps the migration steps alembic runs and, on a live
+connection, listens to every SQL statement they execute.  Each finished
+statement and revision becomes a record (a plain, JSON-serialisable dict)
+handed to every sink: a callable such as the ``profile`` hook of ``Migrate``,
+or ``JsonLines``, which appends the records to a file::
+
+    {"type": "statement", "revision": "1c8e7b2a", "engine_name": "",
+     "statement": "ALTER TABLE ...", "elapsed": 0.0021, "rowcount": -1, ...}
+    {"type": "revision", "revision": "1c8e7b2a", "direction": "upgrade",
+     "elapsed": 0.0154, "statements": 3, "rows": 120, "ok": true, ...}
+
+``rows`` adds up the row counts reported by the statements of a revision.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from functools import wraps
+
+from sqlalchemy import event
+from alembic.runtime.environment import EnvironmentContext
+from alembic.util import CommandError
+
+from fastapi_migrate import phases
+from fastapi_migrate.bootstrap import _script_directory
+
+
+log = logging.getLogger(__name__)
+
+
+class JsonLines(object):
+    """Sink appending one JSON object per record to ``path``, or to
+    standard output when ``path`` is ``'-'``."""
+
+    def __init__(self, path):
+        self.path = path
+        if path == '-':
+            self.file = sys.stdout
+        else:
+            self.file = open(path, 'a')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class Profiler(object):
+    def __init__(self, sinks, history=None):
+        self.sinks = list(sinks)
+        # a fastapi_migrate.history.RunHistory
+        self.history = history
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        with self.lock:
+            for sink in self.sinks:
+                try:
+                    sink(record)
+                except Exception as exc:
+                    # metrics must never break a migration
+                    log.warning('Profile sink %r failed: %s', sink, exc)
+
+    def close(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+    def _timed(self, step, current, impl, connection):
+        migration_fn = step.migration_fn
+        revision = getattr(step, 'revision', None)
+
+        # alembic logs steps by the name of their function
+        @wraps(migration_fn)
+        def run(**kw):
+            record = {
+                'type': 'revision',
+                'revision': getattr(revision, 'revision', None),
+                'down_revision': getattr(revision, 'down_revision', None),
+                'doc': getattr(revision, 'doc', None),
+                'direction': 'upgrade' if step.is_upgrade else 'downgrade',
+                'engine_name': kw.get('engine_name', ''),
+                'started': time.time(),
+                'statements': 0,
+                'rows': 0,
+                # earlier attempts that timed out on a lock, see
+                # fastapi_migrate.timeouts
+                'retries': getattr(impl, 'lock_retries', 0),
+                'ok': False,
+            }
+            if isinstance(record['down_revision'], tuple):
+                record['down_revision'] = list(record['down_revision'])
+            current['revision'] = record
+            # table copies held back by fastapi_migrate.batch
+            coalescer = getattr(impl, 'batch_coalescer', None)
+            start = time.perf_counter()
+            try:
+                migration_fn(**kw)
+                if coalescer is not None:
+                    coalescer.end_step()
+                record['ok'] = True
+            finally:
+                record['elapsed'] = time.perf_counter() - start
+                del current['revision']
+                log.info('%s %s took %.3fs (%d statements)',
+                         record['direction'], record['revision'],
+                         record['elapsed'], record['statements'])
+                self.emit(record)
+            if self.history is not None and connection is not None:
+                if coalescer is not None:
+                    coalescer.bookkeeping.add(self.history.table)
+                # in the transaction of the revision
+                self.history.insert(connection, record)
+        return run
+
+    def wrap(self, fn):
+        """Wrap an ``EnvironmentContext`` ``fn`` so that the steps it
+        returns are timed."""
+        def profiled(rev, context):
+            current = {}
+            starts = []
+
+            def before_cursor_execute(conn, cursor, statement, parameters,
+                                      execution_context, executemany):
+                starts.append(time.perf_counter())
+
+            def after_cursor_execute(conn, cursor, statement, parameters,
+                                     execution_context, executemany):
+                elapsed = time.perf_counter() - starts.pop()
+                record = current.get('revision')
+                if record is None:
+                    # version table bookkeeping between steps
+                    return
+                record['statements'] += 1
+                record['rows'] += max(cursor.rowcount or 0, 0)
+                self.emit({
+                    'type': 'statement',
+                    'revision': record['revision'],
+                    'engine_name': record['engine_name'],
+                    'statement': statement,
+                    'executemany': executemany,
+                    'rowcount': cursor.rowcount,
+                    'elapsed': elapsed,
+                })
+
+            connection = None if context.as_sql else context.connection
+            if connection is not None and self.history is not None:
+                self.history.create(connection)
+            if connection is not None:
+                event.listen(connection, 'before_cursor_execute',
+                             before_cursor_execute)
+                event.listen(connection, 'after_cursor_execute',
+                             after_cursor_execute)
+            try:
+                for step in fn(rev, context):
+                    step.migration_fn = self._timed(step, current,
+                                                    context.impl, connection)
+                    yield step
+            finally:
+                if connection is not None:
+                    event.remove(connection, 'before_cursor_execute',
+                                 before_cursor_execute)
+                    event.remove(connection, 'after_cursor_execute',
+                                 after_cursor_execute)
+        return profiled
+
+
+def make_profiler(*sinks, **kwargs):
+    """Return a ``Profiler`` for the given sinks, skipping ``None``; a sink
+    that is not callable is taken as a ``JsonLines`` path.  A ``history``
+    keyword argument records the revisions in the run history table."""
+    history = kwargs.pop('history', None)
+    sinks = [sink if callable(sink) else JsonLines(sink)
+             for sink in sinks if sink is not None]
+    if not sinks and history is None:
+        return None
+    return Profiler(sinks, history=history)
+
+
+def upgrade(config, revision, sql=False, tag=None, profiler=None,
+            expand_only=False):
+    """``alembic.command.upgrade`` with the steps timed by ``profiler``;
+    ``expand_only`` stops before the first contract revision, see
+    ``fastapi_migrate.phases``."""
+
+    script = _script_directory(config)
+    starting_rev = None
+    if ':' in revision:
+        if not sql:
+            raise CommandError('Range revision not allowed')
+        starting_rev, revision = revision.split(':', 2)
+
+    def upgrade(rev, context):
+        return script._upgrade_revs(revision, rev)
+
+    if expand_only:
+        upgrade = phases.expand_only(upgrade)
+    with EnvironmentContext(
+        config,
+        script,
+        fn=profiler.wrap(upgrade) if profiler is not None else upgrade,
+        as_sql=sql,
+        starting_rev=starting_rev,
+        destination_rev=revision,
+        tag=tag,
+    ):
+        script.run_env()
+
+
+def downgrade(config, revision, sql=False, tag=None, profiler=None):
+    """``alembic.command.downgrade`` with the steps timed by ``profiler``."""
+    script = _script_directory(config)
+    starting_rev = None
+    if ':' in revision:
+        if not sql:
+            raise CommandError('Range revision not allowed')
+        starting_rev, revision = revision.split(':', 2)
+    elif sql:
+        raise CommandError(
+            'downgrade with --sql requires <fromrev>:<torev>')
+
+    def downgrade(rev, context):
+        return script._downgrade_revs(revision, rev)
+
+    with EnvironmentContext(
+        config,
+        script,
+        fn=profiler.wrap(downgrade) if profiler is not None else downgrade,
+        as_sql=sql,
+        starting_rev=starting_rev,
+        destination_rev=revision,
+        tag=tag,
+    ):
+        script.run_env()
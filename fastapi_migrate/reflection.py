@@ -0,0 +1,237 @@
+"""Scoped and cached database reflection for autogenerate.
+
+``include_model_names`` builds an alembic ``include_name`` hook that stops
+autogenerate from reflecting tables and schemas the models don't mention.
+
+``ReflectionCache`` persists the SQLAlchemy inspector's ``info_cache``, keyed
+by database URL and by a cheap fingerprint of the database schema, so
+repeated ``migrate`` runs against an unchanged schema skip reflection
+queries.  It reaches autogenerate through the ``reflection_cache`` option of
+``context.configure``.
+
+The cache holds SQLAlchemy objects and is pickled, and unpickling runs code,
+so it is kept out of the source tree: in a directory of the user's cache
+(``$XDG_CACHE_HOME/fastapi_migrate``, ``~/.cache/fastapi_migrate`` by
+default) only they can write to, one file per migrations directory.  A file
+another user could have written is ignored.
+"""
+import hashlib
+import logging
+import os
+import pickle
+
+import sqlalchemy as sa
+from alembic import util
+
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+
+def model_schemas(metadata):
+    return set(table.schema for table in metadata.tables.values())
+
+
+def _table_key(schema, name):
+    if schema is None:
+        return name
+    return '%s.%s' % (schema, name)
+
+
+def include_model_names(metadata, include_name=None):
+    """Return an ``include_name`` hook limited to the tables in ``metadata``.
+
+    Tables that exist only in the database are never reflected, so
+    autogenerate can no longer propose dropping them.  The model tables are
+    read on every call, so models imported after ``Migrate`` are included.
+    """
+    def include(name, type_, parent_names):
+        if type_ == 'schema' and name not in model_schemas(metadata):
+            return False
+        if type_ == 'table' and \
+                metadata.tables.get(_table_key(parent_names.get('schema_name'), name)) is None:
+            return False
+        if include_name is not None:
+            return include_name(name, type_, parent_names)
+        return True
+    return include
+
+
+_COLUMNS_QUERY = (
+    "SELECT table_schema, table_name, column_name, data_type, is_nullable, "
+    "column_default, character_maximum_length, numeric_precision, "
+    "numeric_scale FROM information_schema.columns "
+    "WHERE %s ORDER BY 1, 2, 3",
+    'table_schema',
+)
+_CONSTRAINTS_QUERY = (
+    "SELECT table_schema, table_name, constraint_name, constraint_type "
+    "FROM information_schema.table_constraints "
+    "WHERE %s ORDER BY 1, 2, 3",
+    'table_schema',
+)
+_INDEXES_QUERIES = {
+    'postgresql': (
+        "SELECT schemaname, tablename, indexdef FROM pg_indexes "
+        "WHERE %s ORDER BY 1, 2, 3",
+        'schemaname',
+    ),
+    'mysql': (
+        "SELECT table_schema, table_name, index_name, column_name, "
+        "seq_in_index, non_unique FROM information_schema.statistics "
+        "WHERE %s ORDER BY 1, 2, 3, 5",
+        'table_schema',
+    ),
+}
+_INDEXES_QUERIES['mariadb'] = _INDEXES_QUERIES['mysql']
+
+
+def _query(query, schemas):
+    template, column = query
+    if schemas is None:
+        return sa.text(template % (
+            "%s NOT IN ('information_schema', 'pg_catalog')" % column))
+    return sa.text(template % ('%s IN :schemas' % column)).bindparams(
+        sa.bindparam('schemas', sorted(schemas), expanding=True))
+
+
+def schema_fingerprint(connection, schemas=None):
+    """Return a value that changes whenever the database schema changes.
+
+    This costs one to three catalog queries, against one or more per table
+    for a full reflection.  ``schemas`` limits them to the tables of those
+    schemas, ``None`` standing for the default schema; without it they
+    cover the whole database.  ``None`` means the dialect is not supported.
+    """
+    dialect_name = connection.dialect.name
+    if dialect_name == 'sqlite':
+        return str(connection.exec_driver_sql('PRAGMA schema_version').scalar())
+    if dialect_name not in _INDEXES_QUERIES:
+        return None
+    if schemas is not None:
+        schemas = set(connection.dialect.default_schema_name
+                      if schema is None else schema for schema in schemas)
+    digest = hashlib.sha1()
+    for query in (_COLUMNS_QUERY, _CONSTRAINTS_QUERY,
+                  _INDEXES_QUERIES[dialect_name]):
+        for row in connection.execute(_query(query, schemas)):
+            digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fastapi_migrate')
+
+
+def cache_path(directory):
+    """The cache file of the migrations ``directory``."""
+    key = hashlib.sha1(os.path.abspath(directory).encode('utf-8'))
+    return os.path.join(cache_directory(),
+                        'reflection-%s.pickle' % key.hexdigest()[:16])
+
+
+def _trusted(f):
+    """Whether only the current user can have written the open file ``f``,
+    or replaced it in its directory."""
+    if not hasattr(os, 'getuid'):
+        return True
+    for st in (os.fstat(f.fileno()), os.stat(os.path.dirname(f.name))):
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            return False
+    return True
+
+
+class ReflectionCache(object):
+    def __init__(self, directory, models_only=False):
+        self.path = cache_path(directory)
+        # reflect_models_only: no other schema is reflected
+        self.models_only = models_only
+        self.entries = None
+        self.loaded = set()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                if not _trusted(f):
+                    log.warning('Ignoring the reflection cache %s, other '
+                                'users can write to it', self.path)
+                    raise ValueError(self.path)
+                version, entries = pickle.load(f)
+        except Exception:
+            # missing, stale or unreadable, start afresh
+            version, entries = None, {}
+        self.entries = entries if version == CACHE_VERSION else {}
+        self.loaded = set(self.entries)
+
+    def info_cache(self, connection, schemas=None):
+        """Return the ``info_cache`` to give the inspector of ``connection``,
+        which reflects ``schemas``, or any schema with ``None``."""
+        self._load()
+        key = connection.engine.url.render_as_string(hide_password=True)
+        fingerprint = schema_fingerprint(connection, schemas)
+        if fingerprint is None:
+            return {}
+        cached = self.entries.get(key)
+        from_disk = key in self.loaded
+        self.loaded.discard(key)
+        if cached is not None and cached[0] == fingerprint:
+            if from_disk:
+                log.info('Reusing cached reflection for %s', key)
+            return cached[1]
+        info_cache = {}
+        self.entries[key] = (fingerprint, info_cache)
+        return info_cache
+
+    def save(self):
+        if not self.entries:
+            return
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((CACHE_VERSION, self.entries), f)
+            os.replace(tmp_path, self.path)
+        except Exception as exc:
+            log.warning('Could not save the reflection cache: %s', exc)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _inspector(self):
+    if self.connection is None:
+        raise TypeError(
+            "can't return inspector as this "
+            "AutogenContext has no database connection"
+        )
+    inspector = sa.inspect(self.connection)
+    opts = self.migration_context.opts
+    cache = opts.get('reflection_cache')
+    if cache is not None:
+        inspector.info_cache = cache.info_cache(
+            self.connection, _reflected_schemas(self, cache))
+    return inspector
+
+
+def _reflected_schemas(autogen_context, cache):
+    """The schemas autogenerate reflects, ``None`` when it may be any."""
+    if autogen_context.opts.get('include_schemas') and not cache.models_only:
+        return None
+    schemas = set([None])
+    for metadata in util.to_list(autogen_context.metadata or []):
+        schemas.update(model_schemas(metadata))
+    return schemas
+
+
+def install():
+    from alembic.autogenerate.api import AutogenContext
+
+    AutogenContext.inspector = util.memoized_property(_inspector)
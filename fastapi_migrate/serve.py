@@ -0,0 +1,226 @@
+"""A warm process running ``db`` commands sent over a Unix socket.
+
+``db serve`` imports alembic once, keeps the application, its ``Migrate``
+state, the reflection cache and the imported revision modules, and runs
+the ``db`` commands it receives one after the other.  A command line that
+starts with::
+
+    from fastapi_migrate.serve import forward
+    forward()
+
+before importing the application sends ``db ...`` invocations to the
+daemon, prints their output and exits with their status.  When no daemon
+is listening ``forward()`` returns and the command runs in-process as
+usual.
+
+The socket is ``.serve.sock`` in the migration directory, relative to the
+working directory, or the ``FASTAPI_MIGRATE_SOCKET`` environment variable.
+``db serve`` takes the directory of ``Migrate`` or its ``--directory``;
+``forward()`` the ``--directory`` of the command, else its ``directory``
+argument, which must be the one given to ``Migrate`` when it is not
+``migrations``.  The protocol is a
+JSON line ``{"args": [...], "cwd": ...}`` answered by ``{"out": ...}`` and
+``{"err": ...}`` lines as the command writes, then ``{"exit": status}``.
+"""
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+
+SOCKET_FILENAME = '.serve.sock'
+SOCKET_ENV = 'FASTAPI_MIGRATE_SOCKET'
+
+# commands that need the terminal or the daemon itself
+LOCAL_COMMANDS = ('serve', 'edit')
+
+
+def socket_path(directory='migrations'):
+    return os.environ.get(SOCKET_ENV) or os.path.join(directory,
+                                                      SOCKET_FILENAME)
+
+
+def _connect(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def _directory_option(args):
+    for i, arg in enumerate(args):
+        if arg in ('-d', '--directory') and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith('--directory='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+def forward(args=None, path=None, group='db', directory='migrations'):
+    """Run the ``group`` command in ``args`` (``sys.argv[1:]`` by default)
+    on the daemon and exit with its status; return when there is no daemon
+    or the command is not a ``group`` command.  ``directory`` is the
+    migration directory of the ``Migrate`` the daemon serves."""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) < 2 or args[0] != group or args[1] in LOCAL_COMMANDS:
+        return
+    client = _connect(path or socket_path(_directory_option(args[2:]) or
+                                          directory))
+    if client is None:
+        return
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps({'args': list(args[1:]),
+                                 'cwd': os.getcwd()}).encode('utf-8') + b'\n')
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode('utf-8'))
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'exit' in message:
+                sys.exit(message['exit'])
+    sys.stderr.write('The migration daemon closed the connection\n')
+    sys.exit(1)
+
+
+class _Output(object):
+    """Stands for ``sys.stdout`` or ``sys.stderr`` in the daemon.
+
+    Log handlers keep the stream they were created with, so the daemon
+    replaces the streams once and sends writes to the client of the running
+    command, if any.
+    """
+
+    def __init__(self, key, stream):
+        self.key = key
+        self.stream = stream
+        self.client = None
+
+    @property
+    def encoding(self):
+        return getattr(self.stream, 'encoding', 'utf-8')
+
+    def write(self, data):
+        if self.client is None:
+            return self.stream.write(data)
+        try:
+            self.client.sendall(json.dumps({self.key: data}).encode('utf-8')
+                                + b'\n')
+        except OSError:
+            # the client went away, let the command finish anyway
+            self.client = None
+        return len(data)
+
+    def flush(self):
+        if self.client is None:
+            self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.stream.fileno()
+
+
+def _run(group, args):
+    """Run ``group`` with ``args`` and return its exit status."""
+    import click
+
+    try:
+        result = group.main(args=args, prog_name=group.name,
+                            standalone_mode=False)
+    except click.exceptions.Exit as exc:
+        return exc.exit_code
+    except click.ClickException as exc:
+        exc.show()
+        return exc.exit_code
+    except click.Abort:
+        sys.stderr.write('Aborted!\n')
+        return 1
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            return exc.code or 0
+        sys.stderr.write('%s\n' % exc.code)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return result if isinstance(result, int) else 0
+
+
+def _handle(client, group, outputs):
+    with client.makefile('rb') as stream:
+        line = stream.readline()
+    if not line:
+        return
+    request = json.loads(line.decode('utf-8'))
+    cwd = os.getcwd()
+    for output in outputs:
+        output.client = client
+    try:
+        os.chdir(request.get('cwd') or cwd)
+        status = _run(group, request['args'])
+    finally:
+        sys.stdout.flush()
+        for output in outputs:
+            output.client = None
+        os.chdir(cwd)
+    client.sendall(json.dumps({'exit': status}).encode('utf-8') + b'\n')
+
+
+def _listen(path):
+    if os.path.exists(path):
+        client = _connect(path)
+        if client is not None:
+            client.close()
+            raise RuntimeError('A migration daemon is already listening on '
+                               '%s' % path)
+        # left behind by a daemon that did not exit cleanly
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    return server
+
+
+def serve(group, path):
+    """Run the commands of ``group`` sent to the socket ``path``, one at a
+    time, until interrupted."""
+    from fastapi_migrate import command  # noqa: F401, imports alembic
+    from fastapi_migrate import index
+
+    index.keep_modules()
+    server = _listen(path)
+    # stop on SIGTERM as on Ctrl+C, removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    outputs = [_Output('out', sys.stdout), _Output('err', sys.stderr)]
+    sys.stdout, sys.stderr = outputs
+    try:
+        while True:
+            client, _ = server.accept()
+            with client:
+                try:
+                    _handle(client, group, outputs)
+                except OSError as exc:
+                    if exc.errno not in (errno.EPIPE, errno.ECONNRESET):
+                        raise
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout, sys.stderr = outputs[0].stream, outputs[1].stream
+        server.close()
+        os.remove(path)
@@ -0,0 +1,646 @@
+"""Snapshots of the model metadata stored in revisions, and autogenerate
+without a database.
+
+With ``Migrate(metadata_snapshot=True)``, every revision autogenerated by
+``db migrate`` or ``db revision --autogenerate``, and written by ``db
+squash``, ends with ``metadata_snapshot``, the tables, columns, indexes and
+constraints of the models at that revision, as compressed JSON.
+``db migrate --offline`` compares the models with the snapshot of the head
+revision instead of with a live database.
+
+The comparison covers tables, columns (type, nullability, server default,
+comment), indexes, unique and foreign key constraints and table comments.
+Types are stored as their class and the constructor arguments that differ
+from the defaults, and compare by that, so unlike autogenerate against a
+database it never reports the differences between a model type and what
+the database reflects it as.  A type with an argument that cannot be
+stored is not compared.
+"""
+import ast
+import base64
+import importlib
+import inspect
+import json
+import logging
+import sys
+import textwrap
+import zlib
+
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+from alembic import util
+from alembic.autogenerate import render
+from alembic.autogenerate.api import AutogenContext
+from alembic.operations import ops
+from alembic.runtime.migration import MigrationContext
+
+from fastapi_migrate.binds import bind_metadata
+from fastapi_migrate.binds import bind_names
+from fastapi_migrate.binds import bind_uri
+
+
+log = logging.getLogger(__name__)
+
+# 2: types as class and arguments instead of repr()
+VERSION = 2
+
+_MISSING = object()
+
+
+def _name(name):
+    # unnamed constraints carry a falsy _NoneName
+    return str(name) if isinstance(name, str) else None
+
+
+def _server_default(column):
+    default = column.server_default
+    if not isinstance(default, sa.DefaultClause):
+        return None
+    arg = default.arg
+    if isinstance(arg, str):
+        return {'value': arg}
+    return {'text': str(getattr(arg, 'text', arg))}
+
+
+def _column_names(columns):
+    return [column.name if isinstance(column, sa.Column) else str(column)
+            for column in columns]
+
+
+def _argument(value):
+    """Return the JSON of a type argument, ``_MISSING`` if it has none."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, sa.types.TypeEngine):
+        return {'type': _type_data(value)}
+    if isinstance(value, (list, tuple)):
+        items = [_argument(item) for item in value]
+        return _MISSING if any(item is _MISSING for item in items) else items
+    return _MISSING
+
+
+def _type_data(type_):
+    """Return ``type_`` as its class and the constructor arguments, read
+    from the attributes of the same name, that differ from the defaults.
+    ``exact`` is false when an argument has no JSON form."""
+    cls = type(type_)
+    data = {'class': cls.__name__, 'module': cls.__module__, 'args': [],
+            'kwargs': {}, 'exact': True}
+    try:
+        parameters = list(inspect.signature(cls.__init__).parameters.values())
+    except (TypeError, ValueError):
+        parameters = []
+    for parameter in parameters[1:]:
+        if parameter.kind == parameter.VAR_KEYWORD:
+            continue
+        value = getattr(type_, parameter.name, _MISSING)
+        if value is _MISSING or (parameter.default is not parameter.empty
+                                 and _equal(value, parameter.default)):
+            continue
+        value = _argument(value)
+        if value is _MISSING:
+            data['exact'] = False
+        elif parameter.kind == parameter.VAR_POSITIONAL:
+            data['args'] = list(value)
+        else:
+            data['kwargs'][parameter.name] = value
+    if isinstance(type_, sa.Enum):
+        # keyword arguments only, Enum(*enums, **kw)
+        for name in ('name', 'schema', 'native_enum'):
+            value = getattr(type_, name, None)
+            if value is not None and value is not True:
+                data['kwargs'][name] = value
+    if isinstance(type_, sa.types.TypeDecorator):
+        data['impl'] = _type_data(type_.impl)
+        data['exact'] = data['exact'] and data['impl']['exact']
+    return data
+
+
+def _equal(value, default):
+    try:
+        return bool(value == default)
+    except Exception:
+        return False
+
+
+def _table(table):
+    return {
+        'name': table.name,
+        'schema': table.schema,
+        'bind_key': table.info.get('bind_key'),
+        'comment': table.comment,
+        'columns': [{
+            'name': column.name,
+            'type': _type_data(column.type),
+            'nullable': column.nullable,
+            'primary_key': column.primary_key,
+            'autoincrement': column.autoincrement,
+            'server_default': _server_default(column),
+            'comment': column.comment,
+        } for column in table.columns],
+        'primary_key': _name(table.primary_key.name),
+        'indexes': sorted(({
+            'name': _name(index.name),
+            'columns': _column_names(index.expressions),
+            'unique': bool(index.unique),
+        } for index in table.indexes), key=lambda index: index['name'] or ''),
+        'unique_constraints': sorted(({
+            'name': _name(constraint.name),
+            'columns': _column_names(constraint.columns),
+        } for constraint in table.constraints
+            if isinstance(constraint, sa.UniqueConstraint)),
+            key=lambda constraint: (constraint['name'] or '',
+                                    constraint['columns'])),
+        'foreign_keys': sorted(({
+            'name': _name(constraint.name),
+            'columns': [element.parent.name
+                        for element in constraint.elements],
+            'referred_table': constraint.elements[0].target_fullname
+            .rsplit('.', 1)[0],
+            'referred_columns': [element.target_fullname.rsplit('.', 1)[1]
+                                 for element in constraint.elements],
+            'ondelete': constraint.ondelete,
+            'onupdate': constraint.onupdate,
+        } for constraint in table.foreign_key_constraints),
+            key=lambda constraint: (constraint['name'] or '',
+                                    constraint['columns'])),
+        'check_constraints': sorted(({
+            'name': _name(constraint.name),
+            'sqltext': str(constraint.sqltext),
+        } for constraint in table.constraints
+            if isinstance(constraint, sa.CheckConstraint)
+            and not getattr(constraint, '_type_bound', False)),
+            key=lambda constraint: (constraint['name'] or '',
+                                    constraint['sqltext'])),
+    }
+
+
+def serialize(metadata):
+    """Return the snapshot of ``metadata`` as a JSON-serialisable dict."""
+    return {
+        'version': VERSION,
+        'naming_convention': dict(
+            (key if isinstance(key, str) else key.__name__, value)
+            for key, value in metadata.naming_convention.items()
+            if isinstance(value, str)),
+        'tables': [_table(table) for table in metadata.sorted_tables],
+    }
+
+
+def dumps(metadata):
+    data = json.dumps(serialize(metadata), sort_keys=True,
+                      separators=(',', ':'))
+    return base64.b64encode(zlib.compress(data.encode('utf-8'), 9)) \
+        .decode('ascii')
+
+
+def loads(data):
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode('utf-8'))
+
+
+def _type_class(data):
+    module = sys.modules.get(data['module'])
+    if module is None and data['module'].split('.')[0] == 'sqlalchemy':
+        # only SQLAlchemy's own modules, the types and the dialects, are
+        # imported; the modules of custom types are loaded with the models
+        try:
+            module = importlib.import_module(data['module'])
+        except ImportError:
+            module = None
+    cls = getattr(module, data['class'], None)
+    if cls is None:
+        cls = getattr(sa.types, data['class'], None)
+    if isinstance(cls, type) and issubclass(cls, sa.types.TypeEngine):
+        return cls
+    return None
+
+
+def _value(value):
+    if isinstance(value, dict):
+        type_ = _build_type(value['type'])
+        if type_ is None:
+            raise ValueError('cannot rebuild %s' % value['type']['class'])
+        return type_
+    if isinstance(value, list):
+        return [_value(item) for item in value]
+    return value
+
+
+def _build_type(data):
+    """Return the type described by ``data``, None if it cannot be
+    rebuilt."""
+    cls = _type_class(data)
+    if cls is None:
+        return None
+    try:
+        return cls(*_value(data['args']),
+                   **dict((name, _value(value))
+                          for name, value in data['kwargs'].items()))
+    except Exception:
+        return None
+
+
+def _literal(node, module):
+    if isinstance(node, ast.Call):
+        return {'type': _call(node, module)}
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_literal(item, module) for item in node.elts]
+    return ast.literal_eval(node)
+
+
+def _call(node, module):
+    # Name(...) or module.Name(...)
+    func = node.func
+    if not isinstance(func, (ast.Name, ast.Attribute)) or node.keywords and \
+            any(keyword.arg is None for keyword in node.keywords):
+        raise ValueError('not a type')
+    return {'class': func.id if isinstance(func, ast.Name) else func.attr,
+            'module': module,
+            'args': [_literal(arg, 'sqlalchemy.types') for arg in node.args],
+            'kwargs': dict((keyword.arg,
+                            _literal(keyword.value, 'sqlalchemy.types'))
+                           for keyword in node.keywords),
+            'exact': True}
+
+
+def _legacy_type(column):
+    """Return the type data of a version 1 snapshot, which stored the
+    ``repr()`` of the type.  It is parsed, never evaluated."""
+    try:
+        data = _call(ast.parse(column['type'], mode='eval').body,
+                     column['type_module'])
+    except (SyntaxError, ValueError):
+        data = None
+    type_ = _build_type(data) if data is not None else None
+    if type_ is None:
+        return {'class': column['type'], 'module': column['type_module'],
+                'args': [], 'kwargs': {}, 'exact': False}
+    # as the models would store it
+    return _type_data(type_)
+
+
+def _column(column):
+    data = column['type']
+    if not isinstance(data, dict):
+        data = _legacy_type(column)
+    if not data['exact']:
+        log.warning('Type %s of column %s has arguments that were not stored, '
+                    'it is not compared', data['class'], column['name'])
+    type_ = _build_type(data)
+    if type_ is None:
+        # compared by the stored data all the same
+        log.warning('Cannot rebuild type %s of column %s', data['class'],
+                    column['name'])
+        type_ = sa.types.NullType()
+    server_default = column['server_default']
+    if server_default is not None:
+        server_default = server_default['value'] if 'value' in server_default \
+            else sa.text(server_default['text'])
+    return sa.Column(column['name'], type_,
+                     nullable=column['nullable'],
+                     primary_key=column['primary_key'],
+                     server_default=server_default,
+                     comment=column['comment'],
+                     autoincrement=column['autoincrement'],
+                     info={'snapshot_type': data})
+
+
+def to_metadata(snapshot):
+    """Rebuild a ``MetaData`` from a snapshot made by ``serialize``."""
+    metadata = sa.MetaData(
+        naming_convention=snapshot.get('naming_convention') or None)
+    for data in snapshot['tables']:
+        table = sa.Table(
+            data['name'], metadata,
+            *[_column(column) for column in data['columns']],
+            schema=data['schema'], comment=data['comment'],
+            info={'bind_key': data['bind_key']} if data['bind_key'] else {})
+        if data['primary_key']:
+            table.primary_key.name = data['primary_key']
+        for index in data['indexes']:
+            sa.Index(index['name'],
+                     *[table.c[name] if name in table.c else sa.text(name)
+                       for name in index['columns']],
+                     unique=index['unique'])
+        for constraint in data['unique_constraints']:
+            table.append_constraint(sa.UniqueConstraint(
+                *constraint['columns'], name=constraint['name']))
+        for constraint in data['foreign_keys']:
+            table.append_constraint(sa.ForeignKeyConstraint(
+                constraint['columns'],
+                ['%s.%s' % (constraint['referred_table'], name)
+                 for name in constraint['referred_columns']],
+                name=constraint['name'], ondelete=constraint['ondelete'],
+                onupdate=constraint['onupdate']))
+        for constraint in data['check_constraints']:
+            table.append_constraint(sa.CheckConstraint(
+                sa.text(constraint['sqltext']), name=constraint['name']))
+    return metadata
+
+
+def render_snapshot(metadata):
+    """Return the lines appended to a revision for ``metadata``."""
+    chunks = textwrap.wrap(dumps(metadata), 72)
+    return '\n'.join([
+        '',
+        '',
+        '# the models at this revision, see `db migrate --offline`',
+        'metadata_snapshot = (',
+    ] + ['    %r' % chunk for chunk in chunks] + [
+        ')',
+        '',
+    ])
+
+
+def append(script, metadata, encoding='utf-8'):
+    """Store the snapshot of ``metadata`` in the revision ``script``."""
+    with open(script.path, 'a', encoding=encoding) as f:
+        f.write(render_snapshot(metadata))
+
+
+# comparison
+
+def _key(table):
+    return (table.schema, table.name)
+
+
+def _by_key(items, key):
+    return dict((key(item), item) for item in items)
+
+
+def _index_key(index):
+    return index.name or tuple(_column_names(index.expressions))
+
+
+def _index_data(index):
+    return (_column_names(index.expressions), bool(index.unique))
+
+
+def _unique_key(constraint):
+    return _name(constraint.name) or tuple(_column_names(constraint.columns))
+
+
+def _foreign_key_key(constraint):
+    return _name(constraint.name) or (
+        tuple(element.parent.name for element in constraint.elements),
+        tuple(element.target_fullname for element in constraint.elements))
+
+
+def _foreign_key_data(constraint):
+    return ([element.parent.name for element in constraint.elements],
+            [element.target_fullname for element in constraint.elements],
+            constraint.ondelete, constraint.onupdate)
+
+
+def _uniques(table):
+    return [constraint for constraint in table.constraints
+            if isinstance(constraint, sa.UniqueConstraint)]
+
+
+def _column_type(column):
+    # the stored type of a snapshot column, not the one rebuilt from it
+    return column.info.get('snapshot_type') or _type_data(column.type)
+
+
+def _type_changed(old, new):
+    old_data, new_data = _column_type(old), _column_type(new)
+    if not old_data['exact'] or not new_data['exact']:
+        return False
+    return json.loads(json.dumps(old_data)) != json.loads(json.dumps(new_data))
+
+
+def _column_data(column):
+    return (column.nullable, _server_default(column), column.comment)
+
+
+def _compare_columns(table_ops, old_table, new_table):
+    schema, name = _key(new_table)
+    old_columns = _by_key(old_table.columns, lambda column: column.name)
+    for column in new_table.columns:
+        if column.name not in old_columns:
+            table_ops.append(ops.AddColumnOp.from_column_and_tablename(
+                schema, name, column))
+            continue
+        old = old_columns[column.name]
+        type_changed = _type_changed(old, column)
+        if not type_changed and _column_data(old) == _column_data(column):
+            continue
+        default_changed = _server_default(old) != _server_default(column)
+        table_ops.append(ops.AlterColumnOp(
+            name, column.name, schema=schema,
+            existing_type=column.type
+            if isinstance(old.type, sa.types.NullType) else old.type,
+            existing_nullable=old.nullable,
+            existing_server_default=old.server_default or False,
+            existing_comment=old.comment,
+            modify_type=column.type if type_changed else None,
+            modify_nullable=column.nullable
+            if old.nullable != column.nullable else None,
+            modify_server_default=(column.server_default or False)
+            if default_changed else False,
+            modify_comment=column.comment
+            if old.comment != column.comment else False,
+        ))
+    new_columns = set(column.name for column in new_table.columns)
+    for column in old_table.columns:
+        if column.name not in new_columns:
+            table_ops.append(ops.DropColumnOp.from_column_and_tablename(
+                schema, name, column))
+
+
+def _compare_items(drops, creates, old_items, new_items, key, data, create,
+                   drop):
+    old = _by_key(old_items, key)
+    new = _by_key(new_items, key)
+    for item_key, item in old.items():
+        if item_key not in new or data(item) != data(new[item_key]):
+            drops.append(drop(item))
+    for item_key, item in new.items():
+        if item_key not in old or data(item) != data(old[item_key]):
+            creates.append(create(item))
+
+
+def _compare_table(old_table, new_table):
+    # constraints go before the columns they cover and come after them
+    drops, columns, creates = [], [], []
+    _compare_columns(columns, old_table, new_table)
+    _compare_items(drops, creates, old_table.indexes, new_table.indexes,
+                   _index_key, _index_data,
+                   ops.CreateIndexOp.from_index, ops.DropIndexOp.from_index)
+    _compare_items(drops, creates, _uniques(old_table), _uniques(new_table),
+                   _unique_key,
+                   lambda constraint: _column_names(constraint.columns),
+                   ops.CreateUniqueConstraintOp.from_constraint,
+                   ops.DropConstraintOp.from_constraint)
+    _compare_items(drops, creates, old_table.foreign_key_constraints,
+                   new_table.foreign_key_constraints, _foreign_key_key,
+                   _foreign_key_data,
+                   ops.CreateForeignKeyOp.from_constraint,
+                   ops.DropConstraintOp.from_constraint)
+    if old_table.comment != new_table.comment:
+        if new_table.comment is None:
+            creates.append(ops.DropTableCommentOp(
+                new_table.name, schema=new_table.schema,
+                existing_comment=old_table.comment))
+        else:
+            creates.append(ops.CreateTableCommentOp(
+                new_table.name, new_table.comment, schema=new_table.schema,
+                existing_comment=old_table.comment))
+    return drops + columns + creates
+
+
+def compare(old_metadata, new_metadata):
+    """Return the ``UpgradeOps`` turning ``old_metadata`` into
+    ``new_metadata``."""
+    old_tables = _by_key(old_metadata.sorted_tables, _key)
+    new_tables = _by_key(new_metadata.sorted_tables, _key)
+    upgrade_ops = []
+    for table in new_metadata.sorted_tables:
+        if _key(table) not in old_tables:
+            upgrade_ops.append(ops.CreateTableOp.from_table(table))
+            upgrade_ops.extend(
+                ops.CreateIndexOp.from_index(index)
+                for index in sorted(table.indexes,
+                                    key=lambda index: index.name or ''))
+    for table in reversed(old_metadata.sorted_tables):
+        if _key(table) not in new_tables:
+            upgrade_ops.extend(
+                ops.DropIndexOp.from_index(index)
+                for index in sorted(table.indexes,
+                                    key=lambda index: index.name or ''))
+            upgrade_ops.append(ops.DropTableOp.from_table(table))
+    for table in new_metadata.sorted_tables:
+        old_table = old_tables.get(_key(table))
+        if old_table is None:
+            continue
+        table_ops = _compare_table(old_table, table)
+        if table_ops:
+            upgrade_ops.append(ops.ModifyTableOps(
+                table.name, table_ops, schema=table.schema))
+    return ops.UpgradeOps(ops=upgrade_ops)
+
+
+# revisions
+
+def head_snapshot(script, head='head'):
+    """Return the snapshot stored in revision ``head``, as a dict."""
+    revision = script.get_revision(head)
+    if revision is None:
+        raise util.CommandError('No revisions, run "db migrate" against a '
+                                'database first')
+    data = getattr(revision.module, 'metadata_snapshot', None)
+    if data is None:
+        raise util.CommandError(
+            'Revision %s has no metadata snapshot, run "db migrate" against '
+            'a database once' % revision.revision)
+    return loads(data)
+
+
+def _dialect_name(migrate_config, name):
+    return make_url(bind_uri(migrate_config, name)).get_backend_name()
+
+
+def _render(migrate_config, migration_script, dialect_name):
+    """Render ``migration_script`` into template arguments."""
+    opts = dict(migrate_config.configure_args)
+    if opts.get('render_as_batch') == 'auto':
+        opts['render_as_batch'] = dialect_name == 'sqlite'
+    opts.setdefault('sqlalchemy_module_prefix', 'sa.')
+    opts.setdefault('alembic_module_prefix', 'op.')
+    opts.setdefault('user_module_prefix', None)
+    migration_context = MigrationContext.configure(
+        dialect_name=dialect_name, opts=opts)
+    autogen_context = AutogenContext(migration_context, autogenerate=False)
+    template_args = {}
+    render._render_python_into_templatevars(autogen_context, migration_script,
+                                            template_args)
+    return template_args
+
+
+def autogenerate(migrate_config, snapshot):
+    """Return the ``MigrationScript`` from ``snapshot`` to the models, and
+    the dialect of each database, without a database connection."""
+    from fastapi_migrate import online
+
+    names = bind_names(migrate_config)
+    old_metadata = to_metadata(snapshot)
+    upgrade_ops_list = []
+    downgrade_ops_list = []
+    dialects = []
+    for name in names:
+        if len(names) == 1:
+            upgrade_token, downgrade_token = 'upgrades', 'downgrades'
+            old, new = old_metadata, migrate_config.metadata
+        else:
+            upgrade_token = '%s_upgrades' % name
+            downgrade_token = '%s_downgrades' % name
+            old = bind_metadata(old_metadata, name)
+            new = bind_metadata(migrate_config.metadata, name)
+        upgrade_ops = compare(old, new)
+        upgrade_ops.upgrade_token = upgrade_token
+        downgrade_ops = upgrade_ops.reverse_into(
+            ops.DowngradeOps(ops=[], downgrade_token=downgrade_token))
+        dialect_name = _dialect_name(migrate_config, name)
+        if migrate_config.configure_args.get('online_ddl') and \
+                dialect_name == 'postgresql':
+            online.rewrite(upgrade_ops)
+            online.rewrite(downgrade_ops)
+        upgrade_ops_list.append(upgrade_ops)
+        downgrade_ops_list.append(downgrade_ops)
+        dialects.append(dialect_name)
+    migration_script = ops.MigrationScript(
+        util.rev_id(), upgrade_ops_list, downgrade_ops_list)
+    return migration_script, dialects
+
+
+def revision(script_directory, migrate_config, message=None, head='head',
+             splice=False, branch_label=None, version_path=None, rev_id=None,
+             split=False):
+    """Write the revision from the snapshot of ``head`` to the models, or
+    the expand and contract revisions with ``split``.  Returns the scripts,
+    none when nothing changed."""
+    from fastapi_migrate import phases
+
+    migration_script, dialects = autogenerate(
+        migrate_config, head_snapshot(script_directory, head))
+    if all(upgrade_ops.is_empty()
+           for upgrade_ops in migration_script.upgrade_ops_list):
+        log.info('No changes in schema detected.')
+        return []
+    migration_script.rev_id = rev_id or migration_script.rev_id
+    migration_script.message = message
+    migration_script.head = head
+    migration_script.splice = splice
+    migration_script.branch_label = branch_label
+    migration_script.version_path = version_path
+    if split:
+        generated = phases.split(migration_script)
+    else:
+        generated = [(None, migration_script)]
+
+    scripts = []
+    for phase, generated_script in generated:
+        template_args = {}
+        imports = set()
+        # each database renders for its own dialect
+        for upgrade_ops, downgrade_ops, dialect_name in zip(
+                generated_script.upgrade_ops_list,
+                generated_script.downgrade_ops_list, dialects):
+            single = ops.MigrationScript(
+                generated_script.rev_id, upgrade_ops, downgrade_ops,
+                imports=set(generated_script.imports))
+            rendered = _render(migrate_config, single, dialect_name)
+            imports.update(line for line in rendered.pop('imports').split('\n')
+                           if line)
+            template_args.update(rendered)
+        template_args['imports'] = '\n'.join(sorted(imports))
+        script = script_directory.generate_revision(
+            generated_script.rev_id, generated_script.message, refresh=True,
+            head=generated_script.head, splice=generated_script.splice,
+            branch_labels=generated_script.branch_label,
+            version_path=generated_script.version_path, **template_args)
+        if phase is not None:
+            phases.append_phase(script, phase,
+                                script_directory.output_encoding)
+        scripts.append(script)
+    return scripts
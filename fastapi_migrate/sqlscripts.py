@@ -0,0 +1,225 @@
+"""Offline SQL written to one file per revision and per database.
+
+``db upgrade --sql --output-dir DIR`` renders the SQL of each revision
+into ``DIR/<database>/<order>_<revision>.sql`` as alembic renders it,
+rather than into one script on standard output; ``<database>`` is
+``primary`` or the bind name.  Every file runs in its own transaction and
+updates the version table itself, so the files can be reviewed and applied
+one at a time.  The databases are rendered concurrently, like online
+upgrades, and ``DIR/manifest.json`` lists the files of each database in the
+order they apply, with their SHA-256::
+
+    {"direction": "upgrade", "from": null, "to": "head",
+     "databases": {"": [{"order": 1, "revision": "e575e5fd9a7c",
+                         "file": "primary/0001_e575e5fd9a7c.sql",
+                         "sha256": "9f2c...", "bytes": 512}]}}
+
+The SQL is rendered by alembic with the configure arguments of ``Migrate``
+and ``literal_binds``, without running env.py.  It is written to a
+directory next to ``DIR`` that only replaces it once every file is
+rendered, so no stale or partial files are left.  ``DIR`` must be new,
+empty or hold an earlier render, with its manifest.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from alembic.runtime.environment import EnvironmentContext
+from alembic.util import CommandError
+
+from fastapi_migrate import phases
+from fastapi_migrate.binds import bind_metadata
+from fastapi_migrate.binds import bind_names
+from fastapi_migrate.binds import bind_uri
+from fastapi_migrate.binds import operations
+from fastapi_migrate.binds import run_binds
+from fastapi_migrate.bootstrap import _script_directory
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def bind_directory(name):
+    return name or 'primary'
+
+
+class _SqlFile(object):
+    """Output buffer writing one revision's SQL to its file, hashed as it
+    is written."""
+
+    def __init__(self, output_dir, name, order, revision):
+        self.relative_path = os.path.join(
+            bind_directory(name), '%04d_%s.sql' % (order, revision))
+        self.file = open(os.path.join(output_dir, self.relative_path), 'w',
+                         encoding='utf-8')
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.sha256.update(data)
+        self.bytes += len(data)
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _step_revision(step):
+    revision = getattr(step, 'revision', None)
+    if revision is not None:
+        return revision.revision
+    # a stamp step, e.g. merging heads
+    return '_'.join(step.to_revisions) if step.is_upgrade \
+        else '_'.join(step.from_revisions)
+
+
+def _split_steps(fn, output_dir, name, entries):
+    """Wrap an ``EnvironmentContext`` ``fn`` so that the SQL of every step
+    goes to a new file."""
+    def split(rev, context):
+        for order, step in enumerate(fn(rev, context), 1):
+            # the version table update of the previous step is written by
+            # now; the last file stays open until the run is over, a
+            # downgrade to base drops the version table after it
+            if entries:
+                entries[-1][2].close()
+            revision = _step_revision(step)
+            sql_file = _SqlFile(output_dir, name, order, revision)
+            context.impl.output_buffer = sql_file
+            entries.append((order, revision, sql_file))
+            yield step
+    return split
+
+
+def _replace(working_dir, output_dir):
+    if not os.path.isdir(output_dir):
+        os.rename(working_dir, output_dir)
+        return
+    previous = working_dir + '.old'
+    os.rename(output_dir, previous)
+    os.rename(working_dir, output_dir)
+    shutil.rmtree(previous)
+
+
+def render(config, migrate_config, output_dir, revision, direction='upgrade',
+           tag=None, expand_only=False):
+    """Write the SQL of an offline ``upgrade`` or ``downgrade`` to
+    ``revision``, or over a ``<fromrev>:<torev>`` range, to ``output_dir``,
+    one file per revision and per database, and return the manifest.
+    ``expand_only`` stops an upgrade before the first contract revision."""
+    output_dir = os.path.normpath(output_dir)
+    if os.path.isdir(output_dir) and os.listdir(output_dir) and \
+            not os.path.isfile(os.path.join(output_dir, MANIFEST_FILENAME)):
+        raise CommandError('%s is not empty and holds no earlier render, '
+                           'give a new or empty --output-dir' % output_dir)
+    parent, basename = os.path.split(os.path.abspath(output_dir))
+    working_dir = os.path.join(parent, '.%s.%d.tmp' % (basename, os.getpid()))
+    # left behind by a run that was killed
+    shutil.rmtree(working_dir, ignore_errors=True)
+    os.makedirs(working_dir)
+    try:
+        manifest = _render(config, migrate_config, working_dir, revision,
+                           direction, tag, expand_only)
+        _replace(working_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(working_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def _render(config, migrate_config, output_dir, revision, direction, tag,
+            expand_only):
+    script = _script_directory(config)
+    starting_rev = None
+    if ':' in revision:
+        starting_rev, revision = revision.split(':', 2)
+    if direction == 'downgrade' and starting_rev is None:
+        raise CommandError('downgrade with --sql requires <fromrev>:<torev>')
+    names = bind_names(migrate_config)
+    for name in names:
+        os.makedirs(os.path.join(output_dir, bind_directory(name)),
+                    exist_ok=True)
+    # load the revision map once, before the threads start walking it
+    script.get_heads()
+    databases = {}
+
+    def render_bind(name):
+        if direction == 'upgrade':
+            def fn(rev, context):
+                return script._upgrade_revs(revision, rev)
+        else:
+            def fn(rev, context):
+                return script._downgrade_revs(revision, rev)
+        if expand_only:
+            fn = phases.expand_only(fn)
+        entries = []
+        databases[name] = entries
+        environment = EnvironmentContext(
+            config,
+            script,
+            fn=_split_steps(fn, output_dir, name, entries),
+            as_sql=True,
+            starting_rev=starting_rev,
+            destination_rev=revision,
+            tag=tag,
+        )
+        configure_args = dict(migrate_config.configure_args)
+        # every file is a transaction of its own
+        configure_args['transaction_per_migration'] = True
+        environment.configure(
+            url=bind_uri(migrate_config, name),
+            output_buffer=_Discard(),
+            target_metadata=bind_metadata(migrate_config.metadata, name)
+            if len(names) > 1 else migrate_config.metadata,
+            literal_binds=True,
+            **configure_args
+        )
+        migration_context = environment.get_context()
+        # the revisions of the multidb template take the database name
+        kw = {'engine_name': name} if len(names) > 1 else {}
+        try:
+            with migration_context.begin_transaction():
+                with operations(migration_context):
+                    migration_context.run_migrations(**kw)
+        finally:
+            for _, _, sql_file in entries:
+                sql_file.close()
+
+    run_binds(render_bind, names, max_workers=migrate_config.max_workers)
+
+    manifest = {
+        'direction': direction,
+        'from': starting_rev,
+        'to': revision,
+        'databases': dict(
+            (name, [{
+                'order': order,
+                'revision': revision_id,
+                'file': sql_file.relative_path,
+                'sha256': sql_file.sha256.hexdigest(),
+                'bytes': sql_file.bytes,
+            } for order, revision_id, sql_file in entries])
+            for name, entries in databases.items()),
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return manifest
+
+
+class _Discard(object):
+    """Output before the first revision, nothing but whitespace with
+    per-migration transactions."""
+
+    def write(self, text):
+        if text.strip():
+            raise CommandError('Unexpected SQL outside of a revision: %s'
+                               % text.strip())
+
+    def flush(self):
+        pass
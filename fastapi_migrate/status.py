@@ -0,0 +1,142 @@
+"""Compare the database revision with the scripts without running alembic.
+
+Used by ``Migrate.status()`` and friends for startup and readiness checks:
+the revision graph is kept by ``Migrate`` until a revision file is added,
+removed or changed, and the database costs a single ``SELECT`` from the
+version table, over a pooled connection.
+"""
+import os
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+
+MigrationStatus = namedtuple('MigrationStatus', ['current', 'heads', 'pending'])
+MigrationStatus.__doc__ = """Revision state of a database.
+
+``current`` holds the revisions stored in the database, ``heads`` the head
+revisions of the scripts and ``pending`` the revisions an ``upgrade heads``
+would run, oldest first.
+"""
+
+
+def _files(script):
+    from fastapi_migrate.index import _list_scripts
+
+    files = []
+    for path, _ in _list_scripts(script):
+        stat = os.stat(path)
+        files.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(files)
+
+
+class RevisionGraph(object):
+    """The revision scripts, loaded once: heads and upgrade order."""
+
+    def __init__(self, script):
+        # before the graph, so that a file changed meanwhile reloads it
+        self.files = _files(script)
+        self.script = script
+        self.heads = tuple(sorted(script.get_heads()))
+        # walk_revisions() goes from the heads down, upgrades run upwards
+        self.order = [revision.revision
+                      for revision in reversed(list(script.walk_revisions()))]
+        self.ids = set(self.order)
+
+    @classmethod
+    def load(cls, migrate, directory=None):
+        from alembic.script import ScriptDirectory
+        from fastapi_migrate import index
+        from fastapi_migrate.bundle import bundle_path
+
+        script = ScriptDirectory.from_config(migrate.get_config(directory))
+        if migrate.revision_index or os.path.exists(bundle_path(script)):
+            index.attach(script)
+        return cls(script)
+
+    def is_current(self):
+        """Whether the revision files are the ones the graph was loaded
+        from, by their size and mtime."""
+        return _files(self.script) == self.files
+
+    def status(self, current):
+        unknown = [revision for revision in current
+                   if revision not in self.ids]
+        if unknown:
+            # e.g. a newer deploy: there is no telling what is pending
+            from alembic.util import CommandError
+
+            raise CommandError(
+                'The database is at revision %s, which the scripts do not '
+                'know' % ', '.join(unknown))
+        revision_map = self.script.revision_map
+        known = list(current)
+        applied = set(
+            revision.revision for revision in revision_map._get_ancestor_nodes(
+                revision_map.get_revisions(known)))
+        pending = [revision for revision in self.order
+                   if revision not in applied]
+        return MigrationStatus(current, self.heads, pending)
+
+
+def _version_table(configure_args):
+    return sa.table(
+        configure_args.get('version_table', 'alembic_version'),
+        sa.column('version_num'),
+        schema=configure_args.get('version_table_schema'),
+    )
+
+
+def current_revisions(bind, configure_args):
+    """Read the revisions stored in the version table.
+
+    ``bind`` is an ``Engine``, which lends a pooled connection for the
+    query, or a ``Connection``, which is used as it is.  An ``AsyncEngine``
+    is driven on its own event loop.
+    """
+    if hasattr(bind, 'sync_engine'):
+        return _current_revisions_async(bind, configure_args)
+    if not isinstance(bind, sa.engine.Connection):
+        with bind.connect() as connection:
+            return _read_versions(connection, configure_args)
+    return _read_versions(bind, configure_args)
+
+
+def _read_versions(connection, configure_args):
+    table = _version_table(configure_args)
+    # a failed query must not abort the transaction of the caller
+    savepoint = connection.begin_nested() if connection.in_transaction() \
+        else None
+    try:
+        rows = connection.execute(sa.select(table.c.version_num)).fetchall()
+    except sa.exc.DBAPIError:
+        if savepoint is not None:
+            savepoint.rollback()
+        # the version table only exists once a migration ran; any other
+        # error is for the caller
+        if sa.inspect(connection).has_table(table.name, schema=table.schema):
+            raise
+        return ()
+    if savepoint is not None:
+        savepoint.commit()
+    return tuple(sorted(row[0] for row in rows))
+
+
+def _current_revisions_async(engine, configure_args):
+    from fastapi_migrate.aio import run_async
+
+    async def read():
+        async with engine.connect() as connection:
+            return await connection.run_sync(current_revisions, configure_args)
+    return run_async(read())
+
+
+def create_engine(migrate_config):
+    if migrate_config.async_:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        # every check runs on a new event loop, pooled connections would
+        # outlive theirs
+        return create_async_engine(migrate_config.db_uri,
+                                   poolclass=sa.pool.NullPool)
+    return sa.create_engine(migrate_config.db_uri)
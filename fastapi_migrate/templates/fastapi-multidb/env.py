@@ -0,0 +1,208 @@
+from __future__ import with_statement
+
+import logging
+import threading
+from logging.config import fileConfig
+
+from sqlalchemy import engine_from_config
+from sqlalchemy import pool
+from sqlalchemy.engine import Connection
+from fastapi_migrate.aio import run_async
+from fastapi_migrate.binds import bind_connectable
+from fastapi_migrate.binds import bind_metadata
+from fastapi_migrate.binds import bind_names
+from fastapi_migrate.binds import bind_uri
+from fastapi_migrate.binds import label_output
+from fastapi_migrate.binds import operations
+from fastapi_migrate.binds import run_binds
+from fastapi_migrate.command import current_app
+
+from alembic import context
+
+USE_TWOPHASE = False
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+fileConfig(config.config_file_name)
+logger = logging.getLogger('alembic.env')
+
+# add your model's MetaData object here
+# for 'autogenerate' support
+# from myapp import mymodel
+# target_metadata = mymodel.Base.metadata
+app = current_app()
+migrate_config = app.extra['migrate']
+db_names = bind_names(migrate_config)
+for name in db_names:
+    if name:
+        config.set_section_option(
+            name, 'sqlalchemy.url',
+            bind_uri(migrate_config, name).replace('%', '%%'))
+    else:
+        config.set_main_option(
+            'sqlalchemy.url',
+            bind_uri(migrate_config, name).replace('%', '%%'))
+target_metadata = migrate_config.metadata
+
+# other values from the config, defined by the needs of env.py,
+# can be acquired:
+# my_important_option = config.get_main_option("my_important_option")
+# ... etc.
+
+
+def get_section(name):
+    if name:
+        return config.get_section(name)
+    return config.get_section(config.config_ini_section)
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    """
+    def migrate_bind_offline(name, buffer):
+        context.configure(
+            url=get_section(name)['sqlalchemy.url'],
+            output_buffer=buffer,
+            target_metadata=bind_metadata(target_metadata, name),
+            literal_binds=True,
+            **migrate_config.configure_args
+        )
+        with context.begin_transaction():
+            context.run_migrations(engine_name=name)
+
+    # for the --sql use case, run migrations for each URL into
+    # individual files, unless the caller collects the output itself
+    # (e.g. db analyze).
+    for name in db_names:
+        logger.info('Migrating database %s' % (name or '<primary>'))
+        if config.output_buffer is not None:
+            migrate_bind_offline(name, config.output_buffer)
+            continue
+        file_ = '%s.sql' % (name or 'primary')
+        logger.info('Writing output to %s' % file_)
+        with open(file_, 'w') as buffer:
+            migrate_bind_offline(name, buffer)
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    Every database gets its own engine and connection, and the databases
+    are migrated concurrently on a bounded thread pool.
+
+    """
+
+    # this callback is used to prevent an auto-migration from being generated
+    # when there are no changes to the schema
+    # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
+    def process_revision_directives(context, revision, directives):
+        if getattr(config.cmd_opts, 'autogenerate', False):
+            script = directives[0]
+            if len(script.upgrade_ops_list) >= len(db_names):
+                # wait until every database has been compared
+                empty = True
+                for upgrade_ops in script.upgrade_ops_list:
+                    if not upgrade_ops.is_empty():
+                        empty = False
+                if empty:
+                    directives[:] = []
+                    logger.info('No changes in schema detected.')
+
+    # alembic's context object is shared by every thread, so configuring
+    # a migration context is serialized; running it is not.
+    configure_lock = threading.Lock()
+
+    def do_migrate_bind(connection, name):
+        with configure_lock:
+            context.configure(
+                connection=connection,
+                upgrade_token='%s_upgrades' % name,
+                downgrade_token='%s_downgrades' % name,
+                target_metadata=bind_metadata(target_metadata, name),
+                process_revision_directives=process_revision_directives,
+                **migrate_config.configure_args
+            )
+            migration_context = context.get_context()
+
+        with migration_context.begin_transaction():
+            with operations(migration_context):
+                migration_context.run_migrations(engine_name=name)
+
+    async def migrate_bind_async(name, connectable):
+        from sqlalchemy.ext.asyncio import async_engine_from_config
+
+        owned = connectable is None
+        if owned:
+            connectable = async_engine_from_config(
+                get_section(name),
+                prefix='sqlalchemy.',
+                poolclass=pool.NullPool,
+            )
+
+        async with connectable.connect() as connection:
+            await connection.run_sync(do_migrate_bind, name)
+
+        if owned:
+            await connectable.dispose()
+
+    def migrate_bind(name):
+        # an Engine or Connection handed over by the application, see
+        # Migrate(engine=...) and the connection argument of the commands
+        connectable = bind_connectable(config, migrate_config, name)
+        if isinstance(connectable, Connection):
+            do_migrate_bind(connectable, name)
+            return
+
+        if hasattr(connectable, 'sync_connection'):
+            # an AsyncConnection
+            run_async(connectable.run_sync(do_migrate_bind, name))
+            return
+
+        if migrate_config.async_:
+            # every worker thread drives its own event loop
+            run_async(migrate_bind_async(name, connectable))
+            return
+
+        if connectable is not None:
+            with connectable.connect() as connection:
+                do_migrate_bind(connection, name)
+            return
+
+        connectable = engine_from_config(
+            get_section(name),
+            prefix='sqlalchemy.',
+            poolclass=pool.NullPool,
+        )
+
+        with connectable.connect() as connection:
+            do_migrate_bind(connection, name)
+        connectable.dispose()
+
+    # autogenerate collects every database's changes into one revision,
+    # which is not safe to do from several threads at once.
+    max_workers = migrate_config.max_workers
+    if getattr(config.cmd_opts, 'autogenerate', False):
+        max_workers = 1
+    label_output(config)
+    # load the revision map once, before the threads start walking it
+    context.script.get_heads()
+    run_binds(migrate_bind, db_names, max_workers=max_workers, logger=logger)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
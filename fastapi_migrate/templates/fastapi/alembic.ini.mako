@@ -11,7 +11,7 @@
 
 # Logging configuration
 [loggers]
-keys = root,sqlalchemy,alembic
+keys = root,sqlalchemy,alembic,fastapi_migrate
 
 [handlers]
 keys = console
@@ -34,6 +34,11 @@ level = INFO
 handlers =
 qualname = alembic
 
+[logger_fastapi_migrate]
+level = INFO
+handlers =
+qualname = fastapi_migrate
+
 [handler_console]
 class = StreamHandler
 args = (sys.stderr,)
@@ -6,6 +6,8 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import MetaData
 from sqlalchemy import pool
+from sqlalchemy.engine import Connection
+from fastapi_migrate.aio import run_async
 from fastapi_migrate.command import current_app
 
 from alembic import context
@@ -51,7 +53,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        **app.extra['migrate'].configure_args
     )
 
     with context.begin_transaction():
@@ -76,13 +79,7 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix='sqlalchemy.',
-        poolclass=pool.NullPool,
-    )
-
-    with connectable.connect() as connection:
+    def do_run_migrations(connection):
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
@@ -93,6 +90,54 @@ def run_migrations_online():
         with context.begin_transaction():
             context.run_migrations()
 
+    # an Engine or Connection handed over by the application, see
+    # Migrate(engine=...) and the connection argument of the commands
+    connectable = config.attributes.get('connection',
+                                        app.extra['migrate'].engine)
+    if isinstance(connectable, Connection):
+        do_run_migrations(connectable)
+        return
+
+    if hasattr(connectable, 'sync_connection'):
+        # an AsyncConnection
+        run_async(connectable.run_sync(do_run_migrations))
+        return
+
+    async def run_async_migrations(connectable):
+        from sqlalchemy.ext.asyncio import async_engine_from_config
+
+        owned = connectable is None
+        if owned:
+            connectable = async_engine_from_config(
+                config.get_section(config.config_ini_section),
+                prefix='sqlalchemy.',
+                poolclass=pool.NullPool,
+            )
+
+        async with connectable.connect() as connection:
+            await connection.run_sync(do_run_migrations)
+
+        if owned:
+            await connectable.dispose()
+
+    if app.extra['migrate'].async_:
+        run_async(run_async_migrations(connectable))
+        return
+
+    if connectable is not None:
+        with connectable.connect() as connection:
+            do_run_migrations(connection)
+        return
+
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section),
+        prefix='sqlalchemy.',
+        poolclass=pool.NullPool,
+    )
+
+    with connectable.connect() as connection:
+        do_run_migrations(connection)
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,186 @@
+"""Upgrade every tenant of a schema-per-tenant or database-per-tenant
+application, several at a time.
+
+The tenants come from a callback registered on ``Migrate``::
+
+    @migrate.tenants
+    def tenants():
+        return ['acme', 'globex']     # PostgreSQL schemas or MySQL databases
+
+or, one SQLite file or database per tenant::
+
+    @migrate.tenants
+    def tenants():
+        for name in os.listdir('data'):
+            yield Tenant(name, db_uri='sqlite:///data/%s' % name)
+
+``db upgrade --tenants`` runs the upgrades on a pool of worker processes,
+each on its own connection with the ``search_path`` (or MySQL database) set
+to the tenant's schema.  The connections of an ``async_`` application
+use its async driver, driven through ``run_sync()`` as env.py does.  A
+failed tenant does not stop the others; the failures are listed at the end.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+from alembic.util import CommandError
+
+
+Tenant = namedtuple('Tenant', ['name', 'schema', 'db_uri'])
+Tenant.__new__.__defaults__ = (None, None)
+Tenant.__doc__ = """A tenant to upgrade.
+
+``schema`` is the PostgreSQL schema or MySQL database of the tenant and
+``db_uri`` its database, by default the ``db_uri`` of ``Migrate``.  A plain
+string stands for a tenant with a schema of that name.
+"""
+
+TenantResult = namedtuple('TenantResult', ['name', 'elapsed', 'error'])
+
+
+def as_tenant(tenant):
+    if isinstance(tenant, Tenant):
+        return tenant
+    if isinstance(tenant, dict):
+        return Tenant(**tenant)
+    return Tenant(tenant, schema=tenant)
+
+
+def set_schema(connection, schema):
+    """Make ``schema`` the default schema of ``connection``."""
+    dialect = connection.dialect
+    quoted = dialect.identifier_preparer.quote(schema)
+    if dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET search_path TO %s' % quoted)
+    elif dialect.name in ('mysql', 'mariadb'):
+        connection.exec_driver_sql('USE %s' % quoted)
+    else:
+        raise CommandError('Tenant schemas need PostgreSQL or MySQL, not %s'
+                           % dialect.name)
+
+
+def _engine(migrate_config, tenant):
+    url = make_url(tenant.db_uri or migrate_config.db_uri)
+    if migrate_config.async_:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        return create_async_engine(url, poolclass=sa.pool.NullPool)
+    return sa.create_engine(url, poolclass=sa.pool.NullPool)
+
+
+def _upgrade(connection, app, tenant, directory, revision, kwargs):
+    from fastapi_migrate import command
+
+    if tenant.schema:
+        set_schema(connection, tenant.schema)
+        connection.commit()
+    command.run_upgrade(app, directory, revision, connection=connection,
+                        **kwargs)
+    connection.commit()
+
+
+async def _upgrade_async(engine, *args):
+    try:
+        async with engine.connect() as connection:
+            await connection.run_sync(_upgrade, *args)
+    finally:
+        await engine.dispose()
+
+
+def upgrade_tenant(tenant, app=None, directory=None, revision='head',
+                   **kwargs):
+    """Upgrade a single tenant of ``app``, an application or its registered
+    name, in a worker process.
+
+    ``kwargs`` are passed on to ``fastapi_migrate.command.upgrade``.
+    """
+    from fastapi_migrate.aio import run_async
+    from fastapi_migrate.apps import get_app
+
+    app = get_app(app)
+    engine = _engine(app.extra['migrate'], tenant)
+    args = app, tenant, directory, revision, kwargs
+    start = time.perf_counter()
+    try:
+        if hasattr(engine, 'sync_engine'):
+            run_async(_upgrade_async(engine, *args))
+        else:
+            try:
+                with engine.connect() as connection:
+                    _upgrade(connection, *args)
+            finally:
+                engine.dispose()
+    except Exception as exc:
+        return TenantResult(tenant.name, time.perf_counter() - start,
+                            '%s: %s' % (type(exc).__name__, exc))
+    return TenantResult(tenant.name, time.perf_counter() - start, None)
+
+
+def _progress(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+def upgrade(tenants, concurrency=None, progress=_progress, **kwargs):
+    """Upgrade ``tenants`` on ``concurrency`` worker processes (one per CPU
+    by default) and return a ``TenantResult`` per tenant, in the order they
+    finished.
+
+    The workers are forked so that they inherit the application; ``kwargs``
+    are passed on to ``upgrade_tenant``.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise CommandError('Upgrading tenants needs the fork start method')
+    tenants = [as_tenant(tenant) for tenant in tenants]
+    results = []
+    if not tenants:
+        return results
+    total = len(tenants)
+    width = len(str(total))
+    executor = ProcessPoolExecutor(
+        max_workers=min(concurrency or os.cpu_count() or 1, total),
+        mp_context=multiprocessing.get_context('fork'))
+    with executor:
+        futures = dict((executor.submit(upgrade_tenant, tenant, **kwargs),
+                        tenant) for tenant in tenants)
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as exc:
+                # the worker process died
+                result = TenantResult(futures[future].name, None,
+                                      '%s: %s' % (type(exc).__name__, exc))
+            results.append(result)
+            progress('[%*d/%d] %s %s%s' % (
+                width, done, total, result.name,
+                'FAILED' if result.error else 'ok',
+                '' if result.elapsed is None
+                else ' (%.1fs)' % result.elapsed))
+    return results
+
+
+def summary(results):
+    """Return the lines reporting the failed tenants of ``results``."""
+    failed = [result for result in results if result.error]
+    lines = ['%d tenants upgraded, %d failed' % (len(results) - len(failed),
+                                                 len(failed))]
+    for result in failed:
+        lines.append('  %s: %s' % (result.name,
+                                   result.error.splitlines()[0]))
+    return lines
+
+
+def write_failures(path, results):
+    """Write the failed tenants of ``results`` to ``path`` as JSON lines."""
+    with open(path, 'w') as f:
+        for result in results:
+            if result.error:
+                f.write(json.dumps(result._asdict(), sort_keys=True) + '\n')
@@ -0,0 +1,211 @@
+"""Migrated template databases for test suites.
+
+Running ``upgrade head`` for every test module is slow.  ``TemplateDatabase``
+migrates a template database once, keyed by a hash of the revision files and
+``env.py``, and hands out copies of it::
+
+    templates = TemplateDatabase(migrate)
+
+    @pytest.fixture
+    def database_url():
+        url = templates.clone()
+        yield url
+        templates.drop(url)
+
+On SQLite the template is a file and a clone is a copy of it; on PostgreSQL
+the template is a database on the same server and a clone is a
+``CREATE DATABASE ... TEMPLATE``.  The template is rebuilt when the hash
+changes, and older templates are removed.
+"""
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+from alembic.util import CommandError
+
+from fastapi_migrate.index import _list_scripts
+
+
+class TemplateDatabase(object):
+    def __init__(self, migrate, url=None, directory=None, cache_dir=None):
+        """``url`` defaults to the ``db_uri`` of ``migrate``; clones are made
+        on the same server.  SQLite templates and clones are files in
+        ``cache_dir``, by default a directory under the system temporary
+        directory specific to the migration directory.
+        """
+        self.migrate = migrate
+        self.directory = directory or migrate.directory
+        self.url = make_url(url or migrate._migrate_config.db_uri)
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                tempfile.gettempdir(), 'fastapi_migrate_templates',
+                hashlib.sha1(os.path.abspath(self.directory).encode('utf-8'))
+                .hexdigest()[:12])
+        self.cache_dir = cache_dir
+        self.backend = self.url.get_backend_name()
+        if self.backend not in ('sqlite', 'postgresql'):
+            raise CommandError(
+                'Template databases need SQLite or PostgreSQL, not %s'
+                % self.backend)
+        self._template = None
+
+    def revisions_hash(self):
+        """Hash of every revision file and of ``env.py``."""
+        from alembic.script import ScriptDirectory
+
+        script = ScriptDirectory.from_config(
+            self.migrate.get_config(self.directory))
+        digest = hashlib.sha1()
+        files = sorted(_list_scripts(script), key=lambda item: item[1])
+        files.append((os.path.join(str(script.dir), 'env.py'), 'env.py'))
+        for path, key in files:
+            digest.update(key.encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _render(self, url):
+        return url.render_as_string(hide_password=False)
+
+    def _sync_url(self, url):
+        # database administration needs a synchronous driver
+        if self.migrate.async_:
+            return url.set(drivername=url.get_backend_name())
+        return url
+
+    def _upgrade(self, url):
+        """Run ``command.upgrade`` against ``url`` instead of ``db_uri``."""
+        from fastapi_migrate import command
+
+        migrate_config = self.migrate._migrate_config
+        saved = migrate_config.db_uri
+        # env.py files from before the connection argument read db_uri
+        migrate_config.db_uri = self._render(url)
+        engine = None
+        if not self.migrate.async_:
+            engine = sa.create_engine(url, poolclass=sa.pool.NullPool)
+        try:
+            command.upgrade(self.directory, connection=engine)
+        finally:
+            migrate_config.db_uri = saved
+            if engine is not None:
+                engine.dispose()
+
+    def template(self):
+        """Return the URL of an up-to-date template, building it if needed."""
+        if self._template is None:
+            if self.backend == 'sqlite':
+                self._template = self._sqlite_template(self.revisions_hash())
+            else:
+                self._template = self._postgresql_template(
+                    self.revisions_hash())
+        return self._render(self._template)
+
+    def clone(self):
+        """Return the URL of a new database copied from the template."""
+        self.template()
+        if self.backend == 'sqlite':
+            path = os.path.join(self.cache_dir,
+                                'clone-%s.db' % uuid.uuid4().hex[:12])
+            shutil.copyfile(self._template.database, path)
+            return self._render(self.url.set(database=path))
+        name = '%s_%s' % (self._name_prefix(), uuid.uuid4().hex[:12])
+        self._admin('CREATE DATABASE %s TEMPLATE %s',
+                    name, self._template.database)
+        return self._render(self.url.set(database=name))
+
+    def drop(self, url):
+        """Remove a clone made by ``clone()``."""
+        url = make_url(url)
+        if self.backend == 'sqlite':
+            if os.path.exists(url.database):
+                os.remove(url.database)
+            return
+        self._admin('DROP DATABASE IF EXISTS %s', url.database)
+
+    # SQLite
+
+    def _sqlite_template(self, revisions_hash):
+        path = os.path.join(self.cache_dir, 'template-%s.db' % revisions_hash)
+        if os.path.exists(path):
+            return self.url.set(database=path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        build_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            self._upgrade(self.url.set(database=build_path))
+            os.replace(build_path, path)
+        finally:
+            if os.path.exists(build_path):
+                os.remove(build_path)
+        for stale in glob.glob(os.path.join(self.cache_dir, 'template-*.db')):
+            if stale != path:
+                os.remove(stale)
+        return self.url.set(database=path)
+
+    # PostgreSQL
+
+    def _name_prefix(self):
+        # database names are limited to 63 characters
+        return (self.url.database or 'postgres')[:40]
+
+    def _admin_engine(self):
+        return sa.create_engine(
+            self._sync_url(self.url).set(database='postgres'),
+            isolation_level='AUTOCOMMIT', poolclass=sa.pool.NullPool)
+
+    def _admin(self, statement, *names):
+        """Run ``statement`` with the quoted database ``names`` in it."""
+        engine = self._admin_engine()
+        try:
+            with engine.connect() as connection:
+                quote = connection.dialect.identifier_preparer.quote
+                connection.exec_driver_sql(
+                    statement % tuple(quote(name) for name in names))
+        finally:
+            engine.dispose()
+
+    def _databases(self, prefix):
+        engine = self._admin_engine()
+        try:
+            with engine.connect() as connection:
+                return [row[0] for row in connection.execute(
+                    sa.text('SELECT datname FROM pg_database '
+                            'WHERE datname LIKE :pattern'),
+                    {'pattern': prefix.replace('_', '\\_') + '%'})]
+        finally:
+            engine.dispose()
+
+    def _postgresql_template(self, revisions_hash):
+        prefix = '%s_tpl_' % self._name_prefix()
+        name = prefix + revisions_hash[:12]
+        existing = self._databases(prefix)
+        if name in existing:
+            return self.url.set(database=name)
+
+        build_name = '%s_build_%s' % (self._name_prefix(),
+                                      uuid.uuid4().hex[:8])
+        self._admin('CREATE DATABASE %s', build_name)
+        try:
+            self._upgrade(self.url.set(database=build_name))
+            self._admin('ALTER DATABASE %s RENAME TO %s', build_name, name)
+        except sa.exc.DBAPIError:
+            self._admin('DROP DATABASE IF EXISTS %s', build_name)
+            if name not in self._databases(name):
+                raise
+            # another process built the same template first
+        except BaseException:
+            self._admin('DROP DATABASE IF EXISTS %s', build_name)
+            raise
+        for stale in existing:
+            try:
+                self._admin('DROP DATABASE IF EXISTS %s', stale)
+            except sa.exc.DBAPIError:
+                # still being cloned by a process on the old revisions
+                pass
+        return self.url.set(database=name)
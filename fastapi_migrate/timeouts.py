@@ -0,0 +1,261 @@
+"""Lock and statement timeouts for migrations, with retries.
+
+With ``lock_timeout`` or ``statement_timeout`` given to ``Migrate``, in
+seconds, every revision of an online ``upgrade`` or ``downgrade`` runs with
+them set on its connection:
+
+* PostgreSQL: ``SET LOCAL lock_timeout`` and ``statement_timeout``, for the
+  transaction of the revision only;
+* MySQL and MariaDB: the session ``lock_wait_timeout`` and
+  ``innodb_lock_wait_timeout``, and ``max_execution_time`` (MySQL) or
+  ``max_statement_time`` (MariaDB);
+* SQLite: ``PRAGMA busy_timeout``; there is no statement timeout.
+
+The session settings are restored at the end of the run.
+
+A revision whose statement times out waiting for a lock is retried up to
+``lock_retries`` times, after an exponential backoff with jitter starting
+at ``lock_retry_delay`` seconds.  On PostgreSQL the revision runs inside a
+savepoint, which is rolled back, releasing its locks, before waiting.
+Without transactional DDL the revision is only retried when none of its
+statements had changed the database.  Each retry is logged, and so is the
+number of retries each revision needed at the end of the run.
+"""
+import logging
+import math
+import random
+import re
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy import exc as sa_exc
+from alembic.runtime.migration import MigrationContext
+
+
+log = logging.getLogger(__name__)
+
+# cap of the backoff, in seconds
+MAX_DELAY = 60.0
+
+# PostgreSQL lock_not_available, raised on lock_timeout
+_PG_LOCK_NOT_AVAILABLE = '55P03'
+# MySQL ER_LOCK_WAIT_TIMEOUT, metadata and InnoDB row locks
+_MYSQL_LOCK_WAIT_TIMEOUT = 1205
+
+_READ = re.compile(r'\s*(SELECT\b|SHOW\b|PRAGMA\s+[\w.]+\s*(\(|$))',
+                   re.IGNORECASE)
+
+
+def is_lock_timeout(error):
+    """Whether ``error``, a SQLAlchemy ``DBAPIError``, is a timeout waiting
+    for a lock."""
+    orig = getattr(error, 'orig', None)
+    if orig is None:
+        return False
+    code = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if code is not None:
+        return code == _PG_LOCK_NOT_AVAILABLE
+    args = getattr(orig, 'args', ())
+    if args and args[0] == _MYSQL_LOCK_WAIT_TIMEOUT:
+        return True
+    message = str(orig)
+    return 'database is locked' in message or \
+        'database table is locked' in message
+
+
+def backoff(retry, delay):
+    """Seconds to wait before retry number ``retry``, starting at 1: the
+    doubled ``delay``, up to ``MAX_DELAY``, less a random half of it."""
+    delay = min(MAX_DELAY, delay * 2 ** (retry - 1))
+    return random.uniform(delay / 2.0, delay)
+
+
+def _milliseconds(seconds):
+    return int(math.ceil(seconds * 1000))
+
+
+def set_session(connection, lock_timeout, statement_timeout):
+    """Set the session timeouts of a MySQL or SQLite ``connection`` and
+    return the statements restoring the previous values."""
+    settings = []
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        if lock_timeout is not None:
+            settings.append(('PRAGMA busy_timeout', 'PRAGMA busy_timeout = %d',
+                             _milliseconds(lock_timeout)))
+    elif dialect in ('mysql', 'mariadb'):
+        if lock_timeout is not None:
+            seconds = max(1, int(math.ceil(lock_timeout)))
+            for name in ('lock_wait_timeout', 'innodb_lock_wait_timeout'):
+                settings.append(('SELECT @@SESSION.%s' % name,
+                                 'SET SESSION %s = %%d' % name, seconds))
+        if statement_timeout is not None:
+            name = 'max_statement_time' if dialect == 'mariadb' \
+                else 'max_execution_time'
+            value = statement_timeout if dialect == 'mariadb' \
+                else _milliseconds(statement_timeout)
+            settings.append(('SELECT @@SESSION.%s' % name,
+                             'SET SESSION %s = %%s' % name, value))
+    restore = []
+    for query, statement, value in settings:
+        previous = connection.exec_driver_sql(query).scalar()
+        connection.exec_driver_sql(statement % value)
+        restore.append(statement % previous)
+    return restore
+
+
+def set_local(connection, lock_timeout, statement_timeout):
+    """Set the PostgreSQL timeouts for the current transaction."""
+    if connection.dialect.name != 'postgresql':
+        return
+    if lock_timeout is not None:
+        connection.exec_driver_sql("SET LOCAL lock_timeout = '%dms'"
+                                   % _milliseconds(lock_timeout))
+    if statement_timeout is not None:
+        connection.exec_driver_sql("SET LOCAL statement_timeout = '%dms'"
+                                   % _milliseconds(statement_timeout))
+
+
+def _step_label(step, kw):
+    revision = getattr(step, 'revision', None)
+    label = revision.revision if revision is not None else step.short_log
+    if kw.get('engine_name'):
+        label = '%s (%s)' % (label, kw['engine_name'])
+    return label
+
+
+class TimedOutSteps(object):
+    """Wraps an ``EnvironmentContext`` ``fn`` so that the steps it returns
+    run with the timeouts set and are retried on lock timeouts."""
+
+    def __init__(self, fn, opts):
+        self.fn = fn
+        self.lock_timeout = opts.get('lock_timeout')
+        self.statement_timeout = opts.get('statement_timeout')
+        self.retries = opts.get('lock_retries', 0)
+        self.delay = opts.get('lock_retry_delay', 1.0)
+        self.generators = []
+        # revision label -> retries it needed
+        self.report = OrderedDict()
+
+    def __call__(self, rev, context):
+        generator = self.steps(rev, context)
+        self.generators.append(generator)
+        return generator
+
+    def close(self):
+        # a failed step leaves its generator suspended, clean up while the
+        # connection is still open
+        for generator in self.generators:
+            generator.close()
+        if self.report:
+            log.warning('Lock timeouts: %s', ', '.join(
+                '%s needed %d retr%s' % (label, retries,
+                                         'y' if retries == 1 else 'ies')
+                for label, retries in self.report.items()))
+
+    def steps(self, rev, context):
+        steps = iter(self.fn(rev, context))
+        step = next(steps, None)
+        if step is None:
+            return
+        connection = context.connection
+        restore = set_session(connection, self.lock_timeout,
+                              self.statement_timeout)
+        try:
+            while step is not None:
+                step.migration_fn = self._retried(step, context)
+                yield step
+                step = next(steps, None)
+        finally:
+            for statement in restore:
+                connection.exec_driver_sql(statement)
+
+    def _retried(self, step, context):
+        migration_fn = step.migration_fn
+        connection = context.connection
+        impl = context.impl
+        transactional = impl.transactional_ddl
+
+        # alembic logs steps by the name of their function
+        @wraps(migration_fn)
+        def run(**kw):
+            retry = 0
+            statements = []
+
+            def after_cursor_execute(conn, cursor, statement, *args):
+                # reads, such as the reflection of a batch, can run again
+                if not _READ.match(statement):
+                    statements.append(statement)
+
+            while True:
+                coalescer = getattr(impl, 'batch_coalescer', None)
+                # batches held back by earlier revisions cannot be run again
+                retryable = coalescer is None or not coalescer.pending
+                savepoint = connection.begin_nested() if transactional \
+                    else None
+                impl.lock_retries = retry
+                event.listen(connection, 'after_cursor_execute',
+                             after_cursor_execute)
+                try:
+                    set_local(connection, self.lock_timeout,
+                              self.statement_timeout)
+                    del statements[:]
+                    migration_fn(**kw)
+                    if savepoint is not None and savepoint.is_active:
+                        savepoint.commit()
+                    break
+                except sa_exc.DBAPIError as error:
+                    if savepoint is not None:
+                        # an autocommit block ended the transaction
+                        retryable = retryable and savepoint.is_active
+                        if savepoint.is_active:
+                            savepoint.rollback()
+                    else:
+                        retryable = retryable and not statements
+                    if not retryable or retry >= self.retries or \
+                            not is_lock_timeout(error):
+                        if retry:
+                            log.warning('%s gave up after %d retries',
+                                        _step_label(step, kw), retry)
+                        raise
+                    if coalescer is not None:
+                        coalescer.discard()
+                finally:
+                    event.remove(connection, 'after_cursor_execute',
+                                 after_cursor_execute)
+                    del impl.lock_retries
+                retry += 1
+                wait = backoff(retry, self.delay)
+                log.warning('%s timed out waiting for a lock, retry %d of %d '
+                            'in %.1fs', _step_label(step, kw), retry,
+                            self.retries, wait)
+                time.sleep(wait)
+            if retry:
+                self.report[_step_label(step, kw)] = retry
+        return run
+
+
+def _run_migrations(run_migrations):
+    def wrapped(self, **kw):
+        if self.as_sql or (self.opts.get('lock_timeout') is None and
+                           self.opts.get('statement_timeout') is None):
+            return run_migrations(self, **kw)
+        fn = self._migrations_fn
+        steps = TimedOutSteps(fn, self.opts)
+        self._migrations_fn = steps
+        try:
+            return run_migrations(self, **kw)
+        finally:
+            self._migrations_fn = fn
+            steps.close()
+    wrapped._lock_timeouts = True
+    return wrapped
+
+
+def install():
+    if not getattr(MigrationContext.run_migrations, '_lock_timeouts', False):
+        MigrationContext.run_migrations = _run_migrations(
+            MigrationContext.run_migrations)
@@ -0,0 +1,100 @@
+import os
+import textwrap
+import types
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import declarative_base
+
+from fastapi_migrate import Migrate
+
+
+REVISION = """from alembic import op
+import sqlalchemy as sa
+
+revision = %(revision)r
+down_revision = %(down_revision)r
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+%(upgrade)s
+
+
+def downgrade():
+%(downgrade)s
+"""
+
+
+class Project(object):
+    """A SQLite application with its migrations in the current directory."""
+
+    def __init__(self, path, **kwargs):
+        self.db_path = os.path.join(path, '%s.db' % kwargs.get(
+            'name', 'app'))
+        self.db_uri = 'sqlite:///' + self.db_path
+        self.Model = declarative_base()
+        self.app = types.SimpleNamespace()
+        kwargs.setdefault('name', 'test')
+        # another URL for the commands that do not connect
+        kwargs.setdefault('db_uri', self.db_uri)
+        self.migrate = Migrate(self.app, self.Model, **kwargs)
+        self.engine = sa.create_engine(self.db_uri,
+                                       poolclass=sa.pool.NullPool)
+
+    def run(self, name, *args, **kwargs):
+        from fastapi_migrate import command
+
+        return getattr(command, name)(*args, app=self.app, **kwargs)
+
+    def table(self, name, *columns):
+        """Declare a model class for the table ``name``."""
+        attrs = {'__tablename__': name}
+        for column in columns:
+            attrs[column.name] = column
+        return type(name.title(), (self.Model,), attrs)
+
+    def write_revision(self, revision, down_revision, upgrade,
+                       downgrade='pass'):
+        """Write a revision file whose ``upgrade()`` is the given source."""
+        path = os.path.join('migrations', 'versions',
+                            '%s_test.py' % revision)
+        with open(path, 'w') as f:
+            f.write(REVISION % dict(
+                revision=revision, down_revision=down_revision,
+                upgrade=textwrap.indent(textwrap.dedent(upgrade).strip(),
+                                        '    '),
+                downgrade=textwrap.indent(textwrap.dedent(downgrade).strip(),
+                                          '    ')))
+
+    def revisions(self):
+        versions = os.path.join('migrations', 'versions')
+        return sorted(name for name in os.listdir(versions)
+                      if name.endswith('.py'))
+
+    def tables(self):
+        return set(sa.inspect(self.engine).get_table_names())
+
+    def execute(self, sql):
+        with self.engine.begin() as connection:
+            result = connection.exec_driver_sql(sql)
+            return result.fetchall() if result.returns_rows else None
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Return a factory of ``Project``, taking the options of ``Migrate``;
+    ``db init`` has run."""
+    monkeypatch.chdir(tmp_path)
+    created = []
+
+    def make(**kwargs):
+        project = Project(str(tmp_path), **kwargs)
+        project.run('init')
+        created.append(project)
+        return project
+
+    yield make
+    for project in created:
+        project.engine.dispose()
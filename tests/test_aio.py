@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+
+from fastapi_migrate.aio import run_async
+from fastapi_migrate.aio import run_in_executor
+
+
+async def answer():
+    await asyncio.sleep(0)
+    return 42
+
+
+async def fail():
+    raise ValueError('failed')
+
+
+def test_run_async():
+    assert run_async(answer()) == 42
+    with pytest.raises(ValueError):
+        run_async(fail())
+
+
+def test_run_async_inside_running_loop():
+    async def main():
+        # a loop cannot be re-entered, so this runs on a helper thread
+        return run_async(answer())
+
+    assert asyncio.run(main()) == 42
+
+
+@pytest.fixture
+def async_project(project, tmp_path):
+    p = project(db_uri='sqlite+aiosqlite:///' + str(tmp_path / 'app.db'),
+                async_=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    return p
+
+
+def test_async_engine(async_project):
+    p = async_project
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    assert 'user' in p.tables()
+    p.run('downgrade')
+    assert 'user' not in p.tables()
+
+
+def test_upgrade_from_running_loop(async_project):
+    from fastapi_migrate import command
+
+    p = async_project
+    p.run('migrate', message='user')
+
+    async def lifespan():
+        await run_in_executor(command.upgrade, app=p.app)
+
+    asyncio.run(lifespan())
+    assert 'user' in p.tables()
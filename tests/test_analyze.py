@@ -0,0 +1,51 @@
+from fastapi_migrate.analyze import classify
+
+
+def test_classify_postgresql():
+    table, operation, lock, blocks, cost, note, severity = classify(
+        'postgresql', 'CREATE INDEX ix_note_body ON "app"."note" (body)')
+    assert (table, operation, lock, blocks, cost, severity) == (
+        'app.note', 'create index', 'SHARE', 'writes', 'scan', 'high')
+    assert 'concurrently' in note
+
+    assert classify('postgresql', 'CREATE INDEX CONCURRENTLY ix_note_body '
+                    'ON note (body)')[1:5] == (
+        'create index concurrently', 'SHARE UPDATE EXCLUSIVE', 'none',
+        'scan')
+
+
+def test_classify_unknown():
+    table, operation, _, _, _, note, severity = classify(
+        'postgresql', 'VACUUM note')
+    assert (table, operation, severity) == (None, 'unknown', 'medium')
+    assert classify('oracle', 'CREATE TABLE note (id INTEGER)')[1] == \
+        'unknown'
+
+
+def test_analyze_pending_revisions(project, capsys):
+    p = project()
+    p.write_revision('r1', None, """
+        op.create_table('note', sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('body', sa.Text))
+    """)
+    p.run('upgrade')
+    capsys.readouterr()
+    p.run('analyze')
+    assert capsys.readouterr().out.strip() == 'No pending operations.'
+
+    p.write_revision('r2', 'r1', """
+        op.create_index('ix_note_body', 'note', ['body'])
+    """)
+    p.run('analyze')
+    out = capsys.readouterr().out
+    assert out.startswith('HIGH   r2 create index on note\n')
+
+    # a small table is not a high risk
+    p.execute('INSERT INTO note (body) VALUES (1)')
+    p.run('analyze', rows=True)
+    out = capsys.readouterr().out
+    assert out.startswith('MEDIUM r2 create index on note (1 rows)\n')
+
+    p.run('analyze', from_revision='base')
+    out = capsys.readouterr().out
+    assert 'r1 create table on note' in out
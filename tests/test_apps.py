@@ -0,0 +1,44 @@
+import subprocess
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+from fastapi_migrate import apps
+
+
+def test_import_stays_light():
+    modules = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, fastapi_migrate; print(" ".join(sys.modules))',
+    ]).decode().split()
+    for heavy in ('alembic', 'sqlalchemy', 'multiprocessing',
+                  'concurrent.futures'):
+        assert heavy not in modules
+
+
+def test_use_app_by_name(project):
+    p = project()
+    with apps.use_app('test') as app:
+        assert app is p.app
+        assert apps.get_app() is p.app
+    with pytest.raises(RuntimeError, match='No application registered'):
+        with apps.use_app('missing'):
+            pass
+
+
+@pytest.mark.parametrize('concurrency', [1, 2])
+def test_run_each(project, concurrency):
+    first = project(name='first', directory='first')
+    second = project(name='second', directory='second')
+    for p in (first, second):
+        p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+        p.run('migrate', message='user')
+
+    results = apps.run_each('upgrade', names=['first', 'second'],
+                            concurrency=concurrency)
+    assert sorted(result.name for result in results) == ['first', 'second']
+    assert all(result.error is None for result in results)
+    assert isinstance(results[0], apps.AppResult)
+    for p in (first, second):
+        assert 'user' in p.tables()
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+from alembic.util import CommandError
+
+
+def make_note(p):
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('num', sa.Integer))
+    p.write_revision('a1', None, """
+        note = op.create_table(
+            'note',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('num', sa.Integer))
+        op.bulk_insert(note, [{'id': i, 'num': 0} for i in range(1, 101)])
+    """)
+    p.write_revision('b2', 'a1', """
+        op.backfill(
+            'note',
+            "UPDATE note SET num = num + 1 WHERE id >= :lower AND id < :upper",
+            batch_size=10)
+    """)
+
+
+def test_backfill_resumes_after_the_last_chunk(project):
+    p = project()
+    make_note(p)
+    p.run('upgrade', _revision='a1')
+    p.execute("CREATE TRIGGER stop BEFORE UPDATE ON note WHEN NEW.id = 55 "
+              "BEGIN SELECT RAISE(ABORT, 'interrupted'); END")
+    with pytest.raises(sa.exc.DBAPIError):
+        p.run('upgrade')
+    assert p.execute('SELECT position FROM fastapi_migrate_checkpoint') == \
+        [(51,)]
+    assert p.execute('SELECT count(*) FROM note WHERE num = 1') == [(50,)]
+
+    p.execute('DROP TRIGGER stop')
+    p.run('upgrade')
+    # every row updated exactly once
+    assert p.execute('SELECT num, count(*) FROM note GROUP BY num') == \
+        [(1, 100)]
+    assert p.execute('SELECT * FROM fastapi_migrate_checkpoint') == []
+    assert p.execute('SELECT version_num FROM alembic_version') == [('b2',)]
+
+
+def test_checkpoint_table_is_hidden_from_autogenerate(project, capsys):
+    p = project()
+    make_note(p)
+    p.run('upgrade')
+    assert 'fastapi_migrate_checkpoint' in p.tables()
+
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
+
+
+def test_backfill_refuses_a_transaction_of_the_caller(project):
+    from fastapi_migrate.command import run_upgrade
+
+    p = project()
+    make_note(p)
+    with p.engine.begin() as connection:
+        with pytest.raises(CommandError, match='needs to own the connection'):
+            run_upgrade(p.app, connection=connection)
@@ -0,0 +1,73 @@
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import event
+
+
+@pytest.fixture
+def rebuilds():
+    """Count the copies of tables made by batch operations."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if statement.lstrip().startswith('CREATE TABLE _alembic_tmp_'):
+            statements.append(statement)
+
+    event.listen(sa.engine.Engine, 'before_cursor_execute',
+                 before_cursor_execute)
+    yield statements
+    event.remove(sa.engine.Engine, 'before_cursor_execute',
+                 before_cursor_execute)
+
+
+def write_revisions(p, between=''):
+    p.write_revision('r1', None, '''
+        op.create_table('note', sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('a', sa.String(10)),
+                        sa.Column('b', sa.String(10)),
+                        sa.Column('c', sa.String(10)))
+    ''')
+    p.write_revision('r2', 'r1', '''
+        with op.batch_alter_table('note') as batch_op:
+            batch_op.drop_column('a')
+        %s
+        with op.batch_alter_table('note') as batch_op:
+            batch_op.alter_column('b', new_column_name='body')
+    ''' % between)
+    p.write_revision('r3', 'r2', '''
+        with op.batch_alter_table('note') as batch_op:
+            batch_op.alter_column('c', nullable=False)
+    ''')
+
+
+def columns(p):
+    return dict((column['name'], column['nullable']) for column in
+                sa.inspect(p.engine).get_columns('note'))
+
+
+@pytest.mark.parametrize('coalesce,expected', [(None, 3), ('revision', 2),
+                                               ('run', 1)])
+def test_table_rebuilt_once(project, rebuilds, capsys, coalesce, expected):
+    p = project(batch_coalesce=coalesce)
+    write_revisions(p)
+    p.run('upgrade')
+    assert len(rebuilds) == expected
+    assert columns(p) == {'id': False, 'body': True, 'c': False}
+    if coalesce:
+        # logged by the handlers of env.py
+        assert 'Rebuilt %d tables' % expected in capsys.readouterr().err
+
+
+def test_not_coalesced_by_default(project, rebuilds):
+    p = project()
+    write_revisions(p)
+    p.run('upgrade')
+    assert len(rebuilds) == 3
+
+
+def test_statement_between_batches(project, rebuilds):
+    p = project(batch_coalesce='revision')
+    # sees the table without the column dropped by the first batch
+    write_revisions(p, between='''op.execute("UPDATE note SET b = 'x'")''')
+    p.run('upgrade')
+    assert len(rebuilds) == 3
+    assert columns(p) == {'id': False, 'body': True, 'c': False}
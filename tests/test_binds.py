@@ -0,0 +1,78 @@
+import shutil
+
+import pytest
+import sqlalchemy as sa
+
+from fastapi_migrate.binds import bind_metadata
+
+
+FAILING_REVISION = """from alembic import op
+import sqlalchemy as sa
+
+revision = 'r2'
+down_revision = %r
+branch_labels = None
+depends_on = None
+
+
+def upgrade(engine_name):
+    globals()['upgrade_%%s' %% engine_name]()
+
+
+def downgrade(engine_name):
+    pass
+
+
+def upgrade_():
+    raise RuntimeError('primary database failed')
+
+
+def upgrade_users():
+    op.create_table('profile', sa.Column('id', sa.Integer, primary_key=True))
+"""
+
+
+@pytest.fixture
+def multidb(project, tmp_path):
+    """A project whose ``user`` model lives in the ``users`` database."""
+    users_uri = 'sqlite:///' + str(tmp_path / 'users.db')
+    p = project(SQLALCHEMY_BINDS={'users': users_uri}, max_workers=2)
+    shutil.rmtree('migrations')
+    p.run('init', multidb=True)
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True))
+    type('User', (p.Model,), {
+        '__tablename__': 'user',
+        '__table_args__': {'info': {'bind_key': 'users'}},
+        'id': sa.Column(sa.Integer, primary_key=True)})
+    p.users = sa.create_engine(users_uri, poolclass=sa.pool.NullPool)
+    yield p
+    p.users.dispose()
+
+
+def test_bind_metadata(multidb):
+    metadata = multidb.Model.metadata
+    assert list(bind_metadata(metadata, '').tables) == ['note']
+    assert list(bind_metadata(metadata, 'users').tables) == ['user']
+    assert bind_metadata(None, 'users') is None
+
+
+def test_migrate_every_bind(multidb):
+    p = multidb
+    p.run('migrate', message='init')
+    p.run('upgrade')
+    assert p.tables() == {'alembic_version', 'note'}
+    assert set(sa.inspect(p.users).get_table_names()) == {
+        'alembic_version', 'user'}
+
+
+def test_failed_bind_does_not_stop_the_others(multidb, capsys):
+    p = multidb
+    p.run('migrate', message='init')
+    revision, = p.revisions()
+    with open('migrations/versions/r2_test.py', 'w') as f:
+        f.write(FAILING_REVISION % revision.split('_')[0])
+    with pytest.raises(SystemExit):
+        p.run('upgrade')
+    assert 'profile' in sa.inspect(p.users).get_table_names()
+    assert 'Migration failed for database(s): <primary>' in \
+        capsys.readouterr().err
@@ -0,0 +1,62 @@
+import pytest
+import sqlalchemy as sa
+
+from fastapi_migrate.internal import HISTORY_TABLE
+
+
+def squashed(project, **kwargs):
+    """A project whose revision r1 inserts a row that a bootstrap from the
+    baseline on top of it does not."""
+    p = project(**kwargs)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)))
+    p.write_revision('r1', None, '''
+        op.create_table('user', sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('name', sa.String(20)))
+        op.execute("INSERT INTO user (name) VALUES ('replayed')")
+    ''')
+    p.run('squash', rev_id='base1')
+    return p
+
+
+def test_bootstrap_with_run_history(project):
+    p = squashed(project, run_history=True)
+    p.run('upgrade', fast_bootstrap=True)
+    # the history table, created first, does not make the database look used
+    assert p.execute('SELECT name FROM user') == []
+    assert HISTORY_TABLE in p.tables()
+    assert p.execute('SELECT version_num FROM alembic_version') == [
+        ('base1',)]
+
+
+def test_bootstrap_skips_replay(project):
+    p = squashed(project)
+    p.write_revision('r2', 'base1', '''
+        op.execute("INSERT INTO user (name) VALUES ('after')")
+    ''')
+    p.run('upgrade', fast_bootstrap=True)
+    assert p.execute('SELECT name FROM user') == [('after',)]
+    assert p.execute('SELECT version_num FROM alembic_version') == [('r2',)]
+
+
+def test_replay_without_fast_bootstrap(project):
+    p = squashed(project)
+    p.run('upgrade')
+    assert p.execute('SELECT name FROM user') == [('replayed',)]
+
+
+def test_database_in_use_is_replayed(project):
+    p = squashed(project)
+    p.execute('CREATE TABLE legacy (id INTEGER)')
+    p.run('upgrade', fast_bootstrap=True)
+    assert p.execute('SELECT name FROM user') == [('replayed',)]
+
+
+def test_bootstrap_checks_the_models(project, capsys):
+    p = squashed(project)
+    p.Model.metadata.tables['user'].append_column(
+        sa.Column('email', sa.String(50)))
+    with pytest.raises(SystemExit):
+        p.run('upgrade', fast_bootstrap=True)
+    assert 'Bootstrapped schema does not match the models' in \
+        capsys.readouterr().err
@@ -0,0 +1,80 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from fastapi_migrate import bundle
+from fastapi_migrate.bootstrap import _script_directory
+
+
+def write_revisions(p):
+    p.write_revision('r1', None, """
+        op.create_table('user', sa.Column('id', sa.Integer, primary_key=True))
+    """)
+    p.write_revision('r2', 'r1', """
+        op.execute('INSERT INTO user (id) VALUES (1)')
+    """)
+
+
+def modules(p):
+    script = _script_directory(p.migrate.get_config())
+    return {revision.revision: type(revision.module)
+            for revision in script.walk_revisions()}
+
+
+def test_bundle(project, capsys):
+    p = project()
+    write_revisions(p)
+    p.run('bundle')
+    assert 'Bundled 2 revisions into' in capsys.readouterr().out
+    with zipfile.ZipFile('migrations/' + bundle.BUNDLE_FILENAME) as archive:
+        manifest = json.loads(archive.read(bundle.MANIFEST))
+    assert sorted(entry['revision'] for entry in
+                  manifest['files'].values()) == ['r1', 'r2']
+
+    assert set(modules(p).values()) == {bundle._BundledModule}
+    p.run('upgrade')
+    assert p.execute('SELECT id FROM user') == [(1,)]
+
+
+def test_changed_file_is_read_from_versions(project, capsys):
+    p = project()
+    write_revisions(p)
+    p.run('bundle')
+    p.write_revision('r2', 'r1', """
+        op.execute('INSERT INTO user (id) VALUES (2)')
+    """)
+    assert modules(p)['r2'] is not bundle._BundledModule
+    assert modules(p)['r1'] is bundle._BundledModule
+    p.run('upgrade')
+    assert p.execute('SELECT id FROM user') == [(2,)]
+    assert '1 revision files changed since "db bundle"' in \
+        capsys.readouterr().err
+
+
+def test_bundle_of_another_python_is_ignored(project):
+    p = project()
+    write_revisions(p)
+    p.run('bundle')
+    path = 'migrations/' + bundle.BUNDLE_FILENAME
+    with zipfile.ZipFile(path) as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+    manifest = json.loads(members[bundle.MANIFEST])
+    manifest['magic'] = '00000000'
+    members[bundle.MANIFEST] = json.dumps(manifest)
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    assert bundle._BundledModule not in modules(p).values()
+
+
+def test_bundle_syntax_error(project, capsys):
+    p = project()
+    write_revisions(p)
+    p.write_revision('r3', 'r2', 'return (')
+    with pytest.raises(SystemExit):
+        p.run('bundle')
+    assert 'Cannot compile versions/r3_test.py' in capsys.readouterr().err
+    assert not [name for name in os.listdir('migrations')
+                if bundle.BUNDLE_FILENAME in name]
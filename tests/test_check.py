@@ -0,0 +1,92 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from fastapi_migrate import snapshot
+
+
+def check(p, capsys, **kwargs):
+    """Run ``db check``; return its exit status and report."""
+    capsys.readouterr()
+    try:
+        p.run('check', **kwargs)
+        status = 0
+    except SystemExit as exc:
+        status = exc.code
+    return status, json.loads(capsys.readouterr().out)
+
+
+def upgraded(project, **kwargs):
+    p = project(**kwargs)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='tables')
+    p.run('upgrade')
+    return p
+
+
+def add_columns(p):
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('email', sa.String(120)))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('body', sa.Text))
+
+
+def test_no_drift(project, capsys):
+    p = upgraded(project)
+    assert check(p, capsys) == (0, {'drift': False, 'databases': {}})
+
+
+def test_drift(project, capsys):
+    p = upgraded(project)
+    add_columns(p)
+    status, report = check(p, capsys)
+    assert status == 1
+    assert report['drift'] is True
+    assert report['databases'][''] == [
+        {'kind': 'add_column', 'schema': None, 'table': 'note',
+         'column': 'body', 'type': 'Text()', 'nullable': True},
+        {'kind': 'add_column', 'schema': None, 'table': 'user',
+         'column': 'email', 'type': 'String(length=120)', 'nullable': True},
+    ]
+
+
+@pytest.mark.parametrize('offline', [False, True])
+def test_drift_of_tables(project, capsys, offline):
+    p = upgraded(project, metadata_snapshot=True)
+    add_columns(p)
+    status, report = check(p, capsys, tables=['user'], offline=offline)
+    assert status == 1
+    assert [diff['table'] for diff in report['databases']['']] == ['user']
+
+    if offline:
+        # compares with the snapshot of the new head
+        p.run('migrate', message='email', offline=True)
+    else:
+        p.execute('ALTER TABLE user ADD COLUMN email VARCHAR(120)')
+    status, report = check(p, capsys, tables=['user'], offline=offline)
+    assert status == 0
+
+
+def test_drift_with_online_ddl(project, capsys):
+    p = project(db_uri='postgresql://localhost/app', online_ddl=True,
+                metadata_snapshot=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer))
+    p.write_revision('r1', None, 'pass')
+    with open('migrations/versions/r1_test.py', 'a') as f:
+        f.write(snapshot.render_snapshot(p.Model.metadata))
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey(
+                'user.id', name='fk_note_user'), index=True))
+    status, report = check(p, capsys, offline=True)
+    assert status == 1
+    assert sorted(diff['kind'] for diff in report['databases']['']) == [
+        'add_fk', 'add_index']
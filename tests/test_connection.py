@@ -0,0 +1,33 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+def write_revision(p):
+    p.write_revision('r1', None, """
+        op.create_table('user', sa.Column('id', sa.Integer, primary_key=True))
+    """)
+
+
+def test_upgrade_with_async_connection(project):
+    p = project()
+    write_revision(p)
+    engine = create_async_engine('sqlite+aiosqlite:///' + p.db_path)
+
+    async def upgrade():
+        async with engine.connect() as connection:
+            p.run('upgrade', connection=connection)
+            await connection.commit()
+        await engine.dispose()
+
+    asyncio.run(upgrade())
+    assert 'user' in p.tables()
+
+
+def test_offline_upgrade_uses_configure_args(project, capsys):
+    p = project(version_table='app_version')
+    write_revision(p)
+    p.run('upgrade', sql=True)
+    sql = capsys.readouterr().out
+    assert 'CREATE TABLE app_version' in sql
+    assert 'alembic_version' not in sql
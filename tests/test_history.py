@@ -0,0 +1,83 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+
+
+def test_history_table_is_hidden_from_autogenerate(project, capsys):
+    p = project(run_history=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    assert 'fastapi_migrate_history' in p.tables()
+
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
+    p.run('migrate', message='nothing')
+    assert len(p.revisions()) == 1
+
+
+def test_history_filter_composes_with_user_filter(project, capsys):
+    def include_name(name, type_, parent_names):
+        return name != 'legacy'
+
+    p = project(run_history='deploy_history', include_name=include_name)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    p.execute('CREATE TABLE legacy (id INTEGER)')
+    assert 'deploy_history' in p.tables()
+
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
+
+
+def test_history_filter_with_reflect_models_only(project, capsys):
+    p = project(run_history=True, reflect_models_only=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
+
+
+def test_upgrade_records_history_and_plans(project, capsys):
+    p = project(run_history=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    rows = p.execute('SELECT revision, direction FROM '
+                     'fastapi_migrate_history')
+    revision = p.revisions()[0].split('_')[0]
+    assert rows == [(revision, 'upgrade')]
+
+    p.run('downgrade', _revision='base')
+    capsys.readouterr()
+    p.run('upgrade', plan=True)
+    out = capsys.readouterr().out
+    assert revision in out
+    assert '(1 run)' in out
+    assert 'Estimated total' in out
+
+
+def test_plan_without_history(project, capsys):
+    p = project(run_history=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade', plan=True)
+    assert 'no history' in capsys.readouterr().out
+
+
+
+@pytest.mark.parametrize('source', ['sqlite:////wrong/path.db',
+                                    'no-such-profile.jsonl'])
+def test_plan_from_a_bad_source_fails(project, source):
+    p = project(run_history=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    with pytest.raises(SystemExit) as exc:
+        p.run('upgrade', plan=True, plan_from=source)
+    assert exc.value.code == 1
@@ -0,0 +1,55 @@
+import json
+import os
+
+from fastapi_migrate.index import INDEX_FILENAME
+
+
+def write_revisions(p):
+    p.write_revision('r1', None, 'pass')
+    # importing this script fails, reading its identifiers does not
+    p.write_revision('r2', 'r1', 'pass')
+    with open('migrations/versions/r2_test.py', 'a') as f:
+        f.write('\nimport not_a_module\n')
+
+
+def index():
+    with open(os.path.join('migrations', INDEX_FILENAME)) as f:
+        return json.load(f)['files']
+
+
+def test_heads_without_importing_revisions(project, capsys):
+    p = project()
+    write_revisions(p)
+    p.run('heads')
+    assert 'r2 (head)' in capsys.readouterr().out
+    assert sorted(entry['revision'] for entry in index().values()) == [
+        'r1', 'r2']
+
+
+def test_index_follows_edits(project, capsys):
+    p = project()
+    write_revisions(p)
+    p.run('heads')
+    capsys.readouterr()
+
+    p.write_revision('r3', 'r1', 'pass')
+    p.run('heads')
+    out = capsys.readouterr().out
+    assert 'r2 (head)' in out and 'r3 (head)' in out
+
+    # same size, new content
+    path = 'migrations/versions/r3_test.py'
+    with open(path) as f:
+        source = f.read()
+    with open(path, 'w') as f:
+        f.write(source.replace("down_revision = 'r1'",
+                               "down_revision = 'r2'"))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    p.run('heads')
+    assert capsys.readouterr().out.split() == ['r3', '(head)']
+
+    os.remove(path)
+    p.run('heads')
+    assert capsys.readouterr().out.split() == ['r2', '(head)']
+    assert len(index()) == 2
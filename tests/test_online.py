@@ -0,0 +1,86 @@
+import sqlalchemy as sa
+
+from fastapi_migrate import snapshot
+
+
+def postgresql_project(project):
+    """Models with a revision and its snapshot, for a PostgreSQL URL that
+    ``db migrate --offline`` never connects to."""
+    p = project(db_uri='postgresql://localhost/app', online_ddl=True,
+                metadata_snapshot=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer),
+            sa.Column('name', sa.String(20)))
+    p.write_revision('r1', None, 'pass')
+    with open('migrations/versions/r1_test.py', 'a') as f:
+        f.write(snapshot.render_snapshot(p.Model.metadata))
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey(
+                'user.id', name='fk_note_user')),
+            sa.Column('name', sa.String(20), index=True))
+    p.table('tag', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20), index=True))
+    return p
+
+
+def sources(p):
+    revisions = {}
+    for name in p.revisions():
+        with open('migrations/versions/' + name) as f:
+            source = f.read()
+        compile(source, name, 'exec')
+        upgrade, downgrade = source.split('def downgrade():')
+        revisions[name] = upgrade, downgrade
+    return revisions
+
+
+def test_split_online_revision(project):
+    p = postgresql_project(project)
+    p.run('migrate', message='online', split=True, offline=True)
+    revisions = sources(p)
+    assert len(revisions) == 2
+    upgrades = ''.join(upgrade for upgrade, _ in revisions.values())
+    downgrades = ''.join(downgrade for _, downgrade in revisions.values())
+    assert 'postgresql_not_valid=True' in upgrades
+    assert "op.validate_constraint('fk_note_user', 'note')" in upgrades
+    assert 'validate_constraint' not in downgrades
+    # the index of an existing table, not that of the new one
+    assert upgrades.count('postgresql_concurrently=True') == 1
+    assert "op.f('ix_note_name'), 'note', ['name'], unique=False, " \
+        "postgresql_concurrently=True" in upgrades
+
+
+def test_online_operations_in_expand(project):
+    p = postgresql_project(project)
+    p.run('migrate', message='online', split=True, offline=True)
+    upgrade, downgrade = [source for name, source in sources(p).items()
+                          if name != 'r1_test.py'][0]
+    # --expand-only builds the index and checks the foreign key
+    assert "phase = 'expand'" in downgrade
+    assert 'postgresql_concurrently=True' in upgrade
+    assert "op.validate_constraint('fk_note_user', 'note')" in upgrade
+
+
+def test_validation_follows_its_constraint(project):
+    p = postgresql_project(project)
+    p.run('migrate', message='fk', offline=True)
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('user_id', sa.Integer, sa.ForeignKey(
+                'user.id', name='fk_note_user', ondelete='CASCADE')),
+            sa.Column('name', sa.String(20), index=True))
+    p.table('tag', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20), index=True))
+    p.run('migrate', message='cascade', split=True, offline=True)
+    contract = [upgrade for upgrade, downgrade in sources(p).values()
+                if "phase = 'contract'" in downgrade]
+    # the foreign key is replaced, and validated after it
+    assert len(contract) == 1
+    assert contract[0].index('op.create_foreign_key') < \
+        contract[0].index("op.validate_constraint('fk_note_user', 'note')")
@@ -0,0 +1,79 @@
+import json
+
+import sqlalchemy as sa
+
+
+def read_phase(path):
+    namespace = {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith('phase = '):
+                exec(line, namespace)
+    return namespace.get('phase')
+
+
+def phases(p):
+    return [read_phase('migrations/versions/' + name)
+            for name in p.revisions()]
+
+
+def test_split_into_expand_and_contract(project, capsys):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)),
+            sa.Column('nickname', sa.String(20)))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)),
+            sa.Column('email', sa.String(50), nullable=False))
+    p.run('migrate', message='email', split=True)
+    assert sorted(phases(p), key=str) == [None, 'contract', 'expand']
+
+    p.run('upgrade', expand_only=True)
+    columns = dict((column['name'], column) for column in
+                   sa.inspect(p.engine).get_columns('user'))
+    # added nullable, the old column is still there
+    assert columns['email']['nullable'] is True
+    assert 'nickname' in columns
+
+    p.run('upgrade')
+    columns = dict((column['name'], column) for column in
+                   sa.inspect(p.engine).get_columns('user'))
+    assert columns['email']['nullable'] is False
+    assert 'nickname' not in columns
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
+
+
+def test_replaced_index_stays_in_contract(project, capsys):
+    p = project()
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20), index=True),
+            sa.Column('body', sa.String(20)))
+    p.run('migrate', message='note')
+    p.run('upgrade')
+
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)),
+            sa.Column('body', sa.String(20)),
+            sa.Column('tag', sa.String(20)))
+    p.Model.metadata.tables['note'].append_constraint(
+        sa.Index('ix_note_name', 'name', 'body'))
+    p.run('migrate', message='index', split=True)
+    assert sorted(phases(p), key=str) == [None, 'contract', 'expand']
+
+    p.run('upgrade', expand_only=True)
+    p.run('upgrade')
+    indexes = sa.inspect(p.engine).get_indexes('note')
+    assert [(index['name'], index['column_names']) for index in indexes] == \
+        [('ix_note_name', ['name', 'body'])]
+    capsys.readouterr()
+    p.run('check')
+    assert json.loads(capsys.readouterr().out)['drift'] is False
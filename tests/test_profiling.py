@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+
+def write_revisions(p):
+    p.write_revision('r1', None, '''
+        op.create_table('user', sa.Column('id', sa.Integer, primary_key=True))
+        op.execute('INSERT INTO user (id) VALUES (1), (2)')
+    ''', downgrade="op.drop_table('user')")
+
+
+def test_profile_file(project):
+    p = project()
+    write_revisions(p)
+    p.run('upgrade', profile='profile.jsonl')
+    p.run('downgrade', profile='profile.jsonl')
+    with open('profile.jsonl') as f:
+        records = [json.loads(line) for line in f]
+
+    statements = [record['statement'].strip() for record in records
+                  if record['type'] == 'statement' and
+                  record['revision'] == 'r1']
+    assert any(s.startswith('CREATE TABLE user') for s in statements)
+    assert any(s.startswith('INSERT INTO user') for s in statements)
+    upgrade, downgrade = [record for record in records
+                          if record['type'] == 'revision']
+    assert (upgrade['direction'], upgrade['ok']) == ('upgrade', True)
+    assert upgrade['rows'] == 2
+    assert downgrade['direction'] == 'downgrade'
+
+
+def test_profile_callback(project):
+    records = []
+    p = project(profile=records.append)
+    write_revisions(p)
+    p.write_revision('r2', 'r1', "raise RuntimeError('failed')")
+    with pytest.raises(SystemExit):
+        p.run('upgrade')
+    revisions = [(record['revision'], record['ok']) for record in records
+                 if record['type'] == 'revision']
+    assert revisions == [('r1', True), ('r2', False)]
+
+
+def test_no_statements_offline(project):
+    records = []
+    p = project(profile=records.append)
+    write_revisions(p)
+    p.run('upgrade', sql=True)
+    assert [record['type'] for record in records] == ['revision']
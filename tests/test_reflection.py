@@ -0,0 +1,70 @@
+import os
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from fastapi_migrate import reflection
+
+
+def test_cache_is_kept_out_of_the_source_tree(project, tmp_path,
+                                              monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    p = project(reflection_cache=True, reflect_models_only=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='note')
+
+    path = reflection.cache_path('migrations')
+    assert path.startswith(str(tmp_path / 'cache' / 'fastapi_migrate'))
+    assert os.path.exists(path)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert not [name for name in os.listdir('migrations')
+                if 'reflection' in name]
+
+    cache = reflection.ReflectionCache('migrations')
+    cache._load()
+    assert cache.entries
+
+
+def test_cache_writable_by_others_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    cache = reflection.ReflectionCache('migrations')
+    cache.entries = {'sqlite://': ('1', {'key': 'value'})}
+    cache.save()
+    os.chmod(cache.path, 0o666)
+
+    cache = reflection.ReflectionCache('migrations')
+    cache._load()
+    assert cache.entries == {}
+
+
+class RecordingConnection(object):
+    """Stands for a PostgreSQL connection; records the queries."""
+    def __init__(self):
+        self.dialect = postgresql.dialect()
+        self.dialect.default_schema_name = 'public'
+        self.queries = []
+
+    def execute(self, query):
+        compiled = query.compile(dialect=self.dialect,
+                                 compile_kwargs={'render_postcompile': True})
+        self.queries.append((str(compiled), compiled.params))
+        return []
+
+
+def test_fingerprint_of_the_model_schemas():
+    connection = RecordingConnection()
+    reflection.schema_fingerprint(connection, {None, 'billing'})
+    assert len(connection.queries) == 3
+    for query, params in connection.queries:
+        assert 'NOT IN' not in query
+        assert sorted(params.values()) == ['billing', 'public']
+
+    connection = RecordingConnection()
+    reflection.schema_fingerprint(connection)
+    for query, params in connection.queries:
+        assert "NOT IN ('information_schema', 'pg_catalog')" in query
+        assert not params
@@ -0,0 +1,56 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from fastapi_migrate import serve
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """A socket in ``db/migrations`` answering every command with exit
+    status 3; yields the requests it received."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(serve.SOCKET_ENV, raising=False)
+    os.makedirs(os.path.join('db', 'migrations'))
+    server = serve._listen(serve.socket_path(os.path.join('db',
+                                                          'migrations')))
+    requests = []
+
+    def accept():
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            with client, client.makefile('rwb') as stream:
+                requests.append(json.loads(stream.readline()))
+                stream.write(json.dumps({'exit': 3}).encode('utf-8') + b'\n')
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    yield requests
+    server.shutdown(socket.SHUT_RDWR)
+    server.close()
+    thread.join(1)
+
+
+def test_forward_to_migrate_directory(daemon):
+    # not listening in the default directory
+    assert serve.forward(['db', 'upgrade']) is None
+    with pytest.raises(SystemExit) as exc:
+        serve.forward(['db', 'upgrade'], directory='db/migrations')
+    assert exc.value.code == 3
+    assert daemon[-1]['args'] == ['upgrade']
+
+
+@pytest.mark.parametrize('args', [['-d', 'db/migrations'],
+                                  ['--directory', 'db/migrations'],
+                                  ['--directory=db/migrations']])
+def test_forward_to_command_directory(daemon, args):
+    with pytest.raises(SystemExit) as exc:
+        serve.forward(['db', 'upgrade'] + args)
+    assert exc.value.code == 3
+    assert daemon[-1]['args'] == ['upgrade'] + args
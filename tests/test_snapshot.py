@@ -0,0 +1,135 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from fastapi_migrate import snapshot
+
+
+def columns(*columns):
+    metadata = sa.MetaData()
+    sa.Table('item', metadata, sa.Column('id', sa.Integer, primary_key=True),
+             *columns)
+    return metadata
+
+
+def round_trip(metadata):
+    return snapshot.to_metadata(json.loads(json.dumps(
+        snapshot.serialize(metadata))))
+
+
+def altered(upgrade_ops):
+    return [op.column_name for table_ops in upgrade_ops.ops
+            for op in table_ops.ops]
+
+
+def test_types_round_trip():
+    metadata = columns(
+        sa.Column('name', sa.String(20, collation='NOCASE')),
+        sa.Column('price', sa.Numeric(10, 2)),
+        sa.Column('at', sa.DateTime(timezone=True)),
+        sa.Column('state', sa.Enum('new', 'done', name='state')),
+        sa.Column('tags', postgresql.ARRAY(sa.String(10))))
+    old = round_trip(metadata)
+    table = old.tables['item']
+    assert repr(table.c.name.type) == "String(length=20, collation='NOCASE')"
+    assert repr(table.c.tags.type) == 'ARRAY(String(length=10))'
+    assert snapshot.compare(old, metadata).is_empty()
+
+
+def test_type_change():
+    old = round_trip(columns(sa.Column('name', sa.String(20))))
+    upgrade_ops = snapshot.compare(
+        old, columns(sa.Column('name', sa.String(50))))
+    op, = upgrade_ops.ops[0].ops
+    assert repr(op.existing_type) == 'String(length=20)'
+    assert repr(op.modify_type) == 'String(length=50)'
+
+
+def test_type_without_stored_arguments_is_not_compared():
+    # a callable has no JSON form
+    metadata = columns(sa.Column('data', sa.PickleType(
+        comparator=lambda a, b: a == b)))
+    data = snapshot.serialize(metadata)
+    assert data['tables'][0]['columns'][1]['type']['exact'] is False
+    old = round_trip(metadata)
+    assert snapshot.compare(old, columns(sa.Column(
+        'data', sa.PickleType(comparator=lambda a, b: a is b)))).is_empty()
+
+
+def test_legacy_snapshot_is_not_evaluated():
+    data = snapshot.serialize(columns(sa.Column('name', sa.String(20)),
+                                      sa.Column('data', sa.Integer)))
+    names = data['tables'][0]['columns'][1:]
+    names[0].update(type='String(length=20)',
+                    type_module='sqlalchemy.sql.sqltypes')
+    names[1].update(type="exec('raise SystemExit')", type_module='builtins')
+    old = snapshot.to_metadata(data)
+    assert repr(old.tables['item'].c.name.type) == 'String(length=20)'
+    assert isinstance(old.tables['item'].c.data.type, sa.types.NullType)
+    upgrade_ops = snapshot.compare(old, columns(
+        sa.Column('name', sa.String(50)), sa.Column('data', sa.Integer)))
+    assert altered(upgrade_ops) == ['name']
+
+
+def test_no_snapshot_by_default(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    with pytest.raises(SystemExit):
+        p.run('migrate', message='again', offline=True)
+
+
+def test_offline_migrate(project):
+    p = project(metadata_snapshot=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)))
+    p.run('migrate', message='user')
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(50)))
+    p.run('migrate', message='longer name', offline=True)
+    first, second = [open('migrations/versions/' + name).read()
+                     for name in p.revisions()]
+    if 'longer name' in first:
+        first, second = second, first
+    assert 'type_=sa.String(length=50)' in second
+    assert 'metadata_snapshot = (' in second
+
+
+def snapshots(p):
+    stored = {}
+    for name in p.revisions():
+        with open('migrations/versions/' + name) as f:
+            stored[name] = 'metadata_snapshot = (' in f.read()
+    return stored
+
+
+def test_no_snapshot_in_empty_revision(project):
+    p = project(metadata_snapshot=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('revision', message='empty')
+    assert list(snapshots(p).values()) == [False]
+    # the models are not in any revision
+    with pytest.raises(SystemExit):
+        p.run('migrate', message='user', offline=True)
+
+    p.run('upgrade')
+    p.run('revision', message='user', autogenerate=True)
+    assert sorted(snapshots(p).values()) == [False, True]
+
+
+def test_snapshot_in_split_revisions(project):
+    p = project(metadata_snapshot=True)
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(20)))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    p.Model.metadata.clear()
+    p.Model.registry.dispose()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('email', sa.String(50)))
+    p.run('migrate', message='email', split=True)
+    assert list(snapshots(p).values()) == [True] * 3
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+
+def write_revisions(p, count, fail=None):
+    down_revision = None
+    for number in range(1, count + 1):
+        revision = 'r%d' % number
+        upgrade = 'op.create_table(%r, sa.Column("id", sa.Integer))' \
+            % ('t%d' % number)
+        if revision == fail:
+            upgrade = 'raise RuntimeError("boom")'
+        p.write_revision(revision, down_revision, upgrade)
+        down_revision = revision
+
+
+def rendered():
+    with open(os.path.join('sql', 'manifest.json')) as f:
+        manifest = json.load(f)
+    return manifest, sorted(os.listdir(os.path.join('sql', 'primary')))
+
+
+def test_render_replaces_earlier_render(project):
+    p = project()
+    write_revisions(p, 3)
+    p.run('upgrade', sql=True, output_dir='sql')
+    assert rendered()[1] == ['0001_r1.sql', '0002_r2.sql', '0003_r3.sql']
+
+    p.run('upgrade', _revision='r1:head', sql=True, output_dir='sql')
+    manifest, files = rendered()
+    assert files == ['0001_r2.sql', '0002_r3.sql']
+    assert manifest['from'] == 'r1'
+    assert sorted(os.listdir('.')) == ['migrations', 'sql']
+
+
+def test_failed_render_leaves_output_dir(project):
+    p = project()
+    write_revisions(p, 2)
+    p.run('upgrade', sql=True, output_dir='sql')
+    before = rendered()
+
+    write_revisions(p, 3, fail='r3')
+    with pytest.raises(SystemExit):
+        p.run('upgrade', sql=True, output_dir='sql')
+    assert rendered() == before
+    assert sorted(os.listdir('.')) == ['migrations', 'sql']
+
+
+def test_refuse_other_directory(project):
+    p = project()
+    write_revisions(p, 1)
+    os.makedirs('sql')
+    with open(os.path.join('sql', 'notes.txt'), 'w') as f:
+        f.write('mine')
+    with pytest.raises(SystemExit):
+        p.run('upgrade', sql=True, output_dir='sql')
+    assert os.listdir('sql') == ['notes.txt']
@@ -0,0 +1,86 @@
+import pytest
+import sqlalchemy as sa
+from alembic.util import CommandError
+from sqlalchemy import event
+
+
+def test_status_of_a_new_database(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    revision = p.revisions()[0].split('_')[0]
+
+    status = p.migrate.status()
+    assert status.current == ()
+    assert status.pending == [revision]
+    assert not p.migrate.is_up_to_date()
+
+    p.run('upgrade')
+    assert p.migrate.status().current == (revision,)
+    assert p.migrate.pending_revisions() == []
+    assert p.migrate.is_up_to_date()
+
+
+def test_status_of_an_unreachable_database(project, tmp_path):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.migrate._migrate_config.db_uri = 'sqlite:///%s' % (
+        tmp_path / 'missing' / 'app.db')
+    with pytest.raises(sa.exc.OperationalError):
+        p.migrate.status()
+    with pytest.raises(SystemExit) as exc:
+        p.run('analyze')
+    assert exc.value.code == 1
+
+
+def test_status_inside_a_transaction(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    with p.engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE other (id INTEGER)')
+        assert p.migrate.status(connection).current == ()
+        assert connection.in_transaction()
+    assert 'other' in p.tables()
+
+
+def test_status_is_one_query(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    statements = []
+    event.listen(p.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args:
+                 statements.append(statement))
+    assert p.migrate.is_up_to_date(p.engine)
+    assert len(statements) == 1
+
+
+def test_status_at_an_unknown_revision(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    p.execute("UPDATE alembic_version SET version_num = 'newer'")
+    with pytest.raises(CommandError, match='newer'):
+        p.migrate.is_up_to_date()
+
+
+def test_status_sees_new_revisions(project):
+    p = project()
+    p.table('user', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='user')
+    p.run('upgrade')
+    assert p.migrate.is_up_to_date()
+    graph = p.migrate._revision_graph
+
+    p.table('note', sa.Column('id', sa.Integer, primary_key=True))
+    p.run('migrate', message='note')
+    assert len(p.migrate.pending_revisions()) == 1
+    assert p.migrate._revision_graph is not graph
+    graph = p.migrate._revision_graph
+    assert p.migrate.pending_revisions()
+    # unchanged files, the graph is kept
+    assert p.migrate._revision_graph is graph
@@ -0,0 +1,41 @@
+import sqlalchemy as sa
+
+from fastapi_migrate.tenants import Tenant
+from fastapi_migrate.tenants import _engine
+
+
+def write_revision(p):
+    p.write_revision('r1', None, 'op.create_table("note", '
+                     'sa.Column("id", sa.Integer))')
+
+
+def tables(name):
+    engine = sa.create_engine('sqlite:///%s.db' % name)
+    try:
+        return set(sa.inspect(engine).get_table_names())
+    finally:
+        engine.dispose()
+
+
+def test_upgrade_tenants(project, capsys):
+    p = project()
+    write_revision(p)
+    p.migrate.tenants(lambda: [Tenant(name, db_uri='sqlite:///%s.db' % name)
+                               for name in ('acme', 'globex')])
+    p.run('upgrade', tenants=True, concurrency=2)
+    assert 'note' in tables('acme') and 'note' in tables('globex')
+    assert '2 tenants upgraded, 0 failed' in capsys.readouterr().out
+
+
+def test_upgrade_async_tenants(project, capsys):
+    p = project(async_=True, db_uri='sqlite+aiosqlite:///app.db')
+    # with the async driver of the application
+    assert hasattr(_engine(p.app.extra['migrate'], Tenant('acme')),
+                   'sync_engine')
+    write_revision(p)
+    p.migrate.tenants(lambda: [
+        Tenant(name, db_uri='sqlite+aiosqlite:///%s.db' % name)
+        for name in ('acme', 'globex')])
+    p.run('upgrade', tenants=True, concurrency=2)
+    assert 'note' in tables('acme') and 'note' in tables('globex')
+    assert '2 tenants upgraded, 0 failed' in capsys.readouterr().out
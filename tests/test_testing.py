@@ -0,0 +1,61 @@
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic.util import CommandError
+from sqlalchemy.engine import make_url
+
+from fastapi_migrate.testing import TemplateDatabase
+
+
+def tables(url):
+    engine = sa.create_engine(url, poolclass=sa.pool.NullPool)
+    try:
+        return set(sa.inspect(engine).get_table_names())
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def templates(project, tmp_path):
+    p = project()
+    p.write_revision('r1', None, """
+        op.create_table('user', sa.Column('id', sa.Integer, primary_key=True))
+    """)
+    templates = TemplateDatabase(p.migrate,
+                                 cache_dir=str(tmp_path / 'templates'))
+    templates.project = p
+    return templates
+
+
+def test_clone_and_drop(templates):
+    first, second = templates.clone(), templates.clone()
+    assert first != second
+    assert tables(first) == {'alembic_version', 'user'}
+    # the application database is left alone
+    assert templates.project.tables() == set()
+
+    templates.drop(first)
+    assert not os.path.exists(make_url(first).database)
+    assert os.path.exists(make_url(second).database)
+
+
+def test_template_follows_the_revisions(templates):
+    template = templates.template()
+    assert TemplateDatabase(templates.migrate, cache_dir=templates.cache_dir
+                            ).template() == template
+
+    templates.project.write_revision('r2', 'r1', """
+        op.create_table('note', sa.Column('id', sa.Integer, primary_key=True))
+    """)
+    rebuilt = TemplateDatabase(templates.migrate,
+                               cache_dir=templates.cache_dir)
+    assert rebuilt.template() != template
+    assert not os.path.exists(make_url(template).database)
+    assert 'note' in tables(rebuilt.clone())
+
+
+def test_unsupported_backend(project):
+    p = project()
+    with pytest.raises(CommandError):
+        TemplateDatabase(p.migrate, url='mysql://localhost/app')
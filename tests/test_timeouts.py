@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+
+def locked(p, seconds=None):
+    """Hold the write lock of the database, for ``seconds`` or until
+    closed."""
+    connection = sqlite3.connect(p.db_path, isolation_level=None,
+                                 check_same_thread=False)
+    connection.execute('BEGIN IMMEDIATE')
+    if seconds is not None:
+        threading.Timer(seconds, connection.rollback).start()
+    return connection
+
+
+def write_revisions(p):
+    p.write_revision('r1', None, 'op.create_table("user", '
+                     'sa.Column("id", sa.Integer))')
+    p.write_revision('r2', 'r1', 'op.create_table("note", '
+                     'sa.Column("id", sa.Integer))')
+
+
+def test_retried_until_the_lock_is_released(project, capsys):
+    p = project(lock_timeout=0.05, lock_retries=10, lock_retry_delay=0.1)
+    write_revisions(p)
+    p.run('upgrade', _revision='r1')
+    connection = locked(p, 0.3)
+    try:
+        p.run('upgrade')
+    finally:
+        connection.close()
+    assert 'note' in p.tables()
+    err = capsys.readouterr().err
+    assert 'r2 timed out waiting for a lock, retry 1 of 10' in err
+    assert 'Lock timeouts: r2 needed' in err
+
+
+def test_gives_up(project, capsys):
+    p = project(lock_timeout=0.05, lock_retries=2, lock_retry_delay=0.05)
+    write_revisions(p)
+    p.run('upgrade', _revision='r1')
+    connection = locked(p)
+    try:
+        with pytest.raises(sa.exc.OperationalError, match='locked'):
+            p.run('upgrade')
+    finally:
+        connection.close()
+    assert 'note' not in p.tables()
+    assert 'r2 gave up after 2 retries' in capsys.readouterr().err